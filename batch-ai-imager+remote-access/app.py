@@ -3,17 +3,21 @@ import os
 import pandas as pd
 from datetime import datetime
 import time
-from image_processor import process_image_folder, process_single_image
-from utils import get_all_image_files, is_valid_image
+from utils import get_all_image_files
 import database as db
+from folder_sync import sync_folder
 from history_page import show_history_page
 from search_page import show_search_page
 from dashboard_page import show_dashboard_page
 from onboarding_tour import show_onboarding_tour
 from clustering_page import show_clustering_page
 from comparison_page import show_comparison_page
+from map_page import show_map_page
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
+# Seconds between progress checks while a queued job is running
+JOB_POLL_INTERVAL = 2
+
 # Set page config
 st.set_page_config(
     page_title="AI Image Analyzer",
@@ -21,6 +25,16 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def migrate_schema():
+    """
+    Apply pending schema migrations once per server process, not per rerun
+    """
+    from migrations import migrate
+    migrate()
+
+migrate_schema()
+
 # Load custom CSS
 with open("custom_styles.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
@@ -42,6 +56,8 @@ if 'tour_step' not in st.session_state:
     st.session_state.tour_step = 1
 if 'tour_completed' not in st.session_state:
     st.session_state.tour_completed = False
+if 'active_job_id' not in st.session_state:
+    st.session_state.active_job_id = None
     
 # Check if first launch - show onboarding
 first_launch = 'first_launch' not in st.session_state
@@ -86,7 +102,7 @@ with col4:
         st.rerun()
 
 # Second row for additional features
-col1, col2, col3 = st.columns(3)
+col1, col2, col3, col4 = st.columns(4)
 with col1:
     if st.button("Image Clusters", use_container_width=True):
         st.session_state.current_page = "clusters"
@@ -96,6 +112,10 @@ with col2:
         st.session_state.current_page = "compare"
         st.rerun()
 with col3:
+    if st.button("Photo Map", use_container_width=True):
+        st.session_state.current_page = "map"
+        st.rerun()
+with col4:
     if st.button("Download Code", use_container_width=True):
         # Redirect to the code download page
         import streamlit as st
@@ -143,6 +163,9 @@ with st.sidebar:
                 if saved_files:
                     st.session_state.processing = True
                     st.session_state.results = None
+                    st.session_state.processing_summary = None
+                    st.session_state.sync_summary = None
+                    st.session_state.active_job_id = None
                     st.session_state.processed_images = {}
                     st.session_state.selected_image = None
                     st.session_state.upload_files = saved_files
@@ -169,9 +192,11 @@ with st.sidebar:
 
                 if selected_folder:
                     folder_path = os.path.join(parent_dir, selected_folder)
+                    include_subfolders = st.checkbox("Include subfolders", value=False,
+                                                     help="Also analyze images in nested folders")
 
                     # Count images in the folder
-                    image_files = get_all_image_files(folder_path)
+                    image_files = get_all_image_files(folder_path, recursive=include_subfolders)
 
                     if image_files:
                         st.info(f"Found {len(image_files)} images in this folder")
@@ -182,7 +207,12 @@ with st.sidebar:
                         # Process button
                         if st.button("Process Folder", use_container_width=True, disabled=st.session_state.processing):
                             st.session_state.processing = True
+                            st.session_state.selected_folder = selected_folder
+                            st.session_state.include_subfolders = include_subfolders
                             st.session_state.results = None
+                            st.session_state.processing_summary = None
+                            st.session_state.sync_summary = None
+                            st.session_state.active_job_id = None
                             st.session_state.processed_images = {}
                             st.session_state.selected_image = None
                             st.rerun()
@@ -194,6 +224,31 @@ with st.sidebar:
             if parent_dir:
                 st.error("Directory not found. Please enter a valid path")
 
+# List queued and interrupted jobs so their progress can be followed again
+with st.sidebar:
+    unfinished_jobs = db.get_unfinished_jobs()
+    if unfinished_jobs:
+        st.subheader("Unfinished Jobs")
+        for unfinished_job in unfinished_jobs[:5]:
+            job_progress = db.get_job_progress(unfinished_job.id)
+            st.caption(
+                f"{unfinished_job.name}: {job_progress[db.ITEM_DONE]} of {unfinished_job.total_items} done, "
+                f"{job_progress[db.ITEM_FAILED]} failed"
+            )
+            if st.button(f"Resume {unfinished_job.name}", key=f"resume_job_{unfinished_job.id}",
+                         use_container_width=True, disabled=st.session_state.processing):
+                # Retry failed items and follow the job's progress
+                db.requeue_job(unfinished_job.id)
+                st.session_state.active_job_id = unfinished_job.id
+                st.session_state.processing = True
+                st.session_state.results = None
+                st.session_state.processing_summary = None
+                st.session_state.sync_summary = None
+                st.session_state.processed_images = {}
+                st.session_state.selected_image = None
+                st.session_state.current_page = "process"
+                st.rerun()
+
 # Add Tour button in sidebar if tour completed
 with st.sidebar:
     if st.session_state.tour_completed:
@@ -214,25 +269,22 @@ elif st.session_state.current_page == "clusters":
     show_clustering_page()
 elif st.session_state.current_page == "compare":
     show_comparison_page()
+elif st.session_state.current_page == "map":
+    show_map_page()
 elif st.session_state.current_page == "onboarding":
     show_onboarding_tour()
 else:  # Process page (default)
-    # Main content area for processing
-    if st.session_state.processing and st.session_state.current_folder:
+    # Main content area for processing. The app only enqueues jobs; the
+    # analysis itself runs in background workers (python worker.py).
+    if st.session_state.processing and not st.session_state.get('active_job_id'):
         # Check if we have uploaded files to process
         if 'upload_files' in st.session_state and st.session_state.upload_files:
             image_files = st.session_state.upload_files
             folder_name = "Uploaded_Images"
             full_folder_path = st.session_state.upload_dir
         else:
-            # Find folder with images from directory selection
-            selected_folder = ""
-            for d in os.listdir(st.session_state.current_folder):
-                if os.path.isdir(os.path.join(st.session_state.current_folder, d)):
-                    if get_all_image_files(os.path.join(st.session_state.current_folder, d)):
-                        selected_folder = d
-                        break
-
+            # Use the folder chosen in the directory selection
+            selected_folder = st.session_state.get('selected_folder')
             if not selected_folder:
                 st.error("Could not find a folder with valid images")
                 st.session_state.processing = False
@@ -241,91 +293,112 @@ else:  # Process page (default)
             full_folder_path = os.path.join(st.session_state.current_folder, selected_folder)
             folder_name = selected_folder
             # Get all images in the folder
-            image_files = get_all_image_files(full_folder_path)
-
-        # Display processing status
-        with st.spinner("Processing images... This may take a while depending on the number of images."):
-            # Create progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            total_images = len(image_files)
-
-            if total_images > 0:
-                results = []
-
-                # Process each image
-                # Add folder to database
-                db_folder = db.add_folder(folder_name, full_folder_path)
-
-                for i, img_path in enumerate(image_files):
-                    try:
-                        # Update progress
-                        progress = (i + 1) / total_images
-                        progress_bar.progress(progress)
-                        status_text.text(f"Processing image {i+1} of {total_images}: {os.path.basename(img_path)}")
-
-                        # Check if image already exists in database
-                        existing_image = db.get_image_by_path(img_path)
-                        if existing_image:
-                            # Use existing result
-                            result = {
-                                "object_name": existing_image.object_name,
-                                "description": existing_image.description,
-                                "confidence": existing_image.confidence
-                            }
-                        else:
-                            # Process the image
-                            result = process_single_image(img_path)
-
-                            # Save to database
-                            db.add_image_result(
-                                folder_id=db_folder.id,
-                                file_name=os.path.basename(img_path),
-                                file_path=img_path,
-                                object_name=result.get("object_name", "Unknown"),
-                                description=result.get("description", "No description available"),
-                                confidence=result.get("confidence", 0),
-                                metadata=result.get("metadata", {})
-                            )
-
-                        # Store result
-                        result_with_path = {
-                            "file_path": img_path,
-                            "file_name": os.path.basename(img_path),
-                            "object_name": result.get("object_name", "Unknown"),
-                            "description": result.get("description", "No description available"),
-                            "confidence": result.get("confidence", 0)
-                        }
-                        results.append(result_with_path)
-
-                        # Store in session state
-                        st.session_state.processed_images[img_path] = result
-
-                    except Exception as e:
-                        st.error(f"Error processing {os.path.basename(img_path)}: {str(e)}")
-                        # Add error entry
-                        results.append({
-                            "file_path": img_path,
-                            "file_name": os.path.basename(img_path),
-                            "object_name": "Error",
-                            "description": f"Failed to process: {str(e)}",
-                            "confidence": 0
-                        })
-
-                # Convert results to DataFrame
-                df = pd.DataFrame(results)
-
-                # Store results in session state
-                st.session_state.results = df
-            else:
-                st.warning("No valid images found in the selected folder")
+            image_files = get_all_image_files(full_folder_path,
+                                              recursive=st.session_state.get('include_subfolders', False))
 
-        # Reset processing flag
-        st.session_state.processing = False
         # Clean up upload files reference if it exists
         if 'upload_files' in st.session_state:
             del st.session_state.upload_files
+
+        if image_files:
+            # Add folder to database, then queue only new or changed files for the workers
+            db_folder = db.add_folder(folder_name, full_folder_path)
+            sync_summary = sync_folder(db_folder.id, image_files)
+            st.session_state.sync_summary = sync_summary
+            to_process = sync_summary['new'] + sync_summary['changed']
+            if to_process:
+                job = db.create_processing_job(db_folder.id, folder_name, to_process)
+                st.session_state.active_job_id = job.id
+            else:
+                st.session_state.processing = False
+        else:
+            st.warning("No valid images found in the selected folder")
+            st.session_state.processing = False
+        st.rerun()
+
+    sync_summary = st.session_state.get('sync_summary')
+    if sync_summary:
+        if not sync_summary['new'] and not sync_summary['changed']:
+            st.success(f"Folder is up to date: {sync_summary['unchanged']} images unchanged since the last run")
+        st.caption(
+            f"Folder sync: {len(sync_summary['new'])} new, {len(sync_summary['changed'])} changed, "
+            f"{sync_summary['unchanged']} unchanged, {sync_summary['missing']} deleted from disk"
+        )
+
+    if st.session_state.processing and st.session_state.get('active_job_id'):
+        # Poll the queued job's progress
+        job_id = st.session_state.active_job_id
+        job = db.get_processing_job(job_id)
+        job_progress = db.get_job_progress(job_id)
+        finished = job_progress[db.ITEM_DONE] + job_progress[db.ITEM_FAILED]
+        remaining = job_progress[db.ITEM_PENDING] + job_progress[db.ITEM_IN_FLIGHT]
+
+        st.subheader(f"Processing {job.name}")
+        st.progress(finished / job.total_items if job.total_items else 1.0)
+        st.text(
+            f"Processed {finished} of {job.total_items} images "
+            f"({job_progress[db.ITEM_FAILED]} failed, {job_progress[db.ITEM_IN_FLIGHT]} in progress)"
+            + (f" - {job.images_per_second:.2f} images/sec" if job.images_per_second else "")
+        )
+
+        if remaining:
+            if job_progress[db.ITEM_IN_FLIGHT] == 0 and finished == 0:
+                st.info("Waiting for a worker to pick up this job. Start one with: python worker.py")
+            if st.button("Stop Watching"):
+                # The job keeps running in the background and stays listed under Unfinished Jobs
+                st.session_state.processing = False
+                st.session_state.active_job_id = None
+                st.rerun()
+            time.sleep(JOB_POLL_INTERVAL)
+            st.rerun()
+
+        # Job finished: load its results from the database
+        items = db.get_job_items(job_id)
+        stored_images = db.get_images_by_paths([item.file_path for item in items])
+        results = []
+        for item in items:
+            img = stored_images.get(item.file_path)
+            if item.state == db.ITEM_DONE and img:
+                result = {
+                    "object_name": img.object_name,
+                    "description": img.description,
+                    "confidence": img.confidence
+                }
+                st.session_state.processed_images[item.file_path] = result
+            else:
+                result = {
+                    "object_name": "Error",
+                    "description": f"Failed to process: {item.error or 'unknown error'}",
+                    "confidence": 0
+                }
+            results.append({
+                "file_path": item.file_path,
+                "file_name": os.path.basename(item.file_path),
+                **result
+            })
+
+        # Convert results to DataFrame
+        df = pd.DataFrame(results)
+
+        # Summarise how much work the caches saved
+        sources = db.get_job_source_counts(job_id)
+        new_images = job.total_items - sources['stored']
+        st.session_state.processing_summary = {
+            "total": job.total_items,
+            "already_stored": sources['stored'],
+            "cache_hits": sources['cache'],
+            "analyzed": sources['analyzed'] + job_progress[db.ITEM_FAILED],
+            "failed": job_progress[db.ITEM_FAILED],
+            "cache_hit_rate": sources['cache'] / new_images if new_images else 0.0,
+            "images_per_second": job.images_per_second or 0.0
+        }
+
+        # Store results in session state
+        st.session_state.results = df
+
+        # Reset processing flag
+        st.session_state.processing = False
+        st.session_state.active_job_id = None
         st.rerun()
 
     # Display results
@@ -337,6 +410,15 @@ else:  # Process page (default)
             # Display summary table
             st.subheader("Analysis Results")
 
+            summary = st.session_state.get("processing_summary")
+            if summary:
+                st.info(
+                    f"{summary['total']} images: {summary['already_stored']} already in database, "
+                    f"{summary['cache_hits']} matched by content hash, {summary['analyzed']} sent for analysis "
+                    f"({summary['failed']} failed). Content cache hit rate: {summary['cache_hit_rate']:.0%}. "
+                    f"Job throughput: {summary['images_per_second']:.2f} images/sec"
+                )
+
             # Convert DataFrame for display (hide file_path column)
             display_df = st.session_state.results.copy()
 
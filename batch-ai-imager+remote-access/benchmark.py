@@ -0,0 +1,1622 @@
+"""
+Performance benchmarks for the AI Image Analyzer
+
+Run a benchmark with:
+
+    python benchmark.py concurrency --images 32 --latency 0.5
+
+Benchmarks that talk to OpenAI use a local fake chat-completions server, so
+no API key or network access is needed.
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class ServerQuota:
+    """
+    Requests-per-minute quota enforced by the fake server
+    """
+    def __init__(self, requests_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """
+        Returns (allowed, remaining, reset_seconds)
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 60.0:
+                self.window_start = now
+                self.used = 0
+            reset = 60.0 - (now - self.window_start)
+            if self.used >= self.requests_per_minute:
+                self.rejected += 1
+                return False, 0, reset
+            self.used += 1
+            return True, self.requests_per_minute - self.used, reset
+
+class FakeChatCompletionsHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the OpenAI chat completions endpoint
+    """
+    latency = 0.5
+    quota = None
+
+    def do_POST(self):
+        # Drain the request body (the base64 image) before answering
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        rate_headers = {}
+        if self.quota is not None:
+            allowed, remaining, reset = self.quota.admit()
+            rate_headers = {
+                "x-ratelimit-limit-requests": str(self.quota.requests_per_minute),
+                "x-ratelimit-remaining-requests": str(remaining),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }
+            if not allowed:
+                body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode("utf-8")
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("retry-after", f"{reset:.3f}")
+                for name, value in rate_headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+        # Simulate model latency
+        time.sleep(self.latency)
+
+        content = json.dumps({
+            "object_name": "Test object",
+            "description": "A synthetic response from the fake server",
+            "confidence": 0.9
+        })
+        body = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in rate_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+def start_fake_openai_server(latency, quota=None):
+    """
+    Start the fake chat-completions server in a background thread
+
+    Args:
+        latency: Seconds each request takes
+        quota: Optional ServerQuota; requests over quota get HTTP 429
+
+    Returns:
+        tuple: (server, base_url)
+    """
+    handler = type("Handler", (FakeChatCompletionsHandler,), {"latency": latency, "quota": quota})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def create_sample_images(folder, count, size=(640, 480)):
+    """
+    Write ``count`` small JPEG images into ``folder`` and return their paths
+    """
+    from PIL import Image
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"sample_{i:05d}.jpg")
+        Image.new("RGB", size, ((i * 37) % 256, (i * 73) % 256, (i * 11) % 256)).save(path, "JPEG")
+        paths.append(path)
+    return paths
+
+def benchmark_concurrency(args):
+    """
+    Measure analysis throughput against the fake server for several worker counts
+    """
+    server, base_url = start_fake_openai_server(args.latency)
+
+    # The OpenAI client reads these when image_processor is imported
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    import rate_limiter
+    from image_processor import process_images_concurrently
+
+    # Measure concurrency alone; benchmark_rate_limit covers the quota
+    rate_limiter._shared_limiter = rate_limiter.RateLimiter(
+        requests_per_minute=1000000,
+        tokens_per_minute=1000000000,
+        max_concurrency=max(args.workers)
+    )
+
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = create_sample_images(folder, args.images)
+
+            print(f"{args.images} images, {args.latency:.2f}s simulated latency per request")
+            print(f"{'workers':>8} {'seconds':>9} {'img/sec':>9} {'speedup':>9}")
+
+            baseline = None
+            for workers in args.workers:
+                start = time.perf_counter()
+                results = process_images_concurrently(paths, max_workers=workers)
+                elapsed = time.perf_counter() - start
+
+                errors = sum(1 for r in results if r["object_name"] == "Error")
+                if baseline is None:
+                    baseline = elapsed
+                print(f"{workers:>8} {elapsed:>9.2f} {len(paths) / elapsed:>9.1f} {baseline / elapsed:>8.1f}x"
+                      + (f"  ({errors} errors)" if errors else ""))
+    finally:
+        server.shutdown()
+
+def benchmark_rate_limit(args):
+    """
+    Run more images than the quota allows and report throughput and 429s
+    """
+    quota = ServerQuota(args.server_rpm)
+    server, base_url = start_fake_openai_server(args.latency, quota)
+
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    import rate_limiter
+    from image_processor import process_images_concurrently
+
+    # Configure the shared limiter before any request is made
+    rate_limiter._shared_limiter = rate_limiter.RateLimiter(
+        requests_per_minute=args.client_rpm,
+        tokens_per_minute=args.client_tpm,
+        max_concurrency=args.workers,
+        base_backoff=0.5
+    )
+
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = create_sample_images(folder, args.images)
+
+            start = time.perf_counter()
+            results = process_images_concurrently(paths, max_workers=args.workers)
+            elapsed = time.perf_counter() - start
+
+            stats = rate_limiter.get_shared_limiter().stats()
+            errors = sum(1 for r in results if r["object_name"] == "Error")
+            print(f"server quota: {args.server_rpm} req/min, client limit: {args.client_rpm} req/min")
+            print(f"{len(paths)} images in {elapsed:.2f}s ({len(paths) / elapsed * 60:.0f} img/min)")
+            print(f"429 responses: {quota.rejected}, retries: {stats['throttled']}, failed images: {errors}")
+            print(f"final concurrency limit: {stats['concurrency_limit']}")
+    finally:
+        server.shutdown()
+
+def create_photo_like_images(folder, count, size=(4032, 3024)):
+    """
+    Write ``count`` noisy full-resolution JPEGs that compress like real photos
+    """
+    from PIL import Image
+
+    paths = []
+    for i in range(count):
+        channels = [Image.effect_noise(size, 40 + i * 5).point(lambda v, o=offset: (v + o) % 256)
+                    for offset in (0, 85, 170)]
+        path = os.path.join(folder, f"photo_{i:05d}.jpg")
+        Image.merge("RGB", channels).save(path, "JPEG", quality=95)
+        paths.append(path)
+    return paths
+
+def benchmark_preprocess(args):
+    """
+    Report upload bytes and estimated image tokens saved by preprocessing
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from PIL import Image
+    from utils import get_all_image_files
+    from image_processor import preprocess_image_for_upload, estimate_image_tokens
+
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = get_all_image_files(args.folder) if args.folder else create_photo_like_images(scratch, args.images)
+        if not paths:
+            print("No images found")
+            return
+
+        print(f"{'file':<28} {'original':>10} {'upload':>10} {'saved':>7} {'tokens':>13} {'ms':>7}")
+        total_original = total_upload = total_tokens_before = total_tokens_after = 0
+        for path in paths:
+            # Raw upload: the file bytes, base64-inflated
+            original = base64_size(os.path.getsize(path))
+            with Image.open(path) as img:
+                tokens_before = estimate_image_tokens(img.width, img.height, args.detail)
+
+            start = time.perf_counter()
+            data, _, size = preprocess_image_for_upload(
+                path, max_edge=args.max_edge, image_format=args.format,
+                quality=args.quality, detail=args.detail
+            )
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            upload = base64_size(len(data))
+            tokens_after = estimate_image_tokens(size[0], size[1], args.detail)
+
+            total_original += original
+            total_upload += upload
+            total_tokens_before += tokens_before
+            total_tokens_after += tokens_after
+            print(f"{os.path.basename(path)[:28]:<28} {original:>10,} {upload:>10,} "
+                  f"{1 - upload / original:>6.0%} {tokens_before:>6}->{tokens_after:<6} {elapsed_ms:>7.1f}")
+
+        print(f"\n{len(paths)} images: {total_original:,} -> {total_upload:,} bytes uploaded "
+              f"({1 - total_upload / total_original:.0%} saved, {(total_original - total_upload) / len(paths):,.0f} bytes/image)")
+        print(f"estimated image tokens: {total_tokens_before:,} -> {total_tokens_after:,}")
+
+def base64_size(byte_count):
+    """
+    Size of ``byte_count`` bytes once base64 encoded
+    """
+    return 4 * ((byte_count + 2) // 3)
+
+def create_mixed_format_images(folder, count, size=(1600, 1200)):
+    """
+    Write ``count`` images cycling through JPEG (with EXIF), PNG and HEIC
+    """
+    from PIL import Image
+    import utils  # registers the HEIF opener
+
+    exif = Image.Exif()
+    exif[0x010F] = "Benchmark"      # Make
+    exif[0x0110] = "Synthetic 1"    # Model
+
+    paths = []
+    for i in range(count):
+        img = Image.new("RGB", size, ((i * 37) % 256, (i * 73) % 256, (i * 11) % 256))
+        kind = i % 3
+        if kind == 0:
+            path = os.path.join(folder, f"mixed_{i:05d}.jpg")
+            img.save(path, "JPEG", exif=exif)
+        elif kind == 1:
+            path = os.path.join(folder, f"mixed_{i:05d}.png")
+            img.save(path, "PNG")
+        else:
+            path = os.path.join(folder, f"mixed_{i:05d}.heic")
+            img.save(path, "HEIF")
+        paths.append(path)
+    return paths
+
+def _legacy_probe_sequence(path):
+    """
+    The per-file work done before probe_image: two validity checks, a
+    dimensions open and a separate exifread pass
+    """
+    import exifread
+    from PIL import Image
+
+    for _ in range(2):
+        with Image.open(path) as img:
+            img.size
+    with Image.open(path) as img:
+        img.size
+    with open(path, "rb") as f:
+        exifread.process_file(f, details=False)
+
+def benchmark_probe(args):
+    """
+    Compare per-file probing cost before and after the single-open probe
+    """
+    import logging
+    import utils
+
+    # exifread logs a warning for every file without EXIF data
+    logging.getLogger("exifread").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = utils.get_all_image_files(args.folder) if args.folder else create_mixed_format_images(scratch, args.images)
+        if not paths:
+            print("No images found")
+            return
+
+        by_format = {}
+        for path in paths:
+            by_format.setdefault(os.path.splitext(path)[1].lower(), []).append(path)
+
+        print(f"{'format':<8} {'files':>6} {'before ms/file':>15} {'after ms/file':>14} {'speedup':>8}")
+        for ext, group in sorted(by_format.items()):
+            start = time.perf_counter()
+            for path in group:
+                _legacy_probe_sequence(path)
+            before = (time.perf_counter() - start) / len(group) * 1000
+
+            utils.clear_probe_cache()
+            start = time.perf_counter()
+            for path in group:
+                # Same call pattern as the pipeline: listing, validation, metadata
+                utils.is_valid_image(path)
+                utils.is_valid_image(path)
+                utils.extract_image_metadata(path)
+            after = (time.perf_counter() - start) / len(group) * 1000
+
+            print(f"{ext:<8} {len(group):>6} {before:>15.2f} {after:>14.2f} {before / after:>7.1f}x")
+
+def _open_database(args, scratch_url):
+    """
+    Point the database module at a benchmark database and bring its schema
+    up to date
+
+    Benchmarks seed and delete rows, so they never use the DATABASE_URL of
+    the environment; they run against ``scratch_url`` unless another
+    database is named explicitly with --database-url.
+
+    Args:
+        args: Parsed command-line arguments
+        scratch_url: URL of the throwaway database to use by default
+
+    Returns:
+        module: The database module
+    """
+    import database as db
+    from migrations import migrate
+
+    url = getattr(args, "database_url", None) or scratch_url
+    os.environ["DATABASE_URL"] = url
+    db.remove_session()
+    if db._engine is not None:
+        db._engine.dispose()
+    db._engine = None
+    db.DATABASE_URL = url
+    migrate()
+    return db
+
+def create_image_tree(root, folders, per_folder, depth=2):
+    """
+    Write a nested folder tree of tiny JPEGs plus non-image files
+    """
+    from PIL import Image
+
+    img = Image.new("RGB", (16, 16), (120, 80, 40))
+    for i in range(folders):
+        folder = os.path.join(root, *[f"level{d}_{i % (d + 2)}" for d in range(depth)], f"folder_{i:04d}")
+        os.makedirs(folder, exist_ok=True)
+        for j in range(per_folder):
+            img.save(os.path.join(folder, f"img_{j:05d}.jpg"), "JPEG")
+        with open(os.path.join(folder, "notes.txt"), "w") as f:
+            f.write("not an image")
+
+def _legacy_scan(root):
+    """
+    The previous discovery pattern: list each directory level and open every
+    file to validate it
+    """
+    from PIL import Image
+
+    found = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                with Image.open(path) as img:
+                    img.size
+                found.append(path)
+            except Exception:
+                pass
+    return found
+
+def benchmark_scan(args):
+    """
+    Compare time-to-first-image and full-tree scan time before and after
+    the streaming scanner
+    """
+    import utils
+
+    with tempfile.TemporaryDirectory() as scratch:
+        root = args.folder
+        if not root:
+            root = scratch
+            create_image_tree(root, args.folders, args.per_folder)
+
+        start = time.perf_counter()
+        legacy = _legacy_scan(root)
+        legacy_total = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanner = utils.iter_image_files(root)
+        first = next(scanner, None)
+        time_to_first = time.perf_counter() - start
+        count = (1 if first else 0) + sum(1 for _ in scanner)
+        scan_total = time.perf_counter() - start
+
+        print(f"{'scanner':<18} {'images':>7} {'first image s':>14} {'full tree s':>12}")
+        # The old pipeline only started analyzing once the whole listing was done
+        print(f"{'listdir + open':<18} {len(legacy):>7} {legacy_total:>14.3f} {legacy_total:>12.3f}")
+        print(f"{'iter_image_files':<18} {count:>7} {time_to_first:>14.4f} {scan_total:>12.3f}")
+
+def benchmark_sync(args):
+    """
+    Time an incremental re-scan of an unchanged folder against the old
+    one-SELECT-per-file check
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'sync.db')}")
+        import utils
+        from folder_sync import sync_folder
+
+        root = os.path.join(scratch, "images")
+        per_folder = max(1, args.images // args.folders)
+        create_image_tree(root, args.folders, per_folder)
+        paths = utils.get_all_image_files(root, recursive=True)
+
+        # Record every file as already analyzed
+        folder = db.add_folder("sync-benchmark", root)
+        rows = []
+        for path in paths:
+            stat = os.stat(path)
+            rows.append({
+                "folder_id": folder.id, "file_name": os.path.basename(path), "file_path": path,
+                "object_name": "Synthetic", "description": "", "confidence": 1.0,
+                "file_size": stat.st_size, "file_mtime": stat.st_mtime, "missing": False,
+            })
+        with db.session_scope() as session:
+            session.bulk_insert_mappings(db.Image, rows)
+
+        start = time.perf_counter()
+        for path in paths:
+            db.get_image_by_path(path)
+        per_file = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanned = utils.get_all_image_files(root, recursive=True)
+        summary = sync_folder(folder.id, scanned)
+        incremental = time.perf_counter() - start
+
+        print(f"{len(paths)} images, {summary['unchanged']} unchanged, "
+              f"{len(summary['new']) + len(summary['changed'])} to analyze")
+        print(f"{'per-file SELECT':<22} {per_file:>8.2f}s")
+        print(f"{'scan + manifest sync':<22} {incremental:>8.2f}s")
+
+def _synthetic_result_row(folder_id, prefix, i):
+    return {
+        "folder_id": folder_id,
+        "file_name": f"img_{i:06d}.jpg",
+        "file_path": f"{prefix}/img_{i:06d}.jpg",
+        "object_name": "Synthetic object",
+        "description": "A synthetic analysis result used for write benchmarks",
+        "confidence": 0.9,
+        "metadata": {"width": 640, "height": 480, "file_size": 12345, "file_type": "jpg",
+                     "camera_make": "Benchmark", "camera_model": "Synthetic 1"},
+    }
+
+def benchmark_upsert(args):
+    """
+    Compare per-row add_image_result with the batched upsert writer
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'upsert.db')}")
+
+        print(f"{'writer':<22} {'rows':>6} {'insert s':>9} {'rows/s':>8} {'update s':>9} {'rows/s':>8}")
+        for name in ("per-row", "batched upsert"):
+            prefix = os.path.join(scratch, name.replace(" ", "-"))
+            folder = db.add_folder(name, prefix)
+            timings = []
+            # Second pass hits the ON CONFLICT / update path for every row
+            for _ in range(2):
+                rows = [_synthetic_result_row(folder.id, prefix, i) for i in range(args.rows)]
+                start = time.perf_counter()
+                if name == "per-row":
+                    for row in rows:
+                        db.add_image_result(**row)
+                else:
+                    with db.ImageResultWriter(batch_size=args.batch_size) as writer:
+                        for row in rows:
+                            writer.add(**row)
+                timings.append(time.perf_counter() - start)
+            insert_s, update_s = timings
+            print(f"{name:<22} {args.rows:>6} {insert_s:>9.2f} {args.rows / insert_s:>8.0f} "
+                  f"{update_s:>9.2f} {args.rows / update_s:>8.0f}")
+
+def benchmark_pages(args):
+    """
+    Compare loading a whole folder as ORM objects with keyset pages of rows
+    """
+    import tracemalloc
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'pages.db')}")
+
+        prefix = os.path.join(scratch, "pages")
+        folder = db.add_folder("pages", prefix)
+        with db.ImageResultWriter(batch_size=5000) as writer:
+            for i in range(args.images):
+                writer.add(**_synthetic_result_row(folder.id, prefix, i))
+
+        def load_all():
+            return [img.file_name for img in db.get_images_by_folder_id(folder.id)]
+
+        def first_page():
+            return db.get_images_page(folder.id, page_size=args.page_size)
+
+        def deep_page():
+            # Seek straight past most of the folder, as after many Next clicks
+            cursor = (f"img_{args.images - args.page_size * 2:06d}.jpg", args.images)
+            return db.get_images_page(folder.id, cursor=cursor, page_size=args.page_size)
+
+        print(f"{'load':<18} {'ms':>9} {'peak MB':>8}")
+        for name, fn in (("all ORM objects", load_all), ("first page", first_page), ("deep page", deep_page)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            print(f"{name:<18} {elapsed:>9.1f} {peak:>8.1f}")
+
+# Indexes added for listings, favorites and the dashboard; toggled by the explain benchmark
+TUNED_INDEXES = [
+    "ix_images_folder_file_name", "ix_images_object_name", "ix_images_confidence", "ix_images_processed_at",
+    "ix_images_camera_model", "ix_images_file_type", "ix_favorite_images_image_id",
+]
+
+def _seed_explain_rows(db, rows, folders):
+    """
+    Insert ``rows`` synthetic images spread over ``folders`` folders, with
+    varied objects, cameras, file types and dates, and favorite every 50th
+    """
+    import datetime
+    import random
+
+    rng = random.Random(42)
+    start = datetime.datetime(2024, 1, 1)
+    with db.session_scope() as session:
+        folder_ids = []
+        for i in range(folders):
+            folder = db.Folder(name=f"explain_{i}", path=f"/explain/{i}")
+            session.add(folder)
+            session.flush()
+            folder_ids.append(folder.id)
+        for batch_start in range(0, rows, 10000):
+            session.bulk_insert_mappings(db.Image, [{
+                "folder_id": folder_ids[i % folders],
+                "file_name": f"img_{i:07d}.jpg",
+                "file_path": f"/explain/{i % folders}/img_{i:07d}.jpg",
+                "object_name": rng.choice(SEARCH_OBJECTS),
+                "description": "A synthetic image",
+                "confidence": rng.random(),
+                "processed_at": start + datetime.timedelta(minutes=i),
+                "camera_model": rng.choice([None, "EOS R5", "EOS 90D", "iPhone 15", "Pixel 8", "X-T5"]),
+                "file_type": rng.choice(["jpg", "png", "heic"]),
+            } for i in range(batch_start, min(rows, batch_start + 10000))])
+        image_ids = [row.id for row in session.query(db.Image.id).order_by(db.Image.id)]
+        session.bulk_insert_mappings(db.FavoriteImage, [{"image_id": image_id} for image_id in image_ids[::50]])
+    return folder_ids, image_ids
+
+def _explain(db, session, query):
+    """
+    Return the database's plan for a query as text
+    """
+    import sqlalchemy as sa
+
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+    if db.engine.dialect.name == "postgresql":
+        rows = session.execute(sa.text("EXPLAIN ANALYZE " + sql)).all()
+        return "\n".join(row[0] for row in rows)
+    if db.engine.dialect.name == "sqlite":
+        rows = session.execute(sa.text("EXPLAIN QUERY PLAN " + sql)).all()
+        return "\n".join(row[-1] for row in rows)
+    return "(EXPLAIN not supported on this database)"
+
+def benchmark_explain(args):
+    """
+    Seed synthetic rows and report plans and timings of the listing,
+    favorites and dashboard queries without and with the tuned indexes
+    """
+    import statistics
+    import sqlalchemy as sa
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'explain.db')}")
+
+        folder_ids, image_ids = _seed_explain_rows(db, args.rows, args.folders)
+        folder_id, image_id = folder_ids[len(folder_ids) // 2], image_ids[len(image_ids) // 2]
+        queries = {
+            "folder page": lambda s: s.query(*db.IMAGE_LISTING_COLUMNS).filter(db.Image.folder_id == folder_id)
+                .order_by(db.Image.file_name, db.Image.id).limit(db.DEFAULT_PAGE_SIZE + 1),
+            "favorite lookup": lambda s: s.query(db.FavoriteImage).filter(db.FavoriteImage.image_id == image_id),
+            "top objects": lambda s: db.value_counts_query(s, db.Image.object_name, 10),
+            "images per day": lambda s: db.images_per_day_query(s),
+            "camera models": lambda s: db.value_counts_query(s, db.Image.camera_model, 5),
+            "file types": lambda s: db.value_counts_query(s, db.Image.file_type),
+            "highest confidence": lambda s: s.query(db.Image.file_name, db.Image.confidence)
+                .order_by(db.Image.confidence.desc()).limit(1),
+        }
+        indexes = [index for table in db.Base.metadata.sorted_tables for index in table.indexes
+                   if index.name in TUNED_INDEXES]
+
+        timings = {}
+        for label, create in (("without", False), ("with", True)):
+            with db.engine.begin() as conn:
+                for index in indexes:
+                    if create:
+                        index.create(conn, checkfirst=True)
+                    else:
+                        index.drop(conn, checkfirst=True)
+                if db.engine.dialect.name in ("postgresql", "sqlite"):
+                    conn.execute(sa.text("ANALYZE"))
+            # Fresh connections, so no cached statement keeps an old plan
+            db.engine.dispose()
+
+            for name, build in queries.items():
+                samples = []
+                with db.session_scope() as session:
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        build(session).all()
+                        samples.append((time.perf_counter() - start) * 1000)
+                    if args.plans:
+                        print(f"--- {name}, {label} indexes")
+                        print(_explain(db, session, build(session)))
+                timings.setdefault(name, []).append(statistics.median(samples))
+
+        print(f"{'query':<20} {'no index ms':>12} {'indexed ms':>11} {'speedup':>8}")
+        for name, (before, after) in timings.items():
+            print(f"{name:<20} {before:>12.2f} {after:>11.2f} {before / after if after else 0:>7.1f}x")
+
+def benchmark_metadata(args):
+    """
+    Compare parsing metadata JSON in Python with the typed metadata columns
+    """
+    import json
+    import random
+    import sqlalchemy as sa
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'metadata.db')}")
+
+        rng = random.Random(7)
+        prefix = os.path.join(scratch, "metadata")
+        folder = db.add_folder("metadata", prefix)
+        cameras = ["Canon", "Nikon", "Sony", "Fujifilm", "Apple"]
+        with db.ImageResultWriter(batch_size=5000) as writer:
+            for i in range(args.rows):
+                row = _synthetic_result_row(folder.id, prefix, i)
+                row["metadata"].update(camera_make=rng.choice(cameras), iso_speed=rng.choice([100, 200, 400, 800]),
+                                       focal_length=rng.uniform(18, 200), aperture=rng.uniform(1.4, 16))
+                writer.add(**row)
+
+        def legacy_features():
+            # Previous clustering: fetch the JSON text and parse it per image
+            with db.session_scope() as session:
+                texts = session.query(sa.cast(db.Image.metadata_json, sa.Text)).all()
+            return [[json.loads(text).get(field, 0) for field in ("width", "height", "file_size", "focal_length",
+                                                                     "aperture", "iso_speed")] for text, in texts]
+
+        def typed_features():
+            columns = [db.Image.id, db.Image.width, db.Image.height, db.Image.file_size, db.Image.focal_length,
+                       db.Image.aperture, db.Image.iso_speed]
+            return [list(row[1:7]) for row in db.iter_image_rows(columns=columns, batch_size=5000)]
+
+        def legacy_filter():
+            with db.session_scope() as session:
+                rows = session.query(db.Image.id, sa.cast(db.Image.metadata_json, sa.Text)).all()
+            return [image_id for image_id, text in rows if json.loads(text).get("camera_make") == "Canon"]
+
+        def typed_filter():
+            with db.session_scope() as session:
+                return [image_id for image_id, in session.query(db.Image.id).filter(db.Image.camera_make == "Canon")]
+
+        def legacy_analytics():
+            totals = {}
+            with db.session_scope() as session:
+                for text, in session.query(sa.cast(db.Image.metadata_json, sa.Text)):
+                    metadata = json.loads(text)
+                    total, count = totals.get(metadata["camera_make"], (0, 0))
+                    totals[metadata["camera_make"]] = (total + metadata["iso_speed"], count + 1)
+            return {camera: total / count for camera, (total, count) in totals.items()}
+
+        def typed_analytics():
+            with db.session_scope() as session:
+                return dict(session.query(db.Image.camera_make, sa.func.avg(db.Image.iso_speed))
+                            .group_by(db.Image.camera_make).all())
+
+        print(f"{'task':<22} {'parse in Python s':>18} {'typed columns s':>15} {'speedup':>8}")
+        for name, legacy, improved in (("clustering features", legacy_features, typed_features),
+                                       ("filter camera_make", legacy_filter, typed_filter),
+                                       ("avg ISO per camera", legacy_analytics, typed_analytics)):
+            start = time.perf_counter()
+            legacy()
+            before = time.perf_counter() - start
+            start = time.perf_counter()
+            improved()
+            after = time.perf_counter() - start
+            print(f"{name:<22} {before:>18.2f} {after:>15.2f} {before / after:>7.1f}x")
+
+class StatementCounter:
+    """
+    Count SQL statements sent to an engine while active
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+def _seed_page_data(db, folders, per_folder):
+    """
+    Insert folders, images and favorites for the query-count check
+    """
+    with db.session_scope() as session:
+        for i in range(folders):
+            folder = db.Folder(name=f"folder_{i}", path=f"/synthetic/{folders}/{i}")
+            session.add(folder)
+            session.flush()
+            session.bulk_insert_mappings(db.Image, [{
+                "folder_id": folder.id, "file_name": f"img_{j}.jpg",
+                "file_path": f"/synthetic/{folders}/{i}/img_{j}.jpg",
+                "object_name": "cat", "description": "a synthetic cat", "confidence": 0.9,
+            } for j in range(per_folder)])
+        image_ids = [row.id for row in session.query(db.Image.id).filter(db.Image.file_path.like(f"/synthetic/{folders}/%"))]
+        session.bulk_insert_mappings(db.FavoriteImage, [{"image_id": image_id} for image_id in image_ids[::3]])
+        return image_ids
+
+def _page_data_paths(db, image_ids):
+    """
+    The data access each page performs while rendering, including the
+    relationship attributes it reads
+    """
+    return {
+        "history folders": lambda: [(folder.name, count) for folder, count in db.get_all_folders_with_image_counts()],
+        # One page of results; unlimited searches hydrate index hits in chunks of 500
+        "search results": lambda: [img.folder.name for img in db.search_images("cat", limit=50)],
+        "dashboard favorites": lambda: [fav.image.folder.name for fav in db.get_all_favorites()],
+        "add favorite dialog": lambda: [img.folder.name for img in db.get_non_favorite_images()],
+        "comparison": lambda: [img.folder.name for img in db.get_images_by_ids(image_ids[:4])],
+        "folders page": lambda: db.get_folders_page(),
+        "images page": lambda: db.get_images_page(cursor=db.get_images_page()[1]),
+        "search results page": lambda: db.search_images_page("cat"),
+    }
+
+def benchmark_queries(args):
+    """
+    Check that page data paths issue a constant number of statements as the
+    tables grow
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        # Always a throwaway SQLite database: the check deletes and seeds rows
+        os.environ["SEARCH_INDEX_PATH"] = os.path.join(scratch, "search_index.pkl")
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'queries.db')}")
+        from search_index import get_search_backend
+        # One process, so its own bumps invalidate the cache; read the stored
+        # generation once now rather than inside a counted page render
+        db.WRITE_GENERATION_POLL_SECONDS = float("inf")
+        db.get_write_generation()
+
+        counts = {}
+        for folders in args.sizes:
+            # Clear previous rows so each size measures its own data
+            with db.session_scope() as session:
+                for model in (db.FavoriteImage, db.Image, db.Folder):
+                    session.query(model).delete()
+            image_ids = _seed_page_data(db, folders, args.per_folder)
+            # Seeded with bulk operations, which do not invalidate cached results
+            db.bump_write_generation()
+            backend = get_search_backend()
+            if hasattr(backend, "refresh"):
+                # Catching the index up is maintenance, not part of a page render
+                backend.refresh(force=True)
+            for name, fn in _page_data_paths(db, image_ids).items():
+                # One session per page render, as with with_session_scope
+                with db.session_scope(), StatementCounter(db.engine) as counter:
+                    fn()
+                counts.setdefault(name, []).append(counter.count)
+
+        header = " ".join(f"{f'{size * args.per_folder} imgs':>10}" for size in args.sizes)
+        print(f"{'page data path':<22} {header}  constant")
+        failures = 0
+        for name, values in counts.items():
+            constant = len(set(values)) == 1
+            failures += not constant
+            print(f"{name:<22} {' '.join(f'{v:>10}' for v in values)}  {'yes' if constant else 'NO'}")
+        if failures:
+            print(f"{failures} page data paths scale with row count")
+            sys.exit(1)
+
+SEARCH_OBJECTS = ["cat", "dog", "car", "bicycle", "mountain", "lake", "building", "tree", "flower", "person",
+                  "bridge", "boat", "bird", "horse", "street", "beach", "forest", "train", "chair", "laptop"]
+SEARCH_WORDS = ["red", "blue", "old", "small", "large", "sunny", "snowy", "busy", "quiet", "wooden",
+                "bright", "dark", "distant", "crowded", "empty"]
+
+def _seed_search_rows(db, rows, prefix):
+    """
+    Insert ``rows`` synthetic images server-side with generate_series
+    """
+    import sqlalchemy as sa
+
+    folder = db.add_folder(f"search-benchmark-{rows}", prefix)
+    objects = "ARRAY[" + ", ".join(f"'{word}'" for word in SEARCH_OBJECTS) + "]"
+    words = "ARRAY[" + ", ".join(f"'{word}'" for word in SEARCH_WORDS) + "]"
+    with db.engine.begin() as conn:
+        conn.execute(sa.text(f"""
+            INSERT INTO images (folder_id, file_name, file_path, object_name, description, confidence,
+                                camera_make, camera_model, file_type, missing)
+            SELECT :folder_id, 'img_' || g || '.jpg', :prefix || '/img_' || g || '.jpg',
+                   ({objects})[1 + g % {len(SEARCH_OBJECTS)}],
+                   'A ' || ({words})[1 + (g * 7) % {len(SEARCH_WORDS)}] || ' '
+                       || ({objects})[1 + g % {len(SEARCH_OBJECTS)}] || ' near a '
+                       || ({words})[1 + (g * 13) % {len(SEARCH_WORDS)}] || ' '
+                       || ({objects})[1 + (g * 3) % {len(SEARCH_OBJECTS)}] || ' photo ' || g,
+                   0.9, 'Canon', 'EOS ' || (g % 90), 'jpg', FALSE
+            FROM generate_series(1, :rows) AS g
+        """), {"folder_id": folder.id, "prefix": prefix, "rows": rows})
+        conn.execute(sa.text("ANALYZE images"))
+    return folder.id
+
+def _legacy_search_query(session, db, query):
+    """
+    The previous search_images filter: six ILIKE scans, no ranking
+    """
+    import sqlalchemy as sa
+
+    pattern = f"%{query}%"
+    return session.query(db.Image).filter(
+        db.Image.object_name.ilike(pattern) | db.Image.description.ilike(pattern) |
+        db.Image.camera_make.ilike(pattern) | db.Image.camera_model.ilike(pattern) |
+        db.Image.file_type.ilike(pattern) | sa.cast(db.Image.metadata_json, sa.Text).ilike(pattern)
+    )
+
+def benchmark_search(args):
+    """
+    Compare search latency of the ILIKE scans and the PostgreSQL full-text
+    and trigram indexes at growing table sizes
+    """
+    import statistics
+
+    if not (args.database_url or "").startswith("postgres"):
+        print("The search benchmark needs --database-url pointing at a PostgreSQL database")
+        sys.exit(1)
+    db = _open_database(args, args.database_url)
+
+    if not db.is_full_text_search_enabled():
+        print("Full-text search is not set up on this database; see the startup log")
+        sys.exit(1)
+
+    print(f"{'rows':>8} {'query':<16} {'ILIKE ms':>9} {'full-text ms':>13} {'speedup':>8}")
+    for rows in args.rows:
+        prefix = f"/benchmark/search/{rows}"
+        folder_id = _seed_search_rows(db, rows, prefix)
+        try:
+            for query in args.queries:
+                timings = {}
+                for name, build in (("legacy", lambda s: _legacy_search_query(s, db, query)),
+                                    ("fts", lambda s: db.build_search_query(s, query))):
+                    samples = []
+                    for _ in range(args.repeat):
+                        with db.session_scope() as session:
+                            start = time.perf_counter()
+                            # A page of ids, so the timing reflects the query plan rather than ORM loading
+                            build(session).with_entities(db.Image.id).limit(args.limit).all()
+                            samples.append((time.perf_counter() - start) * 1000)
+                    timings[name] = statistics.median(samples)
+                print(f"{rows:>8} {query:<16} {timings['legacy']:>9.1f} {timings['fts']:>13.1f} "
+                      f"{timings['legacy'] / timings['fts']:>7.1f}x")
+        finally:
+            with db.session_scope() as session:
+                session.query(db.Image).filter(db.Image.folder_id == folder_id).delete(synchronize_session=False)
+                session.query(db.Folder).filter(db.Folder.id == folder_id).delete(synchronize_session=False)
+
+def _synthetic_description(i):
+    obj = SEARCH_OBJECTS[i % len(SEARCH_OBJECTS)]
+    return (obj, f"A {SEARCH_WORDS[(i * 7) % len(SEARCH_WORDS)]} {obj} near a "
+                 f"{SEARCH_WORDS[(i * 13) % len(SEARCH_WORDS)]} {SEARCH_OBJECTS[(i * 3) % len(SEARCH_OBJECTS)]} "
+                 f"photo {i % 5000}")
+
+def benchmark_index(args):
+    """
+    Build the embedded inverted index over synthetic descriptions and time
+    building, saving, loading and querying it
+    """
+    import statistics
+    from search_index import InvertedIndex
+
+    index = InvertedIndex()
+    start = time.perf_counter()
+    for i in range(args.docs):
+        obj, description = _synthetic_description(i)
+        index.add(i + 1, {"object_name": obj, "description": description, "camera_make": "Canon",
+                          "camera_model": f"EOS {i % 90}", "file_type": "jpg"})
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search_index.pkl")
+        start = time.perf_counter()
+        index.save(path)
+        save_seconds = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 1e6
+        start = time.perf_counter()
+        index = InvertedIndex.load(path)
+        load_seconds = time.perf_counter() - start
+
+    print(f"Indexed {args.docs} documents in {build_seconds:.1f}s ({args.docs / build_seconds:.0f} docs/sec), "
+          f"{len(index.postings)} terms")
+    print(f"Saved {size_mb:.1f} MB in {save_seconds:.2f}s, loaded in {load_seconds:.2f}s")
+
+    print(f"{'query':<16} {'hits':>8} {'median ms':>10}")
+    for query in args.queries:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            hits = index.search(query, limit=args.limit)
+            samples.append((time.perf_counter() - start) * 1000)
+        total_hits = len(index.search(query))
+        print(f"{query:<16} {total_hits:>8} {statistics.median(samples):>10.1f}")
+
+def benchmark_semantic(args):
+    """
+    Build the semantic vector index over synthetic descriptions with the
+    hashing embedder and compare IVF search with an exact scan
+    """
+    import statistics
+    import numpy as np
+    from semantic_search import HashingEmbedder, VectorIndex, document_text
+
+    embedder = HashingEmbedder()
+    index = VectorIndex(embedder.dimensions, nprobe=args.nprobe)
+    embed_seconds = 0.0
+    start = time.perf_counter()
+    for batch_start in range(0, args.docs, 10000):
+        batch_ids = list(range(batch_start + 1, min(args.docs, batch_start + 10000) + 1))
+        embed_start = time.perf_counter()
+        vectors = embedder.embed([document_text(*_synthetic_description(i - 1)) for i in batch_ids])
+        embed_seconds += time.perf_counter() - embed_start
+        index.add(batch_ids, vectors, [0.0] * len(batch_ids))
+    build_seconds = time.perf_counter() - start
+    lists = len(index.centroids) if index.centroids is not None else 0
+    print(f"Embedded and indexed {args.docs} documents in {build_seconds:.1f}s "
+          f"({embed_seconds:.1f}s embedding), {lists} lists")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "semantic_index.f32")
+        start = time.perf_counter()
+        index.save(path, embedder.name)
+        save_seconds = time.perf_counter() - start
+        size_mb = (os.path.getsize(path) + os.path.getsize(path + ".meta")) / 1e6
+        start = time.perf_counter()
+        index = VectorIndex.load(path, embedder.name, embedder.dimensions, nprobe=args.nprobe)
+        load_seconds = time.perf_counter() - start
+    print(f"Saved {size_mb:.1f} MB in {save_seconds:.2f}s, loaded in {load_seconds:.2f}s")
+
+    print(f"{'query':<16} {'top score':>10} {'exact ms':>9} {'IVF ms':>7} {'recall@10':>10}")
+    for query in args.queries:
+        vector = embedder.embed([query])[0]
+        timings = {}
+        results = {}
+        for exact in (True, False):
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results[exact] = index.search(vector, args.limit, exact=exact)
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[exact] = statistics.median(samples)
+        # Ties are common in synthetic text, so compare scores rather than ids
+        threshold = results[True][min(9, len(results[True]) - 1)][1]
+        recall = sum(1 for _, score in results[False][:10] if score >= threshold - 1e-6) / 10
+        print(f"{query:<16} {results[True][0][1]:>10.2f} {timings[True]:>9.1f} {timings[False]:>7.1f} {recall:>10.2f}")
+
+def _synthetic_facet_rows(count, folders):
+    """
+    Rows shaped like iter_image_changes output for the facet benchmark
+    """
+    import random
+    from collections import namedtuple
+
+    Row = namedtuple("Row", "id processed_at camera_make camera_model file_type folder_id confidence date_taken")
+    rng = random.Random(11)
+    makes = ["Canon", "Nikon", "Sony", "Fujifilm", "Apple", None]
+    start = datetime.datetime(2015, 1, 1)
+    for i in range(1, count + 1):
+        make = rng.choice(makes)
+        yield Row(i, start, make, f"{make} {rng.randrange(30)}" if make else None, rng.choice(["jpg", "png", "heic"]),
+                  rng.randrange(folders) + 1, rng.random(), start + datetime.timedelta(days=rng.randrange(3650)))
+
+def benchmark_facets(args):
+    """
+    Time faceted searches with counts on the in-memory facet index against
+    one GROUP BY query per facet
+    """
+    import statistics
+    import sqlalchemy as sa
+    from facets import FacetIndex, VALUE_FACETS
+
+    index = FacetIndex()
+    start = time.perf_counter()
+    batch = []
+    for row in _synthetic_facet_rows(args.rows, args.folders):
+        batch.append(row)
+        if len(batch) == 10000:
+            index.add_rows(batch)
+            batch = []
+    index.add_rows(batch)
+    print(f"Loaded {args.rows} rows into the facet index in {time.perf_counter() - start:.1f}s")
+
+    rng_ids = list(range(1, args.rows + 1, 7))
+    cases = {
+        "no filters": ({}, None),
+        "camera make": ({"camera_make": ["Canon"]}, None),
+        "make + type + dates": ({"camera_make": ["Canon", "Sony"], "file_type": ["jpg"],
+                                 "date_taken": (datetime.date(2018, 1, 1), datetime.date(2019, 12, 31))}, None),
+        "query + confidence": ({"confidence": (0.8, 1.0)}, rng_ids),
+    }
+    print(f"{'filters':<22} {'matches':>9} {'index ms':>9}")
+    for name, (filters, matched_ids) in cases.items():
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            image_ids, _ = index.search(filters, matched_ids)
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{name:<22} {len(image_ids):>9} {statistics.median(samples):>9.1f}")
+
+    if not args.sql_rows:
+        return
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'facets.db')}")
+        with db.session_scope() as session:
+            for i in range(args.folders):
+                session.add(db.Folder(name=f"folder_{i}", path=f"/facets/{i}"))
+            session.flush()
+            rows = []
+            for row in _synthetic_facet_rows(args.sql_rows, args.folders):
+                rows.append({"folder_id": row.folder_id, "file_name": f"img_{row.id}.jpg",
+                             "file_path": f"/facets/img_{row.id}.jpg", "object_name": "Synthetic",
+                             "description": "", "confidence": row.confidence, "camera_make": row.camera_make,
+                             "camera_model": row.camera_model, "file_type": row.file_type,
+                             "date_taken": row.date_taken, "processed_at": row.processed_at, "missing": False})
+                if len(rows) == 10000:
+                    session.bulk_insert_mappings(db.Image, rows)
+                    rows = []
+            session.bulk_insert_mappings(db.Image, rows)
+        db.bump_write_generation()
+
+        def sql_facets():
+            # One GROUP BY per facet, each with the other facets' filters
+            counts = {}
+            with db.session_scope() as session:
+                for facet in VALUE_FACETS:
+                    column = getattr(db.Image, facet)
+                    query = session.query(column, sa.func.count()).filter(column.isnot(None))
+                    if facet != "camera_make":
+                        query = query.filter(db.Image.camera_make == "Canon")
+                    counts[facet] = query.group_by(column).all()
+                session.query(db.Image.id).filter(db.Image.camera_make == "Canon").order_by(
+                    db.Image.id.desc()).limit(50).all()
+            return counts
+
+        small = FacetIndex()
+        small.add_rows(_synthetic_facet_rows(args.sql_rows, args.folders))
+        samples = {"sql": [], "index": []}
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            sql_facets()
+            samples["sql"].append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            small.search({"camera_make": ["Canon"]})
+            samples["index"].append((time.perf_counter() - start) * 1000)
+        print(f"camera make filter at {args.sql_rows} rows: GROUP BY per facet "
+              f"{statistics.median(samples['sql']):.1f} ms, facet index {statistics.median(samples['index']):.1f} ms")
+
+def _synthetic_suggestion_rows(count, distinct):
+    """
+    Rows shaped like iter_image_changes output for the suggestion
+    benchmark, with Zipf-like value frequencies
+    """
+    import random
+    from collections import namedtuple
+
+    Row = namedtuple("Row", "id processed_at object_name camera_make camera_model")
+    rng = random.Random(5)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "su", "do", "fa"]
+    names = sorted({f"{rng.choice(SEARCH_WORDS)} {rng.choice(SEARCH_OBJECTS)} "
+                    f"{''.join(rng.choice(syllables) for _ in range(3))}" for _ in range(distinct)})
+    rng.shuffle(names)
+    makes = ["Canon", "Nikon", "Sony", "Fujifilm", "Apple", "Samsung", "Google", "Olympus"]
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(1, count + 1):
+        # A long tail of rare names behind a few very common ones
+        if rng.random() < 0.7:
+            name = names[min(len(names) - 1, int(rng.paretovariate(1.2)) - 1)]
+        else:
+            name = rng.choice(names)
+        make = makes[i % len(makes)]
+        yield Row(i, start, name, make, f"{make} Model {i % 40}")
+
+def benchmark_suggest(args):
+    """
+    Time prefix suggestions from the suggestion index against a LIKE
+    prefix GROUP BY query
+    """
+    import random
+    import statistics
+    import sqlalchemy as sa
+    from suggestions import SuggestionIndex
+
+    index = SuggestionIndex()
+    start = time.perf_counter()
+    batch = []
+    for row in _synthetic_suggestion_rows(args.rows, args.distinct):
+        batch.append(row)
+        if len(batch) == 10000:
+            index.add_rows(batch)
+            batch = []
+    index.add_rows(batch)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index.suggest("a")
+    key_seconds = time.perf_counter() - start
+    print(f"Loaded {args.rows} rows, {len(index.values['object_name']) - 1} distinct object names, "
+          f"in {load_seconds:.1f}s; keys sorted in {key_seconds:.2f}s")
+
+    rng = random.Random(3)
+    words = [value.lower() for value in index.values["object_name"][1:]] + ["canon", "sony", "model"]
+    print(f"{'prefix length':<14} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7}")
+    for length in (1, 2, 3, 5):
+        samples = []
+        for _ in range(args.lookups):
+            prefix = rng.choice(words)[:length]
+            start = time.perf_counter()
+            index.suggest(prefix, limit=args.limit)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        print(f"{length:<14} {statistics.median(samples):>7.3f} {samples[int(len(samples) * 0.95)]:>7.3f} "
+              f"{samples[-1]:>7.3f}")
+
+    if not args.sql_rows:
+        return
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'suggest.db')}")
+        folder = db.add_folder("suggest", "/suggest")
+        with db.session_scope() as session:
+            rows = []
+            for row in _synthetic_suggestion_rows(args.sql_rows, args.distinct):
+                rows.append({"folder_id": folder.id, "file_name": f"img_{row.id}.jpg",
+                             "file_path": f"/suggest/img_{row.id}.jpg", "object_name": row.object_name,
+                             "description": "", "confidence": 0.9, "camera_make": row.camera_make,
+                             "camera_model": row.camera_model, "missing": False})
+                if len(rows) == 10000:
+                    session.bulk_insert_mappings(db.Image, rows)
+                    rows = []
+            session.bulk_insert_mappings(db.Image, rows)
+        db.bump_write_generation()
+
+        samples = []
+        for _ in range(20):
+            prefix = rng.choice(words)[:2]
+            start = time.perf_counter()
+            with db.session_scope() as session:
+                session.query(db.Image.object_name, sa.func.count()).filter(
+                    db.Image.object_name.ilike(f"{prefix}%") | db.Image.object_name.ilike(f"% {prefix}%")
+                ).group_by(db.Image.object_name).order_by(sa.func.count().desc()).limit(args.limit).all()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"ILIKE GROUP BY at {args.sql_rows} rows, 2-letter prefixes: {statistics.median(samples):.1f} ms median")
+
+def _synthetic_geo_rows(count):
+    """
+    GPS coordinates bunched around cities, with a tenth spread over land
+    and sea, as a photo library's usually are
+    """
+    import random
+
+    rng = random.Random(9)
+    cities = [(rng.uniform(-45, 60), rng.uniform(-125, 150), rng.uniform(0.02, 0.3)) for _ in range(60)]
+    for i in range(1, count + 1):
+        if rng.random() < 0.1:
+            yield i, rng.uniform(-60, 70), rng.uniform(-180, 180)
+        else:
+            latitude, longitude, spread = cities[min(int(rng.paretovariate(1.0)) - 1, len(cities) - 1)]
+            yield i, rng.gauss(latitude, spread), rng.gauss(longitude, spread * 1.5)
+
+def benchmark_geo(args):
+    """
+    Time bounding box, radius and map cluster queries on the geohash index
+    against filtering the coordinate columns
+    """
+    import statistics
+    import sqlalchemy as sa
+    import geo
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'geo.db')}")
+        folder = db.add_folder("geo", "/geo")
+        start = time.perf_counter()
+        with db.session_scope() as session:
+            rows = []
+            for i, latitude, longitude in _synthetic_geo_rows(args.rows):
+                rows.append({"folder_id": folder.id, "file_name": f"img_{i}.jpg", "file_path": f"/geo/img_{i}.jpg",
+                             "object_name": "Synthetic", "description": "", "confidence": 0.9, "missing": False,
+                             "gps_latitude": latitude, "gps_longitude": longitude,
+                             "geohash": geo.encode(latitude, longitude)})
+                if len(rows) == 10000:
+                    session.bulk_insert_mappings(db.Image, rows)
+                    rows = []
+            session.bulk_insert_mappings(db.Image, rows)
+        db.bump_write_generation()
+        print(f"Inserted {args.rows} geotagged rows in {time.perf_counter() - start:.1f}s")
+
+        # Zoom in on the busiest part of the map, as a user would
+        busiest = db.get_map_clusters(-90.0, -180.0, 90.0, 180.0)[0]
+        latitude, longitude = busiest.latitude, busiest.longitude
+        areas = {
+            "world": (-90.0, -180.0, 90.0, 180.0),
+            "region (20 deg)": (latitude - 10, longitude - 10, latitude + 10, longitude + 10),
+            "city (0.5 deg)": (latitude - 0.25, longitude - 0.25, latitude + 0.25, longitude + 0.25),
+            "street (0.01 deg)": (latitude - 0.005, longitude - 0.005, latitude + 0.005, longitude + 0.005),
+        }
+
+        def timed(fn):
+            samples = []
+            for _ in range(args.repeat):
+                db.search_cache.clear()
+                start = time.perf_counter()
+                result = fn()
+                samples.append((time.perf_counter() - start) * 1000)
+            return result, statistics.median(samples)
+
+        def scan_points(area):
+            # Every coordinate in the box, as a client-side map would need
+            south, west, north, east = area
+            with db.session_scope() as session:
+                return session.query(db.Image.gps_latitude, db.Image.gps_longitude).filter(
+                    db.Image.gps_latitude.between(south, north), db.Image.gps_longitude.between(west, east)
+                ).all()
+
+        print(f"{'area':<18} {'images':>8} {'clusters':>9} {'cluster ms':>11} {'all points ms':>14} "
+              f"{'first 500 ms':>13}")
+        for name, area in areas.items():
+            clusters, cluster_ms = timed(lambda: db.get_map_clusters(*area))
+            points, scan_ms = timed(lambda: scan_points(area))
+            _, bbox_ms = timed(lambda: db.get_images_in_bbox(*area, limit=500))
+            assert sum(cluster.count for cluster in clusters) == len(points)
+            print(f"{name:<18} {len(points):>8} {len(clusters):>9} {cluster_ms:>11.1f} {scan_ms:>14.1f} "
+                  f"{bbox_ms:>13.1f}")
+
+        for radius_km in (1, 10, 100):
+            nearby, near_ms = timed(lambda: db.get_images_near(latitude, longitude, radius_km, limit=100))
+            print(f"100 nearest within {radius_km:>3} km: {len(nearby):>4} images in {near_ms:.1f} ms")
+
+def benchmark_cache(args):
+    """
+    Count the statements and time of simulated search page reruns with and
+    without the search result cache
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        # A throwaway SQLite database unless --database-url names another
+        os.environ["SEARCH_INDEX_PATH"] = os.path.join(scratch, "search_index.pkl")
+        db = _open_database(args, f"sqlite:///{os.path.join(scratch, 'cache.db')}")
+
+        prefix = os.path.join(scratch, "cache")
+        folder = db.add_folder("cache", prefix)
+        with db.ImageResultWriter(batch_size=5000) as writer:
+            for i in range(args.images):
+                row = _synthetic_result_row(folder.id, prefix, i)
+                row["object_name"], row["description"] = _synthetic_description(i)
+                writer.add(**row)
+
+        print(f"{'cache':<10} {'reruns':>7} {'statements':>11} {'total ms':>9} {'hit rate':>9}")
+        maxsize = db.search_cache.maxsize
+        for name, size in (("off", 0), ("on", maxsize)):
+            db.search_cache.maxsize = size
+            db.search_cache.clear()
+            db.search_cache.hits = db.search_cache.misses = 0
+            written = args.images
+            start = time.perf_counter()
+            with StatementCounter(db.engine) as counter:
+                for rerun in range(args.reruns):
+                    # Each query stays on screen for several reruns (checkbox
+                    # toggles, picking a result) before the user types another
+                    query = args.queries[(rerun // args.reruns_per_query) % len(args.queries)]
+                    db.search_images_page(query)
+                    if args.write_every and rerun % args.write_every == args.write_every - 1:
+                        row = _synthetic_result_row(folder.id, prefix, written)
+                        row["object_name"], row["description"] = _synthetic_description(written)
+                        db.add_image_result(**row)
+                        written += 1
+            elapsed = (time.perf_counter() - start) * 1000
+            stats = db.search_cache.stats()
+            print(f"{name:<10} {args.reruns:>7} {counter.count:>11} {elapsed:>9.1f} {stats['hit_rate']:>9.0%}")
+        db.search_cache.maxsize = maxsize
+        print("Statements include the writes, which are the same in both runs")
+
+# SQLite's own settings, compared against database.SQLITE_PRAGMAS
+SQLITE_DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 30000}
+
+def benchmark_sqlite(args):
+    """
+    Ingestion, search and analytics throughput on a local SQLite database,
+    with SQLite's default settings and with the tuned pragmas, and with
+    --ablate also with the tuned pragmas minus each one in turn
+
+    Settings are measured in turn, ``--runs`` times over, and the median
+    of each figure is reported.
+    """
+    import statistics
+    import database as db
+    from migrations import migrate
+    from search_index import DatabaseSearchBackend, InvertedIndexBackend
+
+    tuned_pragmas = dict(db.SQLITE_PRAGMAS)
+    settings = [("sqlite defaults", SQLITE_DEFAULT_PRAGMAS), ("tuned", tuned_pragmas)]
+    if args.ablate:
+        settings += [(f"no {pragma}", {name: value for name, value in tuned_pragmas.items() if name != pragma})
+                     for pragma in tuned_pragmas if pragma != "busy_timeout"]
+    results = {name: [] for name, _ in settings}
+    with tempfile.TemporaryDirectory() as scratch:
+        for run in range(args.runs):
+            for name, pragmas in settings:
+                # A fresh database file per setting; journal_mode is stored in the file
+                label = f"{name.replace(' ', '-')}-{run}"
+                db.remove_session()
+                if db._engine is not None:
+                    db._engine.dispose()
+                db._engine = None
+                db.DATABASE_URL = f"sqlite:///{os.path.join(scratch, label + '.db')}"
+                db.SQLITE_PRAGMAS = pragmas
+                migrate()
+
+                prefix = os.path.join(scratch, label)
+                folder = db.add_folder(label, prefix)
+
+                def row(i):
+                    result = _synthetic_result_row(folder.id, prefix, i)
+                    result["object_name"], result["description"] = _synthetic_description(i)
+                    return result
+
+                # One commit per result, as the app stores single uploads, while a
+                # dashboard reader polls: WAL lets the reads run alongside the writes
+                reads = [0]
+                writing = threading.Event()
+                writing.set()
+
+                def poll_dashboard():
+                    while writing.is_set():
+                        db.get_image_value_counts(db.Image.object_name, limit=10)
+                        reads[0] += 1
+                    db.remove_session()
+
+                reader = threading.Thread(target=poll_dashboard)
+                reader.start()
+                start = time.perf_counter()
+                for i in range(args.commits):
+                    db.add_image_result(**row(i))
+                commit_seconds = time.perf_counter() - start
+                writing.clear()
+                reader.join()
+
+                start = time.perf_counter()
+                with db.ImageResultWriter(batch_size=args.batch_size) as writer:
+                    for i in range(args.commits, args.commits + args.rows):
+                        writer.add(**row(i))
+                batch_seconds = time.perf_counter() - start
+
+                def median_ms(fn):
+                    samples = []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        fn()
+                        samples.append((time.perf_counter() - start) * 1000)
+                    return statistics.median(samples)
+
+                scan_backend = DatabaseSearchBackend()
+                # Caught up once here; catching up is maintenance, not search time
+                index_backend = InvertedIndexBackend(path=prefix + ".pkl", refresh_interval=float("inf"))
+                index_backend.refresh(force=True)
+                index_backend.stale = False
+                scan_ms = sum(median_ms(lambda: scan_backend.search_page(query)) for query in args.queries)
+                index_ms = sum(median_ms(lambda: index_backend.search_page(query)) for query in args.queries)
+                analytics_ms = median_ms(lambda: (
+                    db.get_image_value_counts(db.Image.object_name, limit=10),
+                    db.get_image_value_counts(db.Image.camera_model, limit=5),
+                    db.get_images_per_day(),
+                ))
+                results[name].append((args.commits / commit_seconds, reads[0] / commit_seconds,
+                                      args.rows / batch_seconds, scan_ms, index_ms, analytics_ms))
+
+        db.remove_session()
+        db._engine.dispose()
+
+    print(f"{'settings':<16} {'commits/s':>10} {'reads/s':>8} {'batched rows/s':>15} "
+          f"{'scan ms':>8} {'index ms':>9} {'analytics ms':>13}")
+    for name, _ in settings:
+        commits, reads, rows, scan_ms, index_ms, analytics_ms = (
+            statistics.median(values) for values in zip(*results[name])
+        )
+        print(f"{name:<16} {commits:>10.0f} {reads:>8.0f} {rows:>15.0f} "
+              f"{scan_ms:>8.1f} {index_ms:>9.1f} {analytics_ms:>13.1f}")
+    print(f"Medians of {args.runs} runs; search times are the sum over {len(args.queries)} queries, first page each")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI Image Analyzer benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="Concurrent analysis speedup against a fake API server")
+    concurrency.add_argument("--images", type=int, default=32, help="Number of synthetic images")
+    concurrency.add_argument("--latency", type=float, default=0.5, help="Simulated seconds per API request")
+    concurrency.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Worker counts to compare")
+    concurrency.set_defaults(func=benchmark_concurrency)
+
+    ratelimit = subparsers.add_parser("ratelimit", help="Throughput under a server-side request quota")
+    ratelimit.add_argument("--images", type=int, default=60, help="Number of synthetic images")
+    ratelimit.add_argument("--latency", type=float, default=0.2, help="Simulated seconds per API request")
+    ratelimit.add_argument("--workers", type=int, default=16, help="Concurrent analyses")
+    ratelimit.add_argument("--server-rpm", type=int, default=50, help="Requests per minute the fake server accepts")
+    ratelimit.add_argument("--client-rpm", type=int, default=500, help="Requests per minute the client limiter allows")
+    ratelimit.add_argument("--client-tpm", type=int, default=10000000, help="Tokens per minute the client limiter allows")
+    ratelimit.set_defaults(func=benchmark_rate_limit)
+
+    preprocess = subparsers.add_parser("preprocess", help="Upload bytes saved by downscaling and re-encoding")
+    preprocess.add_argument("--folder", help="Folder of sample images (default: generate synthetic photos)")
+    preprocess.add_argument("--images", type=int, default=8, help="Number of synthetic photos to generate")
+    preprocess.add_argument("--max-edge", type=int, default=2048, help="Maximum longest edge in pixels")
+    preprocess.add_argument("--format", choices=["JPEG", "WEBP"], default="JPEG", help="Upload encoding")
+    preprocess.add_argument("--quality", type=int, default=85, help="Encoder quality")
+    preprocess.add_argument("--detail", choices=["low", "high"], default="high", help="Vision detail level")
+    preprocess.set_defaults(func=benchmark_preprocess)
+
+    probe = subparsers.add_parser("probe", help="Per-file image probing cost before and after probe_image")
+    probe.add_argument("--folder", help="Folder of sample images (default: generate mixed JPEG/PNG/HEIC)")
+    probe.add_argument("--images", type=int, default=60, help="Number of synthetic images to generate")
+    probe.set_defaults(func=benchmark_probe)
+
+    scan = subparsers.add_parser("scan", help="Directory discovery cost before and after iter_image_files")
+    scan.add_argument("--folder", help="Folder tree to scan (default: generate a synthetic tree)")
+    scan.add_argument("--folders", type=int, default=200, help="Number of synthetic leaf folders")
+    scan.add_argument("--per-folder", type=int, default=50, help="Images per synthetic folder")
+    scan.set_defaults(func=benchmark_scan)
+
+    sync = subparsers.add_parser("sync", help="Incremental re-scan of an unchanged folder")
+    sync.add_argument("--images", type=int, default=50000, help="Number of synthetic images")
+    sync.add_argument("--folders", type=int, default=100, help="Number of synthetic leaf folders")
+    sync.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    sync.set_defaults(func=benchmark_sync)
+
+    upsert = subparsers.add_parser("upsert", help="Per-row inserts versus the batched upsert writer")
+    upsert.add_argument("--rows", type=int, default=10000, help="Number of synthetic result rows")
+    upsert.add_argument("--batch-size", type=int, default=500, help="Rows per upsert flush")
+    upsert.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    upsert.set_defaults(func=benchmark_upsert)
+
+    pages = subparsers.add_parser("pages", help="Whole-folder loads versus keyset-paginated listing pages")
+    pages.add_argument("--images", type=int, default=100000, help="Number of synthetic images in the folder")
+    pages.add_argument("--page-size", type=int, default=50, help="Rows per page")
+    pages.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    pages.set_defaults(func=benchmark_pages)
+
+    explain = subparsers.add_parser("explain", help="Query plans and timings without and with the tuned indexes")
+    explain.add_argument("--rows", type=int, default=200000, help="Number of synthetic images")
+    explain.add_argument("--folders", type=int, default=200, help="Number of synthetic folders")
+    explain.add_argument("--repeat", type=int, default=5, help="Timed runs per query (median reported)")
+    explain.add_argument("--no-plans", dest="plans", action="store_false", help="Only print timings")
+    explain.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    explain.set_defaults(func=benchmark_explain)
+
+    metadata = subparsers.add_parser("metadata", help="Per-row JSON parsing versus typed metadata columns")
+    metadata.add_argument("--rows", type=int, default=100000, help="Number of synthetic images")
+    metadata.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    metadata.set_defaults(func=benchmark_metadata)
+
+    queries = subparsers.add_parser("queries", help="Check page queries stay constant as tables grow (exits 1 on N+1)")
+    queries.add_argument("--sizes", type=int, nargs="+", default=[5, 50], help="Folder counts to compare")
+    queries.add_argument("--per-folder", type=int, default=20, help="Images per folder")
+    queries.set_defaults(func=benchmark_queries)
+
+    search = subparsers.add_parser("search", help="ILIKE scans versus PostgreSQL full-text search (needs PostgreSQL)")
+    search.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000], help="Table sizes to compare")
+    search.add_argument("--queries", nargs="+", default=["cat", "red car", "snowy mountain", "bicyc", "zebra"],
+                        help="Search strings to time")
+    search.add_argument("--limit", type=int, default=50, help="Results fetched per query")
+    search.add_argument("--repeat", type=int, default=5, help="Timed runs per query (median reported)")
+    search.add_argument("--database-url", help="PostgreSQL database to benchmark")
+    search.set_defaults(func=benchmark_search)
+
+    index = subparsers.add_parser("index", help="Embedded inverted index build, load and query times")
+    index.add_argument("--docs", type=int, default=1000000, help="Number of synthetic descriptions")
+    index.add_argument("--queries", nargs="+", default=["cat", "red car", "snowy mountain", "bicyc", "zebra"],
+                       help="Search strings to time")
+    index.add_argument("--limit", type=int, default=50, help="Results ranked per query")
+    index.add_argument("--repeat", type=int, default=5, help="Timed runs per query (median reported)")
+    index.set_defaults(func=benchmark_index)
+
+    semantic = subparsers.add_parser("semantic", help="Semantic vector index build, load and IVF versus exact query times")
+    semantic.add_argument("--docs", type=int, default=1000000, help="Number of synthetic descriptions")
+    semantic.add_argument("--queries", nargs="+", default=["cat", "red car", "snowy mountain", "bicycle", "zebra"],
+                          help="Search strings to time")
+    semantic.add_argument("--limit", type=int, default=50, help="Results per query")
+    semantic.add_argument("--nprobe", type=int, default=16, help="Centroid lists scanned per query")
+    semantic.add_argument("--repeat", type=int, default=5, help="Timed runs per query (median reported)")
+    semantic.set_defaults(func=benchmark_semantic)
+
+    facets = subparsers.add_parser("facets", help="Faceted search with counts on the facet index versus GROUP BY queries")
+    facets.add_argument("--rows", type=int, default=1000000, help="Images in the facet index")
+    facets.add_argument("--folders", type=int, default=500, help="Number of synthetic folders")
+    facets.add_argument("--sql-rows", type=int, default=200000, help="Images in the SQL comparison (0 to skip)")
+    facets.add_argument("--repeat", type=int, default=5, help="Timed runs per search (median reported)")
+    facets.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    facets.set_defaults(func=benchmark_facets)
+
+    suggest = subparsers.add_parser("suggest", help="Typeahead suggestion latency versus a LIKE prefix GROUP BY")
+    suggest.add_argument("--rows", type=int, default=1000000, help="Images in the suggestion index")
+    suggest.add_argument("--distinct", type=int, default=20000, help="Distinct synthetic object names")
+    suggest.add_argument("--lookups", type=int, default=1000, help="Timed lookups per prefix length")
+    suggest.add_argument("--limit", type=int, default=5, help="Suggestions per lookup")
+    suggest.add_argument("--sql-rows", type=int, default=200000, help="Images in the SQL comparison (0 to skip)")
+    suggest.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    suggest.set_defaults(func=benchmark_suggest)
+
+    geo_parser = subparsers.add_parser("geo", help="Geohash bounding box, radius and map cluster queries")
+    geo_parser.add_argument("--rows", type=int, default=500000, help="Geotagged images to insert")
+    geo_parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query (median reported)")
+    geo_parser.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    geo_parser.set_defaults(func=benchmark_geo)
+
+    cache = subparsers.add_parser("cache", help="Search page reruns with and without the search result cache")
+    cache.add_argument("--images", type=int, default=20000, help="Number of synthetic images")
+    cache.add_argument("--reruns", type=int, default=500, help="Simulated search page reruns")
+    cache.add_argument("--reruns-per-query", type=int, default=5, help="Reruns before the query changes")
+    cache.add_argument("--write-every", type=int, default=50, help="Store a new result every N reruns (0 for never)")
+    cache.add_argument("--queries", nargs="+", default=["cat", "red car", "snowy mountain", "bicycle", "zebra"],
+                       help="Search strings cycled through")
+    cache.add_argument("--database-url", help="Database to benchmark against (default: a throwaway SQLite file)")
+    cache.set_defaults(func=benchmark_cache)
+
+    sqlite = subparsers.add_parser("sqlite", help="Local SQLite ingestion, search and analytics throughput, default versus tuned pragmas")
+    sqlite.add_argument("--commits", type=int, default=2000, help="Results stored with one commit each")
+    sqlite.add_argument("--rows", type=int, default=100000, help="Results stored through the batched writer")
+    sqlite.add_argument("--batch-size", type=int, default=500, help="Rows per upsert flush")
+    sqlite.add_argument("--queries", nargs="+", default=["cat", "red car", "snowy mountain", "bicyc", "zebra"],
+                        help="Search strings to time")
+    sqlite.add_argument("--repeat", type=int, default=5, help="Timed runs per query (median reported)")
+    sqlite.add_argument("--ablate", action="store_true", help="Also run the tuned pragmas without each one in turn")
+    sqlite.add_argument("--runs", type=int, default=1, help="Measurements per setting (medians reported)")
+    sqlite.set_defaults(func=benchmark_sqlite)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""
+Headless bulk analysis of image folders, for cron jobs and large ingests
+
+    python -m cli /photos/2024 /photos/2025 --concurrency 8
+    python -m cli /photos --output results.jsonl --resume
+    python -m cli /photos --dry-run
+    python -m cli /photos --recursive --exclude '.thumbnails' --include '*.jpg'
+
+Results go to the database by default, or to a JSONL file with --output.
+Progress lines with images/sec and ETA are logged to stderr.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from image_processor import (
+    iter_process_images, process_single_image, build_result_with_path,
+    build_error_result, DEFAULT_MAX_WORKERS
+)
+from utils import get_all_image_files
+
+logger = logging.getLogger("cli")
+
+def format_eta(seconds):
+    """
+    Format a duration in seconds as H:MM:SS
+    """
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+class ProgressReporter:
+    """
+    Log throughput and ETA at most once per ``interval`` seconds
+    """
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.last_report = 0.0
+
+    def update(self, failed=False):
+        self.done += 1
+        if failed:
+            self.failed += 1
+        now = time.time()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.time() - self.started_at
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = remaining / rate if rate > 0 else None
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        logger.info("[%d/%d] %.1f%% %.2f images/sec, %d failed, ETA %s",
+                    self.done, self.total, percent, rate, self.failed, format_eta(eta))
+
+def collect_images(folder_paths, recursive=False, include=None, exclude=None, max_depth=None):
+    """
+    Find the images under each folder root
+
+    Returns:
+        list: (folder_path, image_paths) tuples, skipping invalid folders
+    """
+    collected = []
+    for folder_path in folder_paths:
+        folder_path = os.path.abspath(folder_path)
+        if not os.path.isdir(folder_path):
+            logger.error("Not a folder: %s", folder_path)
+            continue
+        image_paths = get_all_image_files(folder_path, recursive=recursive, include=include,
+                                          exclude=exclude, max_depth=max_depth)
+        collected.append((folder_path, image_paths))
+    return collected
+
+def load_completed_paths(output_path):
+    """
+    Read the paths already analyzed successfully in a JSONL output file
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Ignore a line truncated by an interrupted run
+                continue
+            if "error" not in record:
+                completed.add(record.get("file_path"))
+    return completed
+
+def _ends_with_newline(path):
+    if os.path.getsize(path) == 0:
+        return True
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def _database_has_images():
+    """
+    Check, without creating anything, whether the database holds an images table
+    """
+    import sqlalchemy as sa
+    import database as db
+
+    url = sa.engine.make_url(db.DATABASE_URL)
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+            and not os.path.exists(url.database):
+        # Connecting would create the file
+        return False
+    return sa.inspect(db.get_engine()).has_table('images')
+
+def pending_against_manifest(folder_path, paths):
+    """
+    Read-only counterpart of sync_folder for dry runs
+
+    Keeps new images and images whose size and mtime no longer match the
+    stored manifest, unless their content hash still does. Nothing is
+    written: no folder is created and no manifest entry is updated.
+
+    Returns:
+        list: Image paths a real run would analyze
+    """
+    import database as db
+    from folder_sync import file_matches_record
+    from utils import compute_file_hash
+
+    folder = db.get_folder_by_path(folder_path) if _database_has_images() else None
+    manifest = db.get_folder_manifest(folder.id) if folder else {}
+    remaining = []
+    for path in paths:
+        record = manifest.get(path)
+        if record is not None:
+            try:
+                stat = os.stat(path)
+                if file_matches_record(record.file_size, record.file_mtime, stat):
+                    continue
+                if (record.content_hash and record.file_size == stat.st_size
+                        and compute_file_hash(path) == record.content_hash):
+                    continue
+            except OSError:
+                pass
+        remaining.append(path)
+    return remaining
+
+def skip_completed(folders, output_path=None, dry_run=False):
+    """
+    Drop images a previous run already analyzed
+
+    With a JSONL output file, images recorded there without an error are
+    skipped. Otherwise each folder is synced against its stored manifest:
+    only new and changed files are kept and deleted files are marked missing.
+    A dry run compares against the manifest without writing anything.
+
+    Returns:
+        list: (folder_path, image_paths) tuples with completed images removed
+    """
+    if output_path:
+        completed = load_completed_paths(output_path)
+        remaining = [(folder_path, [path for path in paths if path not in completed]) for folder_path, paths in folders]
+        skipped = sum(len(paths) for _, paths in folders) - sum(len(paths) for _, paths in remaining)
+        logger.info("Resuming: skipping %d images already analyzed", skipped)
+        return remaining
+
+    if dry_run:
+        remaining = [(folder_path, pending_against_manifest(folder_path, paths)) for folder_path, paths in folders]
+        skipped = sum(len(paths) for _, paths in folders) - sum(len(paths) for _, paths in remaining)
+        logger.info("Resuming: %d images unchanged since they were analyzed", skipped)
+        return remaining
+
+    import database as db
+    from folder_sync import sync_folder
+
+    remaining = []
+    for folder_path, paths in folders:
+        folder = db.add_folder(os.path.basename(folder_path) or folder_path, folder_path)
+        summary = sync_folder(folder.id, paths)
+        logger.info("Synced %s: %d new, %d changed, %d unchanged, %d missing",
+                    folder_path, len(summary['new']), len(summary['changed']),
+                    summary['unchanged'], summary['missing'])
+        remaining.append((folder_path, summary['new'] + summary['changed']))
+    return remaining
+
+def run_to_jsonl(folders, output_path, concurrency, resume):
+    """
+    Analyze images and write one JSON record per image to ``output_path``,
+    appending when resuming
+
+    Returns:
+        tuple: (done count, failed count)
+    """
+    image_paths = [path for _, paths in folders for path in paths]
+    progress = ProgressReporter(len(image_paths))
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as f:
+        if resume and not _ends_with_newline(output_path):
+            # Start on a fresh line when the previous run was cut off mid-record
+            f.write("\n")
+        for _, img_path, result, error in iter_process_images(image_paths, concurrency, process_single_image):
+            if error is not None:
+                logger.warning("Failed %s: %s", img_path, error)
+                record = build_error_result(img_path, error)
+                record["error"] = str(error)
+            else:
+                record = build_result_with_path(img_path, result)
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            progress.update(failed=error is not None)
+
+    return progress.done - progress.failed, progress.failed
+
+# Buffered database results are written when this many are waiting or
+# the oldest has waited this many seconds
+RESULT_BATCH_SIZE = 500
+RESULT_MAX_DELAY = 5.0
+
+class ResultBuffer:
+    """
+    Batch database writes for run_to_database and count every result of a
+    failed write as failed, not just the one that triggered it
+    """
+    def __init__(self, progress):
+        import database as db
+
+        self.progress = progress
+        # Flushed explicitly, so a failed write is always seen here
+        self.writer = db.ImageResultWriter(batch_size=None, max_delay=None)
+        self.last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        if (len(self.writer) >= RESULT_BATCH_SIZE
+                or (len(self.writer) and time.monotonic() - self.last_flush >= RESULT_MAX_DELAY)):
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        try:
+            self.writer.flush()
+        except Exception as e:
+            unstored = self.writer.discard()
+            logger.error("Failed to store %d results: %s", len(unstored), e)
+            # Already counted as done when they were buffered
+            self.progress.failed += len(unstored)
+
+def run_to_database(folders, concurrency):
+    """
+    Analyze images and store the results in the database, reusing cached
+    analyses of identical files
+
+    Returns:
+        tuple: (done count, failed count)
+    """
+    # Imported here so JSONL runs never open the database
+    import database as db
+    from worker import reuse_existing_analysis, store_analysis
+
+    pending = []
+    for folder_path, image_paths in folders:
+        folder = db.add_folder(os.path.basename(folder_path) or folder_path, folder_path)
+        pending.extend((folder.id, path) for path in image_paths)
+
+    progress = ProgressReporter(len(pending))
+    to_analyze = []
+    content_hashes = {}
+    # Results are written in bulk upserts rather than one commit per image
+    buffer = ResultBuffer(progress)
+    for folder_id, img_path in pending:
+        try:
+            source, content_hashes[img_path] = reuse_existing_analysis(
+                folder_id, img_path, check_stored=False, writer=buffer.writer, item=img_path
+            )
+        except Exception as e:
+            logger.warning("Failed %s: %s", img_path, e)
+            progress.update(failed=True)
+            continue
+        if source:
+            progress.update()
+            buffer.maybe_flush()
+        else:
+            to_analyze.append((folder_id, img_path))
+
+    outcomes = iter_process_images([path for _, path in to_analyze], concurrency, process_single_image)
+    for index, img_path, result, error in outcomes:
+        try:
+            if error is not None:
+                raise error
+            store_analysis(to_analyze[index][0], img_path, result, content_hashes.get(img_path),
+                           writer=buffer.writer, item=img_path)
+        except Exception as e:
+            logger.warning("Failed %s: %s", img_path, e)
+            progress.update(failed=True)
+            continue
+        progress.update()
+        buffer.maybe_flush()
+    buffer.flush()
+
+    return progress.done - progress.failed, progress.failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Analyze image folders without the Streamlit UI")
+    parser.add_argument("folders", nargs="+", help="Folder roots to analyze")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_WORKERS, help="Images analyzed in parallel")
+    parser.add_argument("--output", default=None, help="Write JSONL to this file instead of the database")
+    parser.add_argument("--resume", action="store_true", help="Skip images already analyzed and unchanged since a previous run")
+    parser.add_argument("--dry-run", action="store_true", help="List the images that would be analyzed and exit")
+    parser.add_argument("--recursive", action="store_true", help="Include images in subfolders")
+    parser.add_argument("--max-depth", type=int, default=None, help="Subfolder depth limit with --recursive")
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB",
+                        help="Only analyze files matching this pattern (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="Skip files and folders matching this pattern (repeatable)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if not args.output and not args.dry_run:
+        # Database runs need the current schema; JSONL runs never connect and
+        # dry runs only read
+        from migrations import migrate
+        migrate()
+
+    folders = collect_images(args.folders, recursive=args.recursive, include=args.include,
+                             exclude=args.exclude, max_depth=args.max_depth)
+    total = sum(len(paths) for _, paths in folders)
+    logger.info("Found %d images in %d folders", total, len(folders))
+    if args.resume:
+        folders = skip_completed(folders, args.output, dry_run=args.dry_run)
+
+    if args.dry_run:
+        for _, paths in folders:
+            for path in paths:
+                print(path)
+        return 0
+
+    start = time.time()
+    if args.output:
+        done, failed = run_to_jsonl(folders, args.output, args.concurrency, args.resume)
+    else:
+        done, failed = run_to_database(folders, args.concurrency)
+    elapsed = time.time() - start
+
+    logger.info("Finished: %d analyzed, %d failed in %s (%.2f images/sec)",
+                done, failed, format_eta(elapsed), (done + failed) / elapsed if elapsed > 0 else 0.0)
+
+    # Non-zero exit lets cron flag runs with failures
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
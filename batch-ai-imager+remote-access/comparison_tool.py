@@ -2,9 +2,11 @@
 import streamlit as st
 import os
 import pandas as pd
-from database import get_db, Image, Folder
+from database import get_images_by_ids, get_images_page, get_folder_choices, with_session_scope
+from pagination import get_page_cursor, show_page_controls
 import difflib
 
+@with_session_scope
 def show_comparison_page():
     """
     Display a comparison interface for multiple images
@@ -18,36 +20,32 @@ def show_comparison_page():
     </div>
     """, unsafe_allow_html=True)
     
-    # Get all images from database
-    db_session = next(get_db())
-    all_images = db_session.query(Image).all()
+    # Folders for the filter; images are loaded one page at a time below
+    folder_options = get_folder_choices()
     
-    if not all_images:
+    if not folder_options:
         st.info("No images available for comparison. Process some images first.")
         return
     
-    # Get images by folders for better organization
-    folders = db_session.query(Folder).all()
-    
     # Image selection
     st.subheader("Select Images to Compare")
     
     # Option to select by folder first
     use_folder_filter = st.checkbox("Filter by folder", value=True)
     
-    if use_folder_filter and folders:
+    selected_folder_id = None
+    if use_folder_filter:
         # Create folder selection
-        folder_options = [(f.id, f.name) for f in folders]
         selected_folder_id = st.selectbox(
             "Select Folder",
             options=[f[0] for f in folder_options],
             format_func=lambda x: next((f[1] for f in folder_options if f[0] == x), "")
         )
-        
-        # Filter images by folder
-        available_images = db_session.query(Image).filter(Image.folder_id == selected_folder_id).all()
-    else:
-        available_images = all_images
+    
+    # Filter images by folder
+    available_images, next_cursor = get_images_page(
+        selected_folder_id, get_page_cursor("comparison_images", reset_on=selected_folder_id)
+    )
     
     # Convert to dataframe for selection
     image_data = [{
@@ -74,22 +72,28 @@ def show_comparison_page():
         },
         hide_index=True
     )
+    show_page_controls("comparison_images", next_cursor, len(available_images))
+    
+    # Remember labels of images picked on other pages so they stay selectable
+    labels = st.session_state.setdefault("comparison_image_labels", {})
+    for img in available_images:
+        labels[img.id] = f"{img.file_name} ({img.object_name})"
+    selected = st.session_state.get("comparison_selected_ids", [])
+    options = list(dict.fromkeys(selected + image_df["id"].tolist()))
     
     # Multi-select images
     selected_image_ids = st.multiselect(
         "Select 2-4 images to compare",
-        options=image_df["id"].tolist(),
-        format_func=lambda x: f"{image_df[image_df['id'] == x]['file_name'].iloc[0]} ({image_df[image_df['id'] == x]['object_name'].iloc[0]})",
-        max_selections=4
+        options=options,
+        format_func=lambda x: labels.get(x, str(x)),
+        max_selections=4,
+        key="comparison_selected_ids"
     )
     
     # Proceed with comparison
     if len(selected_image_ids) >= 2:
-        # Get selected images
-        selected_images = [
-            db_session.query(Image).filter(Image.id == img_id).first()
-            for img_id in selected_image_ids
-        ]
+        # Get selected images with their folders in one query
+        selected_images = get_images_by_ids(selected_image_ids)
         
         show_image_comparison(selected_images)
     elif selected_image_ids:
@@ -6,6 +6,7 @@ from database import update_favorite_order, remove_from_favorites
 import database as db
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
+@db.with_session_scope
 def show_image_dashboard_page():
     """
     Display the customizable dashboard with pinned favorite images
@@ -332,18 +333,7 @@ def show_add_favorite_dialog():
     st.subheader("Add to Dashboard")
     
     # Get all images not in favorites
-    db_session = next(db.get_db())
-    all_images = db_session.query(db.Image).all()
-    
-    # Filter to images not in favorites
-    non_favorite_images = []
-    for image in all_images:
-        is_favorite = db_session.query(db.FavoriteImage).filter(
-            db.FavoriteImage.image_id == image.id
-        ).first()
-        
-        if not is_favorite:
-            non_favorite_images.append(image)
+    non_favorite_images = db.get_non_favorite_images()
     
     if not non_favorite_images:
         st.info("All images are already in your dashboard")
@@ -387,7 +377,7 @@ def show_create_favorite_form(image_id):
     Show form to create a new favorite
     """
     # Get image details
-    db_session = next(db.get_db())
+    db_session = db.get_db()
     image = db_session.query(db.Image).filter(db.Image.id == image_id).first()
     
     if not image:
@@ -621,6 +611,7 @@ from sqlalchemy import func, desc
 import datetime
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
+@db.with_session_scope
 def show_dashboard_page():
     """
     Display the dashboard with both analytics and image dashboard
@@ -648,7 +639,7 @@ def show_analytics_dashboard():
     """, unsafe_allow_html=True)
 
     # Get database statistics
-    db_session = next(get_db())
+    db_session = get_db()
     image_count = db_session.query(func.count(Image.id)).scalar()
     folder_count = db_session.query(func.count(Folder.id)).scalar()
 
@@ -690,10 +681,7 @@ def show_analytics_dashboard():
     with tab1:
         st.subheader("Most Common Objects")
         # Get top objects
-        top_objects = db_session.query(
-            Image.object_name, 
-            func.count(Image.id).label('count')
-        ).group_by(Image.object_name).order_by(desc('count')).limit(10).all()
+        top_objects = db.get_image_value_counts(Image.object_name, limit=10)
 
         if top_objects:
             # Convert to DataFrame
@@ -717,10 +705,7 @@ def show_analytics_dashboard():
         st.subheader("Processing Activity")
 
         # Get processing by date
-        processing_dates = db_session.query(
-            func.date(Image.processed_at).label('date'),
-            func.count(Image.id).label('count')
-        ).group_by('date').order_by('date').all()
+        processing_dates = db.get_images_per_day()
 
         if processing_dates:
             # Convert to DataFrame
@@ -746,10 +731,7 @@ def show_analytics_dashboard():
         # Try to get camera distribution if metadata exists
         camera_data = []
         try:
-            camera_models = db_session.query(
-                Image.camera_model, 
-                func.count(Image.id).label('count')
-            ).filter(Image.camera_model.isnot(None)).group_by(Image.camera_model).order_by(desc('count')).limit(5).all()
+            camera_models = db.get_image_value_counts(Image.camera_model, limit=5)
 
             if camera_models:
                 for model, count in camera_models:
@@ -779,10 +761,7 @@ def show_analytics_dashboard():
             # Try to get file type distribution
             file_types = []
             try:
-                types = db_session.query(
-                    Image.file_type, 
-                    func.count(Image.id).label('count')
-                ).filter(Image.file_type.isnot(None)).group_by(Image.file_type).order_by(desc('count')).all()
+                types = db.get_image_value_counts(Image.file_type)
 
                 if types:
                     for file_type, count in types:
@@ -1,32 +1,141 @@
 import os
 import sqlalchemy as sa
 import json
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, Boolean, ForeignKey, func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship, joinedload
+from sqlalchemy.dialects.postgresql import JSONB
 import datetime
+import uuid
+import time
+import functools
+import heapq
+import threading
+from contextlib import contextmanager
+from query_cache import QueryCache, normalize_query
+import geo
 
-# Get database URL from environment variables
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-# Modify URL for connection pooling
-if DATABASE_URL:
-    pool_url = DATABASE_URL.replace('.us-east-2', '-pooler.us-east-2')
-    # Create SQLAlchemy engine with connection pool
-    engine = create_engine(
-        pool_url,
-        pool_size=5,
-        max_overflow=10,
-        pool_timeout=30,
-        pool_recycle=1800,
-        pool_pre_ping=True
-    )
-else:
-    raise Exception("DATABASE_URL environment variable not set")
+# Get database URL from environment variables; without one the app keeps its
+# data in a SQLite file next to the code, so it runs with no database server
+DEFAULT_DATABASE_URL = "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_analyzer.db")
+DATABASE_URL = os.environ.get("DATABASE_URL") or DEFAULT_DATABASE_URL
+
+# Set to 1 to connect through the provider's connection pooler host
+# (the "-pooler" endpoint next to the database host) instead of the database directly
+DATABASE_USE_POOLER = os.environ.get("DATABASE_USE_POOLER", "").lower() in ("1", "true", "yes")
+
+# Applied to every SQLite connection. Each pragma is measured with
+# `python benchmark.py sqlite --ablate --runs 3`:
+# - WAL lets readers run alongside the writer: without it single-row commits
+#   drop from 123 to 98/s and a polling dashboard from 446 to 346 reads/s
+# - NORMAL sync only fsyncs at checkpoints (safe under WAL, a crash can lose
+#   the last commits but never corrupts): 123 against 110 commits/s with FULL
+# - busy_timeout makes writers wait for the lock instead of failing
+# mmap_size, cache_size and temp_store made no difference beyond run-to-run
+# noise on any figure, so SQLite's defaults are kept for them
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 30000,
+}
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _pooler_url(url):
+    """
+    Point a database URL at the pooler endpoint of its host
+    """
+    host = url.host or ''
+    endpoint, _, domain = host.partition('.')
+    if not domain or endpoint.endswith('-pooler'):
+        return url
+    return url.set(host=f"{endpoint}-pooler.{domain}")
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Leave transactions to _begin_sqlite: pysqlite only emits BEGIN before
+    # its first write, so a SAVEPOINT could open and commit a transaction
+    # of its own
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def _begin_sqlite(conn):
+    # A connection with execution_options(sqlite_begin="IMMEDIATE") takes
+    # the write lock as soon as its transaction begins
+    conn.exec_driver_sql("BEGIN " + conn.get_execution_options().get("sqlite_begin", "DEFERRED"))
+
+def _engine_options(url):
+    """
+    Get create_engine keyword arguments for the database backend
+    
+    Args:
+        url: SQLAlchemy URL of the database
+        
+    Returns:
+        dict: Pool and driver options
+    """
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # Every connection to :memory: is a new empty database, so share one
+            return {"poolclass": sa.pool.StaticPool, "connect_args": {"check_same_thread": False}}
+        # SQLite has a single writer, so a few connections cover the worker
+        # threads; waits for the write lock are bounded by busy_timeout
+        return {
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000},
+            "pool_size": 5,
+            "max_overflow": 5,
+            "pool_timeout": 30,
+        }
+    return {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
+
+def get_engine():
+    """
+    Get the SQLAlchemy engine, creating it on first use
+    
+    Importing this module does not touch the database; the engine and its
+    connection pool are created when the first query runs. The schema is
+    managed by the migrations module.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = sa.engine.make_url(DATABASE_URL)
+                if DATABASE_USE_POOLER and url.get_backend_name() != 'sqlite':
+                    url = _pooler_url(url)
+                engine = create_engine(
+                    url,
+                    # Metadata can hold EXIF values json cannot encode natively
+                    json_serializer=lambda value: json.dumps(value, default=str),
+                    **_engine_options(url)
+                )
+                if url.get_backend_name() == 'sqlite':
+                    sa.event.listen(engine, "connect", _set_sqlite_pragmas)
+                    sa.event.listen(engine, "begin", _begin_sqlite)
+                _engine = engine
+    return _engine
+
+def __getattr__(name):
+    # database.engine keeps working for callers, created lazily
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Create declarative base
 Base = declarative_base()
 
+# JSONB on PostgreSQL, JSON text elsewhere; None is stored as SQL NULL
+MetadataJSON = sa.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql')
+
 # Define models
 class Folder(Base):
     """
@@ -55,17 +164,19 @@ class Image(Base):
     folder_id = Column(Integer, ForeignKey('folders.id'), nullable=False)
     file_name = Column(String(255), nullable=False)
     file_path = Column(String(512), nullable=False, unique=True)
-    object_name = Column(String(255))
+    # Indexed columns back the dashboard's group-bys and ordering, which read
+    # only the index (count(*) per value) instead of the table
+    object_name = Column(String(255), index=True)
     description = Column(Text)
-    confidence = Column(Float)
-    processed_at = Column(DateTime, default=datetime.datetime.utcnow)
+    confidence = Column(Float, index=True)
+    processed_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     
     # Metadata fields
-    metadata_json = Column(Text, nullable=True)  # Stores all metadata as JSON
+    metadata_json = Column(MetadataJSON, nullable=True)  # All metadata as a JSON document
     width = Column(Integer, nullable=True)
     height = Column(Integer, nullable=True)
     camera_make = Column(String(255), nullable=True)
-    camera_model = Column(String(255), nullable=True)
+    camera_model = Column(String(255), nullable=True, index=True)
     date_taken = Column(DateTime, nullable=True)
     focal_length = Column(Float, nullable=True)
     exposure_time = Column(String(50), nullable=True)
@@ -73,14 +184,29 @@ class Image(Base):
     iso_speed = Column(Integer, nullable=True)
     gps_latitude = Column(Float, nullable=True)
     gps_longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True)  # Derived from the GPS coordinates, see geo
     file_size = Column(Integer, nullable=True)
-    file_type = Column(String(50), nullable=True)
+    file_type = Column(String(50), nullable=True, index=True)
+    
+    # Manifest fields used by incremental folder syncs
+    file_mtime = Column(Float, nullable=True)  # Modification time when analyzed
+    content_hash = Column(String(64), nullable=True, index=True)
+    missing = Column(Boolean, default=False, nullable=False)  # File deleted from disk
     
     # Relationship with folder
     folder = relationship("Folder", back_populates="images")
     # Relationship with favorites
     favorites = relationship("FavoriteImage", back_populates="image", cascade="all, delete-orphan")
     
+    # Seek index for paging through a folder by file name; its folder_id
+    # prefix also serves folder filters and joins
+    __table_args__ = (
+        sa.Index('ix_images_folder_file_name', 'folder_id', 'file_name', 'id'),
+        # Spatial index: bounding boxes are geohash prefix ranges, and the
+        # coordinate and id columns let map clustering read only the index
+        sa.Index('ix_images_geohash', 'geohash', 'gps_latitude', 'gps_longitude', 'id'),
+    )
+    
     def __repr__(self):
         return f"<Image(file_name='{self.file_name}', object_name='{self.object_name}')>"
 
@@ -91,7 +217,7 @@ class FavoriteImage(Base):
     __tablename__ = 'favorite_images'
     
     id = Column(Integer, primary_key=True)
-    image_id = Column(Integer, ForeignKey('images.id'), nullable=False)
+    image_id = Column(Integer, ForeignKey('images.id'), nullable=False, unique=True, index=True)  # One favorite per image
     display_order = Column(Integer, default=0)  # For customizing display order
     note = Column(Text, nullable=True)  # User's note about why this is favorited
     custom_label = Column(String(255), nullable=True)  # Custom label for the image
@@ -103,56 +229,495 @@ class FavoriteImage(Base):
     def __repr__(self):
         return f"<FavoriteImage(image_id='{self.image_id}', custom_label='{self.custom_label}')>"
 
-# Create all tables in the database
-Base.metadata.create_all(engine)
+class AnalysisCache(Base):
+    """
+    Stores analysis results keyed by a hash of the image file contents,
+    so identical images at different paths are only analyzed once
+    """
+    __tablename__ = 'analysis_cache'
+    
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False, unique=True)
+    object_name = Column(String(255))
+    description = Column(Text)
+    confidence = Column(Float)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<AnalysisCache(content_hash='{self.content_hash}', object_name='{self.object_name}')>"
+
+class WriteGeneration(Base):
+    """
+    Single-row counter incremented in every transaction that changes images
+    or favorites, so query caches in the app, workers and CLI notice each
+    other's writes
+    """
+    __tablename__ = 'write_generation'
+    
+    id = Column(Integer, primary_key=True)
+    generation = Column(sa.BigInteger, nullable=False, default=0)
+    # Incremented by a trigger on every DELETE from images, so in-process
+    # indexes know to drop rows they can no longer find by processed_at
+    image_deletions = Column(sa.BigInteger, nullable=False, default=0)
+
+# Processing job states
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
 
-# Create a session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Job item states
+ITEM_PENDING = 'pending'
+ITEM_IN_FLIGHT = 'in_flight'
+ITEM_DONE = 'done'
+ITEM_FAILED = 'failed'
 
-def get_db():
+class ProcessingJob(Base):
     """
-    Get a database session
+    Represents a batch of images queued for analysis, so interrupted runs can resume
     """
-    db = SessionLocal()
+    __tablename__ = 'processing_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    folder_id = Column(Integer, ForeignKey('folders.id'), nullable=False)
+    name = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default=JOB_PENDING)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    # Progress and throughput statistics
+    total_items = Column(Integer, default=0)
+    done_items = Column(Integer, default=0)
+    failed_items = Column(Integer, default=0)
+    run_count = Column(Integer, default=0)
+    processing_seconds = Column(Float, default=0.0)  # Wall time across all runs
+    images_per_second = Column(Float, nullable=True)
+    
+    # Relationships
+    folder = relationship("Folder")
+    items = relationship("JobItem", back_populates="job", cascade="all, delete-orphan")
+    
+    def __repr__(self):
+        return f"<ProcessingJob(name='{self.name}', status='{self.status}')>"
+
+class JobItem(Base):
+    """
+    Represents one image within a processing job and its processing state
+    """
+    __tablename__ = 'job_items'
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('processing_jobs.id'), nullable=False, index=True)
+    file_path = Column(String(512), nullable=False)
+    state = Column(String(20), nullable=False, default=ITEM_PENDING)
+    attempts = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    worker_id = Column(String(255), nullable=True)  # Worker that claimed the item
+    claim_token = Column(String(32), nullable=True, index=True)
+    result_source = Column(String(20), nullable=True)  # 'stored', 'cache' or 'analyzed'
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    # Relationship with job
+    job = relationship("ProcessingJob", back_populates="items")
+    
+    def __repr__(self):
+        return f"<JobItem(file_path='{self.file_path}', state='{self.state}')>"
+
+# Whether the PostgreSQL search column and its GIN index exist; None until checked
+_full_text_search_enabled = None
+
+def is_full_text_search_enabled():
+    """
+    Check whether the full-text search migration built its search index
+    
+    Checked once per process; the migrations module resets the check after
+    changing the schema.
+    """
+    global _full_text_search_enabled
+    if _full_text_search_enabled is None:
+        engine = get_engine()
+        enabled = False
+        if get_engine().dialect.name == 'postgresql':
+            indexes = {index['name'] for index in sa.inspect(engine).get_indexes('images')}
+            enabled = 'ix_images_search_vector' in indexes
+        _full_text_search_enabled = enabled
+    return _full_text_search_enabled
+
+def reset_schema_checks():
+    """
+    Forget cached schema checks, after migrations ran
+    """
+    global _full_text_search_enabled
+    _full_text_search_enabled = None
+
+# Create a session factory. Objects stay usable after commit, so results
+# returned from a scope can still be read once the scope has closed.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+
+def _new_session():
+    return SessionLocal(bind=get_engine())
+
+# One session per thread, shared by every scope nested inside the outermost one
+ScopedSession = scoped_session(_new_session)
+_scope_state = threading.local()
+
+def _after_commit(db, fn, *args):
+    """
+    Call ``fn(*args)`` once the outermost scope has committed the session's
+    transaction; nothing is called if the write is rolled back
+    """
+    db.info.setdefault('after_commit', []).append((fn, args))
+
+def _end_scope(session, savepoint, failed, first_callback):
+    """
+    Commit or roll back a scope: its savepoint for an inner scope, the
+    session's transaction for the outermost one
+    """
+    callbacks = session.info.setdefault('after_commit', [])
+    transaction = savepoint if savepoint is not None else session
+    if failed:
+        transaction.rollback()
+        del callbacks[first_callback:]
+        return
     try:
-        return db
+        transaction.commit()
+    except Exception:
+        _end_scope(session, savepoint, True, first_callback)
+        raise
+    if savepoint is None:
+        for fn, args in session.info.pop('after_commit'):
+            fn(*args)
+
+@contextmanager
+def session_scope():
+    """
+    Provide a transactional scope around a series of operations
+    
+    Scopes nest: inner scopes reuse the thread's current session inside a
+    savepoint, so an error rolls back only the inner scope's work. The
+    outermost scope commits and then releases the session and its pooled
+    connection. Functions called inside a scope must not commit or roll
+    back the session themselves.
+    
+    Usage:
+        with session_scope() as db:
+            db.query(...)
+    """
+    session = ScopedSession()
+    depth = getattr(_scope_state, 'depth', 0)
+    _scope_state.depth = depth + 1
+    first_callback = len(session.info.setdefault('after_commit', []))
+    try:
+        savepoint = session.begin_nested() if depth else None
+        try:
+            yield session
+        except BaseException as e:
+            # st.rerun() and st.stop() end a Streamlit page render early;
+            # they are not errors, so the render's writes are kept
+            failed = isinstance(e, (Exception, KeyboardInterrupt, SystemExit))
+            raise
+        else:
+            failed = False
+        finally:
+            _end_scope(session, savepoint, failed, first_callback)
     finally:
-        db.close()
+        _scope_state.depth = depth
+        if depth == 0:
+            ScopedSession.remove()
+
+def with_session_scope(fn):
+    """
+    Decorator that runs ``fn`` inside session_scope
+    
+    Used for Streamlit page renders, so every query in one render shares a
+    single session and relationships can be loaded lazily while rendering.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with session_scope():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def get_db():
+    """
+    Get the current thread's database session
+    
+    Call this inside session_scope (or a function decorated with
+    with_session_scope) so the session is released when the scope ends.
+    """
+    return ScopedSession()
+
+def remove_session():
+    """
+    Close and discard the current thread's session, returning its connection
+    to the pool
+    """
+    ScopedSession.remove()
 
 # Database operations
 def get_all_folders():
     """
     Get all folders from the database
     """
-    db = get_db()
-    return db.query(Folder).order_by(Folder.processed_at.desc()).all()
+    with session_scope() as db:
+        return db.query(Folder).order_by(Folder.processed_at.desc()).all()
+
+def get_all_folders_with_image_counts():
+    """
+    Get all folders with the number of images in each, in one query
+    
+    Returns:
+        List of (Folder, image_count) tuples, most recently processed first
+    """
+    with session_scope() as db:
+        return db.query(Folder, func.count(Image.id)).outerjoin(
+            Image, Image.folder_id == Folder.id
+        ).group_by(Folder.id).order_by(Folder.processed_at.desc()).all()
+
+def value_counts_query(db, column, limit=None):
+    """
+    Build a query counting images per non-null value of an Image column,
+    most common first
+
+    Counts rows with count(*) rather than count(id), so with an index on
+    the column the database answers from the index alone.
+
+    Args:
+        db: Session to build the query on
+        column: Image column to group by
+        limit: Optional number of values to return
+    """
+    query = db.query(column, func.count().label('count')).filter(
+        column.isnot(None)
+    ).group_by(column).order_by(sa.desc('count'))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def get_image_value_counts(column, limit=None):
+    """
+    Get (value, count) tuples for an Image column, see value_counts_query
+    """
+    with session_scope() as db:
+        return value_counts_query(db, column, limit).all()
+
+def images_per_day_query(db):
+    """
+    Build a query counting images processed per day, oldest first
+    """
+    day = func.date(Image.processed_at).label('date')
+    return db.query(day, func.count().label('count')).filter(
+        Image.processed_at.isnot(None)
+    ).group_by(day).order_by(day)
+
+def get_images_per_day():
+    """
+    Get (date, count) tuples of images processed per day
+    """
+    with session_scope() as db:
+        return images_per_day_query(db).all()
+
+def get_folder_choices():
+    """
+    Get (id, name) tuples of all folders, for folder pickers
+    """
+    with session_scope() as db:
+        return db.query(Folder.id, Folder.name).order_by(Folder.name, Folder.id).all()
+
+def get_folders_page(cursor=None, page_size=None):
+    """
+    Get one page of folders with their image counts, most recently
+    processed first
+    
+    Args:
+        cursor: next_cursor of the previous page, or None for the first page
+        page_size: Rows per page (defaults to DEFAULT_PAGE_SIZE)
+        
+    Returns:
+        Tuple of (rows, next_cursor); rows have id, name, path, processed_at
+        and image_count
+    """
+    with session_scope() as db:
+        image_count = db.query(func.count(Image.id)).filter(
+            Image.folder_id == Folder.id
+        ).correlate(Folder).scalar_subquery()
+        query = db.query(Folder.id, Folder.name, Folder.path, Folder.processed_at,
+                         image_count.label('image_count'))
+        return keyset_page(query, Folder.processed_at, Folder.id, cursor, page_size, descending=True)
+
+def get_folder_by_id(folder_id):
+    """
+    Get a folder by its ID
+    """
+    with session_scope() as db:
+        return db.query(Folder).filter(Folder.id == folder_id).first()
 
 def get_folder_by_path(path):
     """
     Get a folder by its path
     """
-    db = get_db()
-    return db.query(Folder).filter(Folder.path == path).first()
+    with session_scope() as db:
+        return db.query(Folder).filter(Folder.path == path).first()
 
 def add_folder(name, path):
     """
     Add a new folder to the database
     """
-    db = get_db()
+    with session_scope() as db:
+        # Check if folder already exists
+        existing_folder = db.query(Folder).filter(Folder.path == path).first()
+        if existing_folder:
+            return existing_folder
+    
+        # Create new folder
+        folder = Folder(name=name, path=path)
+        db.add(folder)
+        db.flush()
+        return folder
+
+# Image columns filled from the metadata dictionary
+IMAGE_METADATA_FIELDS = [
+    'width', 'height', 'camera_make', 'camera_model', 'date_taken', 'focal_length', 'exposure_time',
+    'aperture', 'iso_speed', 'gps_latitude', 'gps_longitude', 'file_size', 'file_type', 'file_mtime'
+]
+
+# Callbacks run after image rows are written, e.g. to refresh a search index
+_image_write_listeners = []
+
+def add_image_write_listener(listener):
+    """
+    Register a function called with the list of written file paths after
+    add_image_result or upsert_image_results stores rows
+    """
+    if listener not in _image_write_listeners:
+        _image_write_listeners.append(listener)
+
+# Incremented by every write that can change search results; cached results
+# computed under an older generation are discarded
+_write_generation = 0
+_write_generation_lock = threading.Lock()
+
+# The stored generation (see WriteGeneration) is re-read at most this
+# often, which bounds how long a write from another process, such as a
+# worker, can stay hidden behind cached results
+WRITE_GENERATION_POLL_SECONDS = float(os.environ.get("WRITE_GENERATION_POLL_SECONDS", "1"))
+_stored_generation = None
+_stored_generation_checked_at = None
+
+def stamp_write(db):
+    """
+    Increment the stored write generation in the session's transaction
     
-    # Check if folder already exists
-    existing_folder = db.query(Folder).filter(Folder.path == path).first()
-    if existing_folder:
-        return existing_folder
+    Call inside the scope of a write that can change search results, so
+    other processes see the new generation together with the data. This
+    process's generation is bumped once the write has committed.
+    """
+    db.execute(
+        sa.update(WriteGeneration).where(WriteGeneration.id == 1)
+        .values(generation=WriteGeneration.generation + 1)
+    )
+    _after_commit(db, bump_write_generation)
+
+def bump_write_generation():
+    """
+    Invalidate this process's cached query results after a write
+    
+    The write functions in this module have it called after their scope
+    commits, through stamp_write; code that writes with raw SQL or bulk
+    session operations should call it too, and call stamp_write in its
+    transaction if other processes may cache results.
+    """
+    global _write_generation
+    with _write_generation_lock:
+        _write_generation += 1
+
+def _get_stored_generation():
+    global _stored_generation, _stored_generation_checked_at
+    now = time.monotonic()
+    with _write_generation_lock:
+        if (_stored_generation_checked_at is not None
+                and now - _stored_generation_checked_at < WRITE_GENERATION_POLL_SECONDS):
+            return _stored_generation
+    try:
+        with session_scope() as db:
+            generation = db.query(WriteGeneration.generation).filter(WriteGeneration.id == 1).scalar()
+    except sa.exc.SQLAlchemyError:
+        # Not migrated yet; local writes still invalidate
+        generation = None
+    with _write_generation_lock:
+        _stored_generation = generation
+        _stored_generation_checked_at = now
+    return generation
+
+def get_write_generation():
+    """
+    Get the current write generation: the writes made by this process and
+    the stored generation, which also counts writes by other processes
+    """
+    return _write_generation, _get_stored_generation()
+
+def get_image_deletions():
+    """
+    Get the number of DELETE statements run on the images table so far
+
+    Returns:
+        int: The counter, or None before the migrations have created it
+    """
+    try:
+        with session_scope() as db:
+            return db.query(WriteGeneration.image_deletions).filter(WriteGeneration.id == 1).scalar()
+    except sa.exc.SQLAlchemyError:
+        return None
+
+def _notify_image_write(file_paths):
+    bump_write_generation()
+    for listener in _image_write_listeners:
+        try:
+            listener(file_paths)
+        except Exception as e:
+            print(f"Error in image write listener: {e}")
+
+def metadata_document(metadata):
+    """
+    Build the JSON document stored in Image.metadata_json
     
-    # Create new folder
-    folder = Folder(name=name, path=path)
-    db.add(folder)
-    db.commit()
-    db.refresh(folder)
-    return folder
+    Dates become ISO strings, and the pre-encoded 'metadata_json' copy that
+    extract_image_metadata adds is dropped.
+    """
+    document = {}
+    for key, value in metadata.items():
+        if key == 'metadata_json':
+            continue
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        document[key] = value
+    return document
+
+def _image_values(folder_id, file_name, file_path, object_name, description, confidence, metadata=None,
+                  content_hash=None):
+    """
+    Build the column values stored for one analyzed image
+    """
+    values = {
+        'folder_id': folder_id,
+        'file_name': file_name,
+        'file_path': file_path,
+        'object_name': object_name,
+        'description': description,
+        'confidence': confidence,
+        'processed_at': datetime.datetime.utcnow(),
+        'missing': False,
+        'content_hash': content_hash,
+        'metadata_json': metadata_document(metadata) if metadata else None,
+    }
+    for field in IMAGE_METADATA_FIELDS:
+        values[field] = metadata.get(field) if metadata else None
+    values['geohash'] = geo.encode(values['gps_latitude'], values['gps_longitude'])
+    return values
 
-def add_image_result(folder_id, file_name, file_path, object_name, description, confidence, metadata=None):
+def add_image_result(folder_id, file_name, file_path, object_name, description, confidence, metadata=None,
+                     content_hash=None):
     """
     Add an image analysis result to the database
     
@@ -164,125 +729,782 @@ def add_image_result(folder_id, file_name, file_path, object_name, description,
         description: Description of the image
         confidence: Confidence score of the analysis
         metadata: Dictionary containing image metadata
+        content_hash: Hash of the file contents, used by incremental syncs
     """
-    db = get_db()
-    
-    # Process metadata
-    metadata_json = None
-    width = None
-    height = None
-    camera_make = None
-    camera_model = None
-    date_taken = None
-    focal_length = None
-    exposure_time = None
-    aperture = None
-    iso_speed = None
-    gps_latitude = None
-    gps_longitude = None
-    file_size = None
-    file_type = None
-    
-    if metadata:
-        metadata_json = json.dumps(metadata)
-        width = metadata.get('width')
-        height = metadata.get('height')
-        camera_make = metadata.get('camera_make')
-        camera_model = metadata.get('camera_model')
-        date_taken = metadata.get('date_taken')
-        focal_length = metadata.get('focal_length')
-        exposure_time = metadata.get('exposure_time')
-        aperture = metadata.get('aperture')
-        iso_speed = metadata.get('iso_speed')
-        gps_latitude = metadata.get('gps_latitude')
-        gps_longitude = metadata.get('gps_longitude')
-        file_size = metadata.get('file_size')
-        file_type = metadata.get('file_type')
-    
-    # Check if image already exists
-    existing_image = db.query(Image).filter(Image.file_path == file_path).first()
-    if existing_image:
-        # Update existing image
-        existing_image.object_name = object_name
-        existing_image.description = description
-        existing_image.confidence = confidence
-        existing_image.processed_at = datetime.datetime.utcnow()
-        
-        # Update metadata if provided
-        if metadata:
-            existing_image.metadata_json = metadata_json
-            existing_image.width = width
-            existing_image.height = height
-            existing_image.camera_make = camera_make
-            existing_image.camera_model = camera_model
-            existing_image.date_taken = date_taken
-            existing_image.focal_length = focal_length
-            existing_image.exposure_time = exposure_time
-            existing_image.aperture = aperture
-            existing_image.iso_speed = iso_speed
-            existing_image.gps_latitude = gps_latitude
-            existing_image.gps_longitude = gps_longitude
-            existing_image.file_size = file_size
-            existing_image.file_type = file_type
+    with session_scope() as db:
+        values = _image_values(folder_id, file_name, file_path, object_name, description, confidence,
+                               metadata, content_hash)
+    
+        # Check if image already exists
+        existing_image = db.query(Image).filter(Image.file_path == file_path).first()
+        if existing_image:
+            # Update existing image
+            existing_image.object_name = object_name
+            existing_image.description = description
+            existing_image.confidence = confidence
+            existing_image.processed_at = values['processed_at']
+            existing_image.missing = False
+            if content_hash:
+                existing_image.content_hash = content_hash
+        
+            # Update metadata if provided
+            if metadata:
+                existing_image.metadata_json = values['metadata_json']
+                for field in IMAGE_METADATA_FIELDS + ['geohash']:
+                    setattr(existing_image, field, values[field])
             
-        db.commit()
-        return existing_image
-    
-    # Create new image
-    image = Image(
-        folder_id=folder_id,
-        file_name=file_name,
-        file_path=file_path,
-        object_name=object_name,
-        description=description,
-        confidence=confidence,
-        metadata_json=metadata_json,
-        width=width,
-        height=height,
-        camera_make=camera_make,
-        camera_model=camera_model,
-        date_taken=date_taken,
-        focal_length=focal_length,
-        exposure_time=exposure_time,
-        aperture=aperture,
-        iso_speed=iso_speed,
-        gps_latitude=gps_latitude,
-        gps_longitude=gps_longitude,
-        file_size=file_size,
-        file_type=file_type
+            stamp_write(db)
+            _after_commit(db, _notify_image_write, [file_path])
+            return existing_image
+    
+        # Create new image
+        image = Image(**values)
+        db.add(image)
+        db.flush()
+        stamp_write(db)
+        _after_commit(db, _notify_image_write, [file_path])
+        return image
+
+def upsert_image_results(rows, cache_entries=None):
+    """
+    Insert or update many analysis results in one statement
+    
+    Uses INSERT ... ON CONFLICT (file_path) DO UPDATE on PostgreSQL and
+    SQLite. Other databases fall back to add_image_result per row. As with
+    add_image_result, a row without metadata keeps the stored metadata.
+    
+    Args:
+        rows: List of dictionaries with the add_image_result arguments
+        cache_entries: Optional list of dictionaries with the
+            add_cached_analysis arguments, stored in the same transaction
+            so a cached analysis never exists without its image row
+    """
+    if not rows and not cache_entries:
+        return
+    
+    # Last write wins when the same path is buffered twice
+    values_by_path = {}
+    for row in rows:
+        values_by_path[row['file_path']] = _image_values(**row)
+    values = list(values_by_path.values())
+    # The first analysis of a given file content is kept
+    cache_by_hash = {}
+    for entry in cache_entries or []:
+        cache_by_hash.setdefault(entry['content_hash'], entry)
+    
+    dialect = get_engine().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        for row in rows:
+            add_image_result(**row)
+        for entry in cache_by_hash.values():
+            add_cached_analysis(**entry)
+        return
+    
+    stmt = insert(Image)
+    excluded = stmt.excluded
+    update = {
+        'object_name': excluded.object_name,
+        'description': excluded.description,
+        'confidence': excluded.confidence,
+        'processed_at': excluded.processed_at,
+        'missing': excluded.missing,
+    }
+    # Keep stored values where the new row has none
+    for field in IMAGE_METADATA_FIELDS + ['geohash', 'metadata_json', 'content_hash']:
+        update[field] = func.coalesce(excluded[field], Image.__table__.c[field])
+    stmt = stmt.on_conflict_do_update(index_elements=['file_path'], set_=update)
+    
+    with session_scope() as db:
+        # executemany; SQLAlchemy batches this into multi-row VALUES statements
+        if values:
+            db.execute(stmt, values)
+        if cache_by_hash:
+            db.execute(
+                insert(AnalysisCache).on_conflict_do_nothing(index_elements=['content_hash']),
+                [dict(entry, hit_count=0, created_at=datetime.datetime.utcnow()) for entry in cache_by_hash.values()]
+            )
+        if values:
+            stamp_write(db)
+            _after_commit(db, _notify_image_write, list(values_by_path))
+
+class ImageResultWriter:
+    """
+    Buffer analysis results and write them with upsert_image_results
+    
+    Rows stay buffered until a write succeeds, and each row can carry an
+    ``item`` tag such as the job item it belongs to: when a flush fails,
+    discard() returns the tags of every result that was not stored.
+    
+    The buffer is flushed when it holds ``batch_size`` rows or when the
+    oldest buffered row is ``max_delay`` seconds old (either check is off
+    when None), and on exit when used as a context manager. A flush
+    triggered by add() raises from add(). Safe to share between threads.
+    """
+    def __init__(self, batch_size=500, max_delay=5.0):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.rows = []
+        self.items = []
+        self.cache_entries = []
+        self.first_buffered_at = None
+        self.lock = threading.RLock()
+    
+    def add(self, item=None, cache=False, **row):
+        """
+        Buffer one result; takes the same arguments as add_image_result
+        
+        Args:
+            item: Tag for this result, returned by flush() and discard()
+            cache: Also store the analysis under the row's content_hash
+                (see add_cached_analysis), in the same transaction
+        """
+        with self.lock:
+            if not self.rows:
+                self.first_buffered_at = time.monotonic()
+            self.rows.append(row)
+            self.items.append(item)
+            if cache and row.get('content_hash'):
+                self.cache_entries.append({
+                    'content_hash': row['content_hash'],
+                    'object_name': row['object_name'],
+                    'description': row['description'],
+                    'confidence': row['confidence'],
+                })
+            due = ((self.batch_size is not None and len(self.rows) >= self.batch_size)
+                   or (self.max_delay is not None
+                       and time.monotonic() - self.first_buffered_at >= self.max_delay))
+        if due:
+            self.flush()
+    
+    def flush(self):
+        """
+        Write all buffered rows in one transaction
+        
+        If the write fails the rows stay buffered and the error is raised.
+        
+        Returns:
+            list: Item tags of the rows written
+        """
+        with self.lock:
+            # Held while writing so flushes from different threads stay ordered
+            upsert_image_results(self.rows, self.cache_entries)
+            return self.discard()
+    
+    def discard(self):
+        """
+        Drop the buffered rows, e.g. after a failed flush
+        
+        Returns:
+            list: Item tags of the dropped rows
+        """
+        with self.lock:
+            items = self.items
+            self.rows, self.items, self.cache_entries = [], [], []
+            self.first_buffered_at = None
+            return items
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+def get_folder_manifest(folder_id):
+    """
+    Load the stored manifest of a folder in one query
+    
+    Returns:
+        Dictionary mapping file path to a row with id, file_size,
+        file_mtime, content_hash and missing
+    """
+    with session_scope() as db:
+        rows = db.query(
+            Image.id, Image.file_path, Image.file_size, Image.file_mtime, Image.content_hash, Image.missing
+        ).filter(Image.folder_id == folder_id).all()
+        return {row.file_path: row for row in rows}
+
+def update_image_manifest(updates):
+    """
+    Bulk update manifest fields of existing images
+    
+    Args:
+        updates: List of dictionaries with an 'id' key and any of
+            file_size, file_mtime, content_hash and missing
+    """
+    if not updates:
+        return
+    with session_scope() as db:
+        db.bulk_update_mappings(Image, updates)
+        stamp_write(db)
+
+def get_images_by_ids(image_ids, chunk_size=500):
+    """
+    Get images with their folders for a list of IDs, one query per chunk
+    
+    Returns:
+        List of Image objects in the order of ``image_ids``
+    """
+    image_ids = list(image_ids)
+    by_id = {}
+    with session_scope() as db:
+        for start in range(0, len(image_ids), chunk_size):
+            chunk = image_ids[start:start + chunk_size]
+            images = db.query(Image).options(joinedload(Image.folder)).filter(Image.id.in_(chunk)).all()
+            by_id.update((img.id, img) for img in images)
+    return [by_id[image_id] for image_id in image_ids if image_id in by_id]
+
+DEFAULT_PAGE_SIZE = 50
+
+# Columns loaded for image listings; pages get plain rows, not ORM objects
+IMAGE_LISTING_COLUMNS = [
+    Image.id, Image.folder_id, Image.file_name, Image.file_path, Image.object_name, Image.description,
+    Image.confidence, Image.camera_make, Image.camera_model, Image.file_type, Image.processed_at
+]
+
+# Sort orders for image listings: name -> (column, descending)
+IMAGE_SORT_KEYS = {
+    'file_name': (Image.file_name, False),
+    'processed_at': (Image.processed_at, True),
+}
+
+def keyset_page(query, sort_column, id_column, cursor=None, page_size=None, descending=False):
+    """
+    Fetch one page of a query with keyset (seek) pagination
+    
+    Rows are ordered by (sort_column, id_column) and a page starts right
+    after the cursor row, so every page costs the same however deep it is,
+    unlike OFFSET. The sort column must not be NULL.
+    
+    Args:
+        query: Query selecting the rows, including both columns
+        sort_column: Column to order by
+        id_column: Unique tie breaker, usually the primary key
+        cursor: (sort value, id) of the last row of the previous page
+        page_size: Rows per page (defaults to DEFAULT_PAGE_SIZE)
+        descending: Order newest/largest first
+        
+    Returns:
+        Tuple of (rows, next_cursor); next_cursor is None on the last page
+    """
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    key = sa.tuple_(sort_column, id_column)
+    if cursor is not None:
+        query = query.filter(key < tuple(cursor) if descending else key > tuple(cursor))
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    
+    # One extra row tells whether another page follows
+    rows = query.limit(page_size + 1).all()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, (getattr(last, sort_column.key), getattr(last, id_column.key))
+
+def _image_listing_query(db, columns=None):
+    return db.query(*(columns or IMAGE_LISTING_COLUMNS), Folder.name.label('folder_name')).outerjoin(
+        Folder, Image.folder_id == Folder.id
     )
-    db.add(image)
-    db.commit()
-    db.refresh(image)
-    return image
+
+def get_images_page(folder_id=None, cursor=None, page_size=None, sort='file_name'):
+    """
+    Get one page of images as lightweight rows
+    
+    Args:
+        folder_id: Only images in this folder (all images if None)
+        cursor: next_cursor of the previous page, or None for the first page
+        page_size: Rows per page (defaults to DEFAULT_PAGE_SIZE)
+        sort: Key of IMAGE_SORT_KEYS
+        
+    Returns:
+        Tuple of (rows, next_cursor); rows have the IMAGE_LISTING_COLUMNS
+        plus folder_name
+    """
+    sort_column, descending = IMAGE_SORT_KEYS[sort]
+    with session_scope() as db:
+        query = _image_listing_query(db)
+        if folder_id is not None:
+            query = query.filter(Image.folder_id == folder_id)
+        return keyset_page(query, sort_column, Image.id, cursor, page_size, descending)
+
+def get_image_rows_by_ids(image_ids):
+    """
+    Get listing rows for a list of IDs, in the order of ``image_ids``
+    """
+    image_ids = list(image_ids)
+    if not image_ids:
+        return []
+    with session_scope() as db:
+        rows = _image_listing_query(db).filter(Image.id.in_(image_ids)).all()
+    by_id = {row.id: row for row in rows}
+    return [by_id[image_id] for image_id in image_ids if image_id in by_id]
+
+def iter_image_rows(folder_id=None, columns=None, batch_size=1000):
+    """
+    Stream image rows in id order, one short query per batch
+    
+    For exports and analyses that need every row without holding ORM
+    objects for the whole table.
+    
+    Args:
+        folder_id: Only images in this folder (all images if None)
+        columns: Image columns to load (defaults to IMAGE_LISTING_COLUMNS)
+        batch_size: Rows fetched per query
+        
+    Yields:
+        Rows with the requested columns plus folder_name
+    """
+    cursor = None
+    while True:
+        with session_scope() as db:
+            query = _image_listing_query(db, columns)
+            if folder_id is not None:
+                query = query.filter(Image.folder_id == folder_id)
+            if cursor is not None:
+                query = query.filter(Image.id > cursor)
+            rows = query.order_by(Image.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield from rows
+        cursor = rows[-1].id
+
+def iter_image_changes(columns, since=None, batch_size=5000):
+    """
+    Stream columns of images processed since a point in time, for keeping
+    in-process indexes in sync with the table
+    
+    Rows are read in batches by ascending id, so memory use stays flat on
+    large tables.
+    
+    Args:
+        columns: Image columns to load; id is always included
+        since: Only rows processed at or after this datetime (all rows if None)
+        batch_size: Rows fetched per query
+        
+    Yields:
+        Rows with id, processed_at and the requested columns
+    """
+    last_id = 0
+    while True:
+        with session_scope() as db:
+            query = db.query(Image.id, Image.processed_at, *columns).filter(Image.id > last_id)
+            if since is not None:
+                query = query.filter(Image.processed_at >= since)
+            rows = query.order_by(Image.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
 
 def get_images_by_folder_id(folder_id):
     """
     Get all images for a specific folder
+    
+    Loads every row; listings should use get_images_page instead.
     """
-    db = get_db()
-    return db.query(Image).filter(Image.folder_id == folder_id).all()
+    with session_scope() as db:
+        return db.query(Image).filter(Image.folder_id == folder_id).all()
 
 def get_image_by_path(file_path):
     """
     Get an image by its file path
     """
-    db = get_db()
-    return db.query(Image).filter(Image.file_path == file_path).first()
+    with session_scope() as db:
+        return db.query(Image).filter(Image.file_path == file_path).first()
 
-def search_images(query):
+def get_cached_analysis(content_hash):
     """
-    Search for images by object name, description, or metadata fields
+    Get a previous analysis result for identical file contents
+    
+    Args:
+        content_hash: Hash of the image file contents
+        
+    Returns:
+        AnalysisCache object or None
+    """
+    with session_scope() as db:
+        entry = db.query(AnalysisCache).filter(AnalysisCache.content_hash == content_hash).first()
+        if entry:
+            entry.hit_count = (entry.hit_count or 0) + 1
+        return entry
+
+def add_cached_analysis(content_hash, object_name, description, confidence):
+    """
+    Store an analysis result under the hash of the image file contents
+    
+    Args:
+        content_hash: Hash of the image file contents
+        object_name: Name of the object identified in the image
+        description: Description of the image
+        confidence: Confidence score of the analysis
+        
+    Returns:
+        The AnalysisCache object
+    """
+    with session_scope() as db:
+        # Keep the first analysis for a given hash
+        existing = db.query(AnalysisCache).filter(AnalysisCache.content_hash == content_hash).first()
+        if existing:
+            return existing
+    
+        entry = AnalysisCache(
+            content_hash=content_hash,
+            object_name=object_name,
+            description=description,
+            confidence=confidence
+        )
+        db.add(entry)
+        db.flush()
+        return entry
+
+def search_rank(query):
     """
-    db = get_db()
+    SQL expression ranking a row against a search, higher is better
+    
+    ts_rank with PostgreSQL full-text search; a constant elsewhere, where
+    results are ordered by id only.
+    """
+    if is_full_text_search_enabled():
+        return func.ts_rank(sa.literal_column('images.search_vector'), func.websearch_to_tsquery('english', query))
+    return sa.literal(0.0, sa.Float)
+
+def build_search_query(db, query):
+    """
+    Build the image search query for a session, without executing it
+    
+    With PostgreSQL full-text search, terms use websearch syntax (quoted
+    phrases, "or", -exclusions) against the indexed search_vector, and any
+    substring of an object name or description also matches through the
+    trigram indexes. Results are ordered by ts_rank. Other databases use
+    ILIKE matching over the text columns, which include the text EXIF
+    values (camera make and model, file type).
+    
+    Args:
+        db: Session to build the query on
+        query: Search text entered by the user
+        
+    Returns:
+        SQLAlchemy Query over Image
+    """
+    pattern = f"%{query}%"
+    if is_full_text_search_enabled():
+        tsquery = func.websearch_to_tsquery('english', query)
+        search_vector = sa.literal_column('images.search_vector')
+        return db.query(Image).filter(
+            search_vector.op('@@')(tsquery) |
+            Image.object_name.ilike(pattern) |
+            Image.description.ilike(pattern)
+        ).order_by(search_rank(query).desc(), Image.id.desc())
+    
     return db.query(Image).filter(
-        (Image.object_name.ilike(f"%{query}%")) | 
-        (Image.description.ilike(f"%{query}%")) |
-        (Image.camera_make.ilike(f"%{query}%")) |
-        (Image.camera_model.ilike(f"%{query}%")) |
-        (Image.file_type.ilike(f"%{query}%")) |
-        (Image.metadata_json.ilike(f"%{query}%"))
-    ).all()
+        (Image.object_name.ilike(pattern)) | 
+        (Image.description.ilike(pattern)) |
+        (Image.camera_make.ilike(pattern)) |
+        (Image.camera_model.ilike(pattern)) |
+        (Image.file_type.ilike(pattern))
+    )
+
+# Recent search results, so Streamlit reruns do not repeat the query; a
+# TTL bounds staleness when another process writes
+search_cache = QueryCache(get_write_generation, ttl=float(os.environ.get("SEARCH_CACHE_TTL", "30")))
+
+def get_search_cache_stats():
+    """
+    Get hit and miss counters of the search result cache, see QueryCache.stats
+    """
+    return search_cache.stats()
+
+def _get_search_backend(semantic):
+    if semantic:
+        from semantic_search import get_semantic_backend
+        return get_semantic_backend()
+    from search_index import get_search_backend
+    return get_search_backend()
+
+def search_images(query, limit=None, semantic=False):
+    """
+    Search for images by object name, description, or metadata fields
+    
+    The search runs on the backend chosen in search_index (SQL or the
+    embedded inverted index).
+    
+    Args:
+        query: Search text entered by the user
+        limit: Optional maximum number of results
+        semantic: Match object names and descriptions by meaning with the
+            vector index in semantic_search instead of by keyword
+        
+    Results are cached in search_cache until the next write.
+    
+    Returns:
+        List of Image objects with their folders loaded, best matches first
+        when ranking is available
+    """
+    key = ("images", normalize_query(query), limit, semantic)
+    return search_cache.get_or_compute(key, lambda: _get_search_backend(semantic).search(query, limit=limit))
+
+def search_images_page(query, cursor=None, page_size=None, semantic=False):
+    """
+    Get one page of search results as lightweight rows
+    
+    Pages are keyset paginated on (rank, id), best matches first, and
+    cached like search_images results.
+    
+    Args:
+        query: Search text entered by the user
+        cursor: next_cursor of the previous page, or None for the first page
+        page_size: Rows per page (defaults to DEFAULT_PAGE_SIZE)
+        semantic: Match by meaning instead of by keyword, see search_images
+        
+    Returns:
+        Tuple of (rows, next_cursor, total); rows are as in get_images_page
+        and total is the number of matching images (for semantic search,
+        the number of close matches considered)
+    """
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    key = ("page", normalize_query(query), cursor, page_size, semantic)
+    return search_cache.get_or_compute(
+        key, lambda: _get_search_backend(semantic).search_page(query, cursor, page_size)
+    )
+
+def _filters_key(filters):
+    # Hashable, order-independent form of a facet filter dictionary
+    return tuple(sorted(
+        (name, tuple(sorted(value, key=str)) if isinstance(value, (list, set)) else tuple(value))
+        for name, value in (filters or {}).items() if value
+    ))
+
+def _faceted_matches(query, filters, semantic):
+    from facets import get_facet_search
+
+    matched_ids = None
+    if normalize_query(query):
+        matched_ids = _get_search_backend(semantic).match_ids(query)
+    return get_facet_search().search(filters or {}, matched_ids)
+
+def faceted_search(query=None, filters=None, cursor=None, page_size=None, semantic=False):
+    """
+    Search images with facet filters and count the images for each facet value
+    
+    Filtering and counting run on the in-process facet index in the facets
+    module; the query, if any, is matched as in search_images. Results are
+    cached like search_images results.
+    
+    Args:
+        query: Optional search text
+        filters: Dictionary with lists of accepted values for camera_make,
+            camera_model, file_type and folder_id, and (min, max) tuples for
+            confidence and date_taken; either end of a range may be None
+        cursor: next_cursor of the previous page, or None for the first
+            page; an offset into the result list, which is held in memory
+        page_size: Rows per page (defaults to DEFAULT_PAGE_SIZE)
+        semantic: Match the query by meaning, see search_images
+        
+    Returns:
+        Tuple of (rows, next_cursor, total, facet_counts). Rows are as in
+        get_images_page, best matches first with a query and newest first
+        without. facet_counts maps camera_make, camera_model, file_type and
+        folder_id to (value, count) pairs, most common first; each facet is
+        counted with every filter applied except its own.
+    """
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    offset = cursor or 0
+
+    def run():
+        image_ids, facet_counts = _faceted_matches(query, filters, semantic)
+        page_ids = image_ids[offset:offset + page_size].tolist()
+        next_cursor = offset + page_size if len(image_ids) > offset + page_size else None
+        return get_image_rows_by_ids(page_ids), next_cursor, len(image_ids), facet_counts
+
+    key = ("facets", normalize_query(query), _filters_key(filters), offset, page_size, semantic)
+    return search_cache.get_or_compute(key, run)
+
+def get_faceted_image_ids(query=None, filters=None, semantic=False):
+    """
+    Get the ids of every image matching a faceted search, in result order
+    """
+    image_ids, _ = _faceted_matches(query, filters, semantic)
+    return image_ids.tolist()
+
+def suggest_search_terms(prefix, limit=5):
+    """
+    Suggest object names, camera makes and camera models for a partly typed search
+    
+    Served from the in-process index in the suggestions module, without
+    querying the images table.
+    
+    Args:
+        prefix: Text typed so far; matches the start of any word in a value
+        limit: Maximum number of suggestions
+        
+    Returns:
+        List of (field, value, image count) tuples, most common first
+    """
+    from suggestions import get_suggester
+    return get_suggester().suggest(prefix, limit)
+
+# Geospatial queries
+
+# Geohash prefixes a bounding box is covered with; adjacent prefixes merge
+# into one index range scan
+GEO_COVER_CELLS = 32
+# Cell budget when choosing the map cluster size; only cells holding
+# images produce a cluster
+MAP_MAX_CLUSTERS = 1024
+
+# First search radius for nearest-image queries; it grows fourfold per step
+NEAREST_START_KM = 0.1
+
+GEO_LISTING_COLUMNS = IMAGE_LISTING_COLUMNS + [Image.gps_latitude, Image.gps_longitude]
+
+def _geo_boxes(south, west, north, east):
+    if south > north:
+        raise ValueError("The south edge of a bounding box must not be north of its north edge")
+    return geo.split_antimeridian(south, west, north, east)
+
+def _geohash_ranges(boxes):
+    return geo.prefix_ranges(geo.cover(boxes, GEO_COVER_CELLS))
+
+def _inside_boxes(boxes):
+    # Exact test on the coordinates, for rows the geohash ranges over-cover
+    return sa.or_(*[
+        sa.and_(Image.gps_latitude.between(south, north), Image.gps_longitude.between(west, east))
+        for south, west, north, east in boxes
+    ])
+
+def _in_boxes(boxes):
+    ranges = [Image.geohash.between(low, high) for low, high in _geohash_ranges(boxes)]
+    return sa.and_(sa.or_(*ranges), _inside_boxes(boxes))
+
+def get_images_in_bbox(south, west, north, east, limit=500):
+    """
+    Get geotagged images inside a bounding box
+    
+    Reads the geohash ranges covering the box from ix_images_geohash one
+    after another, so a limited query over a large box stops early instead
+    of collecting and sorting every match.
+    
+    Args:
+        south, west, north, east: Box edges in degrees; a west edge greater
+            than the east edge selects a box crossing the 180th meridian
+        limit: Maximum number of rows
+        
+    Returns:
+        List of rows with GEO_LISTING_COLUMNS plus folder_name, in geohash order
+    """
+    boxes = _geo_boxes(south, west, north, east)
+    rows = []
+    with session_scope() as db:
+        for low, high in _geohash_ranges(boxes):
+            rows += _image_listing_query(db, GEO_LISTING_COLUMNS).filter(
+                Image.geohash.between(low, high), _inside_boxes(boxes)
+            ).order_by(Image.geohash).limit(limit - len(rows)).all()
+            if len(rows) >= limit:
+                break
+    return rows
+
+def get_images_near(latitude, longitude, radius_km, limit=100):
+    """
+    Get the geotagged images closest to a point within a radius
+    
+    Candidates come from the bounding box around a circle, read from the
+    geohash index; great-circle distances are computed for them only. The
+    circle starts small and grows until it holds ``limit`` images or
+    reaches ``radius_km``, so a dense city does not load every image in a
+    wide radius to return the nearest hundred.
+    
+    Args:
+        latitude, longitude: Center in degrees
+        radius_km: Search radius in kilometers
+        limit: Maximum number of images
+        
+    Returns:
+        List of (row, distance in km) tuples, nearest first; rows are as in
+        get_images_in_bbox
+    """
+    search_radius = NEAREST_START_KM / 4
+    while True:
+        search_radius = min(search_radius * 4, radius_km)
+        boxes = geo.radius_bbox(latitude, longitude, search_radius)
+        with session_scope() as db:
+            candidates = db.query(Image.id, Image.gps_latitude, Image.gps_longitude).filter(
+                _in_boxes(boxes)
+            ).all()
+        distances = {}
+        for row in candidates:
+            distance = geo.haversine_km(latitude, longitude, row.gps_latitude, row.gps_longitude)
+            if distance <= search_radius:
+                distances[row.id] = distance
+        # The nearest images within a smaller circle are the nearest overall
+        if len(distances) >= limit or search_radius >= radius_km:
+            break
+    nearest = heapq.nsmallest(limit, distances, key=distances.get)
+    if not nearest:
+        return []
+    with session_scope() as db:
+        rows = _image_listing_query(db, GEO_LISTING_COLUMNS).filter(Image.id.in_(nearest)).all()
+    rows.sort(key=lambda row: distances[row.id])
+    return [(row, distances[row.id]) for row in rows]
+
+def get_map_clusters(south, west, north, east, max_clusters=MAP_MAX_CLUSTERS):
+    """
+    Group the geotagged images inside a bounding box into map clusters
+    
+    Images are grouped by geohash prefix in the database, with the prefix
+    length chosen so the box spans at most ``max_clusters`` cells, so a map
+    of any number of images receives at most that many points. The query
+    reads only ix_images_geohash. Results are cached like search results.
+    
+    Args:
+        south, west, north, east: Box edges in degrees, as in get_images_in_bbox
+        max_clusters: Cell budget for the box
+        
+    Returns:
+        List of rows with cell (the geohash prefix), count, latitude and
+        longitude (the mean position of the cluster's images) and image_id
+        (the smallest id in the cluster), largest clusters first
+    """
+    boxes = _geo_boxes(south, west, north, east)
+    precision = geo.precision_for(boxes, max_clusters)
+
+    def run():
+        cell = func.substr(Image.geohash, 1, precision).label('cell')
+        with session_scope() as db:
+            rows = db.query(
+                cell, func.count().label('count'), func.avg(Image.gps_latitude).label('latitude'),
+                func.avg(Image.gps_longitude).label('longitude'), func.min(Image.id).label('image_id')
+            ).filter(_in_boxes(boxes)).group_by(cell).all()
+        return sorted(rows, key=lambda row: (-row.count, row.cell))
+
+    key = ("map", tuple(boxes), precision)
+    return search_cache.get_or_compute(key, run)
+
+def get_geotagged_bounds():
+    """
+    Get the number of geotagged images and the box around them
+    
+    Returns:
+        Tuple of (count, (south, west, north, east)); the box is None when
+        no image has coordinates
+    """
+    def run():
+        with session_scope() as db:
+            row = db.query(
+                func.count(), func.min(Image.gps_latitude), func.min(Image.gps_longitude),
+                func.max(Image.gps_latitude), func.max(Image.gps_longitude)
+            ).filter(Image.geohash.isnot(None)).one()
+        return row[0], (tuple(row[1:]) if row[0] else None)
+
+    return search_cache.get_or_compute(("geo_bounds",), run)
 
 # Favorites operations
 def add_to_favorites(image_id, custom_label=None, note=None, display_order=0):
@@ -298,16 +1520,33 @@ def add_to_favorites(image_id, custom_label=None, note=None, display_order=0):
     Returns:
         The created FavoriteImage object
     """
-    db = get_db()
+    with session_scope() as db:
+        # Check if image exists
+        image = db.query(Image).filter(Image.id == image_id).first()
+        if not image:
+            raise ValueError(f"Image with ID {image_id} not found")
     
-    # Check if image exists
-    image = db.query(Image).filter(Image.id == image_id).first()
-    if not image:
-        raise ValueError(f"Image with ID {image_id} not found")
-    
-    # Check if already favorited
-    existing = db.query(FavoriteImage).filter(FavoriteImage.image_id == image_id).first()
-    if existing:
+        # Check if already favorited
+        existing = db.query(FavoriteImage).filter(FavoriteImage.image_id == image_id).first()
+        if not existing:
+            # Create new favorite
+            favorite = FavoriteImage(
+                image_id=image_id,
+                custom_label=custom_label,
+                note=note,
+                display_order=display_order
+            )
+            try:
+                with db.begin_nested():
+                    db.add(favorite)
+                    db.flush()
+            except sa.exc.IntegrityError:
+                # Favorited concurrently; the unique index kept one row, update it
+                existing = db.query(FavoriteImage).filter(FavoriteImage.image_id == image_id).one()
+            else:
+                stamp_write(db)
+                return favorite
+
         # Update existing favorite
         if custom_label is not None:
             existing.custom_label = custom_label
@@ -315,20 +1554,8 @@ def add_to_favorites(image_id, custom_label=None, note=None, display_order=0):
             existing.note = note
         if display_order is not None:
             existing.display_order = display_order
-        db.commit()
+        stamp_write(db)
         return existing
-    
-    # Create new favorite
-    favorite = FavoriteImage(
-        image_id=image_id,
-        custom_label=custom_label,
-        note=note,
-        display_order=display_order
-    )
-    db.add(favorite)
-    db.commit()
-    db.refresh(favorite)
-    return favorite
 
 def remove_from_favorites(favorite_id):
     """
@@ -340,14 +1567,14 @@ def remove_from_favorites(favorite_id):
     Returns:
         Boolean indicating success
     """
-    db = get_db()
-    favorite = db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
-    if not favorite:
-        return False
+    with session_scope() as db:
+        favorite = db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
+        if not favorite:
+            return False
     
-    db.delete(favorite)
-    db.commit()
-    return True
+        db.delete(favorite)
+        stamp_write(db)
+        return True
 
 def get_all_favorites():
     """
@@ -356,8 +1583,21 @@ def get_all_favorites():
     Returns:
         List of FavoriteImage objects with their related Image objects
     """
-    db = get_db()
-    return db.query(FavoriteImage).order_by(FavoriteImage.display_order.asc()).all()
+    with session_scope() as db:
+        return db.query(FavoriteImage).options(
+            joinedload(FavoriteImage.image).joinedload(Image.folder)
+        ).order_by(FavoriteImage.display_order.asc()).all()
+
+def get_non_favorite_images():
+    """
+    Get all images that are not on the dashboard, with their folders
+    
+    Returns:
+        List of Image objects
+    """
+    with session_scope() as db:
+        is_favorite = sa.exists().where(FavoriteImage.image_id == Image.id)
+        return db.query(Image).options(joinedload(Image.folder)).filter(~is_favorite).order_by(Image.id).all()
 
 def get_favorite_by_id(favorite_id):
     """
@@ -369,8 +1609,10 @@ def get_favorite_by_id(favorite_id):
     Returns:
         FavoriteImage object or None
     """
-    db = get_db()
-    return db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
+    with session_scope() as db:
+        return db.query(FavoriteImage).options(
+            joinedload(FavoriteImage.image).joinedload(Image.folder)
+        ).filter(FavoriteImage.id == favorite_id).first()
 
 def update_favorite_order(favorite_id, new_order):
     """
@@ -383,15 +1625,14 @@ def update_favorite_order(favorite_id, new_order):
     Returns:
         The updated FavoriteImage object
     """
-    db = get_db()
-    favorite = db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
-    if not favorite:
-        return None
+    with session_scope() as db:
+        favorite = db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
+        if not favorite:
+            return None
     
-    favorite.display_order = new_order
-    db.commit()
-    db.refresh(favorite)
-    return favorite
+        favorite.display_order = new_order
+        stamp_write(db)
+        return favorite
 
 def update_favorite_details(favorite_id, custom_label=None, note=None):
     """
@@ -405,16 +1646,394 @@ def update_favorite_details(favorite_id, custom_label=None, note=None):
     Returns:
         The updated FavoriteImage object
     """
-    db = get_db()
-    favorite = db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
-    if not favorite:
-        return None
+    with session_scope() as db:
+        favorite = db.query(FavoriteImage).filter(FavoriteImage.id == favorite_id).first()
+        if not favorite:
+            return None
+    
+        if custom_label is not None:
+            favorite.custom_label = custom_label
+        if note is not None:
+            favorite.note = note
+    
+        stamp_write(db)
+        return favorite
+
+# Processing job operations
+def create_processing_job(folder_id, name, file_paths):
+    """
+    Create a processing job with one pending item per image
+    
+    Args:
+        folder_id: ID of the folder the images belong to
+        name: Display name for the job
+        file_paths: List of image file paths to process
+        
+    Returns:
+        The created ProcessingJob object
+    """
+    with session_scope() as db:
+        job = ProcessingJob(folder_id=folder_id, name=name, total_items=len(file_paths))
+        db.add(job)
+        db.flush()
+    
+        db.bulk_insert_mappings(JobItem, [
+            {"job_id": job.id, "file_path": path, "state": ITEM_PENDING, "attempts": 0}
+            for path in file_paths
+        ])
+        return job
+
+def get_processing_job(job_id):
+    """
+    Get a processing job by ID
+    """
+    with session_scope() as db:
+        return db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+
+def get_unfinished_jobs():
+    """
+    Get all jobs that still have items left to process, newest first
+    """
+    with session_scope() as db:
+        return db.query(ProcessingJob).filter(
+            ProcessingJob.status != JOB_COMPLETED
+        ).order_by(ProcessingJob.created_at.desc()).all()
+
+def get_job_items(job_id, states=None):
+    """
+    Get the items of a job, optionally limited to the given states
+    """
+    with session_scope() as db:
+        query = db.query(JobItem).filter(JobItem.job_id == job_id)
+        if states:
+            query = query.filter(JobItem.state.in_(states))
+        return query.order_by(JobItem.id).all()
+
+def start_job_run(job_id, max_attempts=3):
+    """
+    Begin (or resume) a run of a job and return the items it still needs to process
+    
+    Items left in flight by an interrupted run, and failed items with attempts
+    remaining, are returned to pending first.
+    
+    Args:
+        job_id: ID of the job
+        max_attempts: Failed items are retried until they reach this many attempts
+        
+    Returns:
+        List of pending JobItem objects
+    """
+    with session_scope() as db:
+        db.query(JobItem).filter(
+            JobItem.job_id == job_id,
+            (JobItem.state == ITEM_IN_FLIGHT) |
+            ((JobItem.state == ITEM_FAILED) & (JobItem.attempts < max_attempts))
+        ).update({JobItem.state: ITEM_PENDING}, synchronize_session=False)
+    
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        job.status = JOB_RUNNING
+        job.run_count = (job.run_count or 0) + 1
+        if job.started_at is None:
+            job.started_at = datetime.datetime.utcnow()
+        db.flush()
+    
+        return db.query(JobItem).filter(
+            JobItem.job_id == job_id,
+            JobItem.state == ITEM_PENDING
+        ).order_by(JobItem.id).all()
+
+def mark_job_items_in_flight(item_ids):
+    """
+    Mark items as being processed and count the attempt
+    """
+    if not item_ids:
+        return
+    with session_scope() as db:
+        db.query(JobItem).filter(JobItem.id.in_(item_ids)).update({
+            JobItem.state: ITEM_IN_FLIGHT,
+            JobItem.attempts: JobItem.attempts + 1,
+            JobItem.updated_at: datetime.datetime.utcnow()
+        }, synchronize_session=False)
+
+def _job_item_filter(db, item_id, claim_token):
+    query = db.query(JobItem).filter(JobItem.id == item_id)
+    if claim_token is not None:
+        # Once the lease was released the item may belong to another claim
+        query = query.filter(JobItem.claim_token == claim_token)
+    return query
+
+def mark_job_item_done(item_id, result_source=None, claim_token=None):
+    """
+    Mark an item as successfully processed
+    
+    Args:
+        item_id: ID of the job item
+        result_source: Where the result came from ('stored', 'cache' or 'analyzed')
+        claim_token: Token the item was claimed with; if given, the item is
+            only updated while it still belongs to that claim
+        
+    Returns:
+        Number of items updated, 0 if the claim lost its lease
+    """
+    with session_scope() as db:
+        updated = _job_item_filter(db, item_id, claim_token).update({
+            JobItem.state: ITEM_DONE,
+            JobItem.error: None,
+            JobItem.result_source: result_source,
+            JobItem.updated_at: datetime.datetime.utcnow()
+        }, synchronize_session=False)
+        return updated
+
+def mark_job_item_failed(item_id, error, claim_token=None):
+    """
+    Mark an item as failed and record the error message
+    
+    Args:
+        item_id: ID of the job item
+        error: The exception or message to record
+        claim_token: Token the item was claimed with, see mark_job_item_done
+        
+    Returns:
+        Number of items updated, 0 if the claim lost its lease
+    """
+    with session_scope() as db:
+        updated = _job_item_filter(db, item_id, claim_token).update({
+            JobItem.state: ITEM_FAILED,
+            JobItem.error: str(error),
+            JobItem.updated_at: datetime.datetime.utcnow()
+        }, synchronize_session=False)
+        return updated
+
+def get_job_progress(job_id):
+    """
+    Count a job's items by state
+    
+    Returns:
+        Dictionary mapping each item state to its count
+    """
+    with session_scope() as db:
+        counts = {ITEM_PENDING: 0, ITEM_IN_FLIGHT: 0, ITEM_DONE: 0, ITEM_FAILED: 0}
+        rows = db.query(JobItem.state, func.count(JobItem.id)).filter(
+            JobItem.job_id == job_id
+        ).group_by(JobItem.state).all()
+        for state, count in rows:
+            counts[state] = count
+        return counts
+
+def finish_job_run(job_id, elapsed_seconds):
+    """
+    Record the outcome and throughput of a run and update the job status
+    
+    Args:
+        job_id: ID of the job
+        elapsed_seconds: Wall time the run took
+        
+    Returns:
+        The updated ProcessingJob object
+    """
+    counts = get_job_progress(job_id)
+    
+    with session_scope() as db:
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        job.done_items = counts[ITEM_DONE]
+        job.failed_items = counts[ITEM_FAILED]
+        job.processing_seconds = (job.processing_seconds or 0.0) + elapsed_seconds
+        if job.processing_seconds > 0:
+            job.images_per_second = (job.done_items + job.failed_items) / job.processing_seconds
+    
+        # A job is complete once nothing is left pending or in flight
+        if counts[ITEM_PENDING] == 0 and counts[ITEM_IN_FLIGHT] == 0:
+            job.status = JOB_COMPLETED
+            job.finished_at = datetime.datetime.utcnow()
+        else:
+            job.status = JOB_PENDING
+    
+        return job
+
+# Work queue operations used by background workers
+def claim_job_items(worker_id, limit=10):
+    """
+    Atomically claim pending items for a worker
+    
+    On PostgreSQL rows are locked with SELECT ... FOR UPDATE SKIP LOCKED so
+    concurrent workers never wait on or double-claim each other's rows. SQLite
+    serialises writers, so a single guarded UPDATE gives the same guarantee.
+    
+    Args:
+        worker_id: Identifier of the claiming worker (host and pid)
+        limit: Maximum number of items to claim
+        
+    Returns:
+        List of claimed JobItem objects, now in flight
+    """
+    with session_scope() as db:
+        token = uuid.uuid4().hex
+        now = datetime.datetime.utcnow()
+        claim_values = {
+            JobItem.state: ITEM_IN_FLIGHT,
+            JobItem.attempts: JobItem.attempts + 1,
+            JobItem.worker_id: worker_id,
+            JobItem.claim_token: token,
+            JobItem.updated_at: now
+        }
+    
+        if get_engine().dialect.name == 'postgresql':
+            locked = db.query(JobItem.id).filter(
+                JobItem.state == ITEM_PENDING
+            ).order_by(JobItem.id).limit(limit).with_for_update(skip_locked=True).all()
+            item_ids = [row.id for row in locked]
+            if item_ids:
+                db.query(JobItem).filter(JobItem.id.in_(item_ids)).update(claim_values, synchronize_session=False)
+        else:
+            next_ids = sa.select(JobItem.id).where(
+                JobItem.state == ITEM_PENDING
+            ).order_by(JobItem.id).limit(limit).scalar_subquery()
+            db.query(JobItem).filter(
+                JobItem.id.in_(next_ids),
+                JobItem.state == ITEM_PENDING
+            ).update(claim_values, synchronize_session=False)
     
-    if custom_label is not None:
-        favorite.custom_label = custom_label
-    if note is not None:
-        favorite.note = note
+        # Mark the affected jobs as running
+        job_ids = [row.job_id for row in db.query(JobItem.job_id).filter(JobItem.claim_token == token).distinct()]
+        if job_ids:
+            db.query(ProcessingJob).filter(
+                ProcessingJob.id.in_(job_ids),
+                ProcessingJob.status == JOB_PENDING
+            ).update({
+                ProcessingJob.status: JOB_RUNNING,
+                ProcessingJob.started_at: func.coalesce(ProcessingJob.started_at, now)
+            }, synchronize_session=False)
+    
+        return db.query(JobItem).filter(JobItem.claim_token == token).order_by(JobItem.id).all()
+
+def renew_job_items(claim_token):
+    """
+    Renew the lease on a claim's items that are still in flight, so
+    release_stale_job_items leaves them alone while a worker is alive
+    
+    Args:
+        claim_token: Token the items were claimed with
+        
+    Returns:
+        Number of items renewed
+    """
+    with session_scope() as db:
+        renewed = db.query(JobItem).filter(
+            JobItem.claim_token == claim_token,
+            JobItem.state == ITEM_IN_FLIGHT
+        ).update({JobItem.updated_at: datetime.datetime.utcnow()}, synchronize_session=False)
+        return renewed
+
+def release_stale_job_items(lease_seconds=900):
+    """
+    Return items whose worker stopped reporting back to the queue
+    
+    Workers renew their items with renew_job_items while processing them.
+    
+    Args:
+        lease_seconds: How long an item may stay in flight without an update
+        
+    Returns:
+        Number of items released
+    """
+    with session_scope() as db:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=lease_seconds)
+        released = db.query(JobItem).filter(
+            JobItem.state == ITEM_IN_FLIGHT,
+            JobItem.updated_at < cutoff
+        ).update({JobItem.state: ITEM_PENDING, JobItem.claim_token: None}, synchronize_session=False)
+        return released
+
+def requeue_job(job_id, max_attempts=3):
+    """
+    Put a job's retryable failed items back on the queue
+    
+    Args:
+        job_id: ID of the job
+        max_attempts: Failed items are retried until they reach this many attempts
+        
+    Returns:
+        The updated ProcessingJob object
+    """
+    with session_scope() as db:
+        db.query(JobItem).filter(
+            JobItem.job_id == job_id,
+            JobItem.state == ITEM_FAILED,
+            JobItem.attempts < max_attempts
+        ).update({JobItem.state: ITEM_PENDING}, synchronize_session=False)
+    
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if job.status == JOB_COMPLETED:
+            job.status = JOB_PENDING
+        db.flush()
+    
+        return refresh_job_progress(job_id)
+
+def refresh_job_progress(job_id):
+    """
+    Update a job's counts, status and throughput from its items
+    
+    Throughput for queued jobs is measured in wall time since a worker
+    first picked the job up, across however many workers served it.
+    
+    Returns:
+        The updated ProcessingJob object
+    """
+    counts = get_job_progress(job_id)
+    
+    with session_scope() as db:
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        job.done_items = counts[ITEM_DONE]
+        job.failed_items = counts[ITEM_FAILED]
+    
+        now = datetime.datetime.utcnow()
+        if counts[ITEM_PENDING] == 0 and counts[ITEM_IN_FLIGHT] == 0:
+            job.status = JOB_COMPLETED
+            job.finished_at = job.finished_at or now
+        elif job.status == JOB_COMPLETED:
+            job.status = JOB_PENDING
+            job.finished_at = None
+    
+        if job.started_at:
+            elapsed = ((job.finished_at or now) - job.started_at).total_seconds()
+            if elapsed > 0:
+                job.processing_seconds = elapsed
+                job.images_per_second = (job.done_items + job.failed_items) / elapsed
+    
+        return job
+
+def get_job_source_counts(job_id):
+    """
+    Count a job's finished items by where their result came from
+    
+    Returns:
+        Dictionary mapping 'stored', 'cache' and 'analyzed' to counts
+    """
+    with session_scope() as db:
+        counts = {'stored': 0, 'cache': 0, 'analyzed': 0}
+        rows = db.query(JobItem.result_source, func.count(JobItem.id)).filter(
+            JobItem.job_id == job_id,
+            JobItem.state == ITEM_DONE
+        ).group_by(JobItem.result_source).all()
+        for source, count in rows:
+            if source in counts:
+                counts[source] = count
+        return counts
+
+def get_images_by_paths(file_paths):
+    """
+    Get images for a list of file paths in one query
+    
+    Returns:
+        Dictionary mapping file path to Image object
+    """
+    with session_scope() as db:
+        file_paths = list(file_paths)
+        images = {}
     
-    db.commit()
-    db.refresh(favorite)
-    return favorite
\ No newline at end of file
+        # Chunk the IN list to stay under the driver's bound-parameter limit
+        for start in range(0, len(file_paths), 500):
+            chunk = file_paths[start:start + 500]
+            for img in db.query(Image).filter(Image.file_path.in_(chunk)).all():
+                images[img.file_path] = img
+        return images
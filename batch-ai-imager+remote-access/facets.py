@@ -0,0 +1,323 @@
+"""
+Faceted search: filter images by camera, file type, folder, date taken and
+confidence, with a count for every facet value
+
+FacetIndex keeps the facet columns of every image in numpy arrays, about
+40 bytes per image, and FacetSearch keeps it in sync with the images table
+like the search indexes do. A search builds one boolean mask per active
+filter and counts each facet with np.bincount over the images matching
+all the other filters, so with a camera selected the list still shows how
+many images each other camera would add. At a million images a search
+with counts takes tens of milliseconds and never scans the table.
+"""
+import os
+import pickle
+import datetime
+import threading
+import numpy as np
+from search_index import SyncedIndexBackend, _version_of
+
+FACET_INDEX_PATH = os.environ.get(
+    "FACET_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "facet_index.pkl")
+)
+
+# Facets counted per distinct value, filtered by a list of accepted values
+VALUE_FACETS = ("camera_make", "camera_model", "file_type", "folder_id")
+# Filtered by a (min, max) range; either end may be None
+RANGE_FILTERS = ("confidence", "date_taken")
+
+_INDEX_FORMAT = 1
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _timestamp(value):
+    if value is None:
+        return np.nan
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return (value - _EPOCH).total_seconds()
+
+class FacetIndex:
+    """
+    Columnar copy of the facet fields of every image
+
+    Rows are kept in ascending image id order. Facet values are dictionary
+    encoded: each facet has a list of distinct values and an int32 code per
+    row. Code 0 stands for images without a value.
+    """
+    def __init__(self):
+        self.count = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.versions = np.zeros(0, dtype=np.float64)
+        self.codes = {facet: np.zeros(0, dtype=np.int32) for facet in VALUE_FACETS}
+        self.values = {facet: [None] for facet in VALUE_FACETS}   # code -> value
+        self.code_of = {facet: {} for facet in VALUE_FACETS}      # value -> code
+        self.confidence = np.zeros(0, dtype=np.float32)           # NaN when unknown
+        self.date_taken = np.zeros(0, dtype=np.float64)           # seconds since the epoch, NaN when unknown
+        self.row_by_id = {}
+        self.watermark = None                                     # newest processed_at loaded from the database
+        self.deletions = None                                     # images table delete count when last pruned
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.count
+
+    def version_of(self, image_id):
+        """
+        Return the version loaded for an image, or None if it is not indexed
+        """
+        row = self.row_by_id.get(image_id)
+        return None if row is None else self.versions[row]
+
+    def image_ids(self):
+        """
+        Return the ids of every indexed image
+        """
+        with self.lock:
+            return self.ids[:self.count].tolist()
+
+    def _arrays(self):
+        arrays = {"ids": self.ids, "versions": self.versions, "confidence": self.confidence,
+                  "date_taken": self.date_taken}
+        arrays.update(("code_" + facet, self.codes[facet]) for facet in VALUE_FACETS)
+        return arrays
+
+    def _set_arrays(self, arrays):
+        self.ids = arrays["ids"]
+        self.versions = arrays["versions"]
+        self.confidence = arrays["confidence"]
+        self.date_taken = arrays["date_taken"]
+        for facet in VALUE_FACETS:
+            self.codes[facet] = arrays["code_" + facet]
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        grown = {}
+        for name, old in self._arrays().items():
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            grown[name] = new
+        self._set_arrays(grown)
+
+    def _code(self, facet, value):
+        if value is None or value == "":
+            return 0
+        code = self.code_of[facet].get(value)
+        if code is None:
+            code = len(self.values[facet])
+            self.values[facet].append(value)
+            self.code_of[facet][value] = code
+        return code
+
+    def add_rows(self, rows):
+        """
+        Add or update images from rows with id, processed_at, the value
+        facets, confidence and date_taken
+        """
+        with self.lock:
+            unsorted = False
+            for row in rows:
+                index = self.row_by_id.get(row.id)
+                if index is None:
+                    index = self.count
+                    self._grow(index + 1)
+                    # Rows committed late can carry a smaller id than rows already loaded
+                    unsorted = unsorted or (index > 0 and row.id < self.ids[index - 1])
+                    self.ids[index] = row.id
+                    self.row_by_id[row.id] = index
+                    self.count += 1
+                self.versions[index] = _version_of(row.processed_at)
+                for facet in VALUE_FACETS:
+                    self.codes[facet][index] = self._code(facet, getattr(row, facet))
+                self.confidence[index] = np.nan if row.confidence is None else row.confidence
+                self.date_taken[index] = _timestamp(row.date_taken)
+            if unsorted:
+                self._sort()
+
+    def remove_rows(self, image_ids):
+        """
+        Drop images from the index
+        """
+        with self.lock:
+            rows = [self.row_by_id[image_id] for image_id in image_ids if image_id in self.row_by_id]
+            if not rows:
+                return
+            keep = np.ones(self.count, dtype=bool)
+            keep[rows] = False
+            self._set_arrays({name: array[:self.count][keep] for name, array in self._arrays().items()})
+            self.count = len(self.ids)
+            self.row_by_id = {int(image_id): row for row, image_id in enumerate(self.ids)}
+
+    def _sort(self):
+        order = np.argsort(self.ids[:self.count], kind="stable")
+        self._set_arrays({name: array[:self.count][order] for name, array in self._arrays().items()})
+        self.row_by_id = {int(image_id): row for row, image_id in enumerate(self.ids)}
+
+    def _value_mask(self, facet, accepted):
+        codes = [self.code_of[facet][value] for value in accepted if value in self.code_of[facet]]
+        lookup = np.zeros(len(self.values[facet]), dtype=bool)
+        lookup[codes] = True
+        return lookup[self.codes[facet][:self.count]]
+
+    def _range_mask(self, values, low, high):
+        mask = ~np.isnan(values)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+        return mask
+
+    def search(self, filters, matched_ids=None):
+        """
+        Find the images passing every filter and count each facet's values
+
+        Args:
+            filters: Lists of accepted values keyed by VALUE_FACETS names and
+                (min, max) tuples keyed by RANGE_FILTERS names; empty or
+                missing entries do not filter
+            matched_ids: Image ids matching a search query, best first, or
+                None to consider every image
+
+        Returns:
+            tuple: (image ids in result order, facet counts). Results follow
+                ``matched_ids`` when given and are newest first otherwise.
+                Facet counts map each value facet to (value, count) pairs,
+                most common first.
+        """
+        with self.lock:
+            n = self.count
+            masks = {}
+            for facet in VALUE_FACETS:
+                if filters.get(facet):
+                    masks[facet] = self._value_mask(facet, filters[facet])
+            low, high = filters.get("confidence") or (None, None)
+            if low is not None or high is not None:
+                masks["confidence"] = self._range_mask(self.confidence[:n], low, high)
+            start, end = filters.get("date_taken") or (None, None)
+            if start is not None or end is not None:
+                if end is not None and not isinstance(end, datetime.datetime):
+                    # An end date includes the whole day
+                    end = datetime.datetime.combine(end, datetime.time.max)
+                masks["date_taken"] = self._range_mask(
+                    self.date_taken[:n], None if start is None else _timestamp(start),
+                    None if end is None else _timestamp(end)
+                )
+
+            matched_rows = None
+            if matched_ids is not None:
+                matched_ids = np.asarray(matched_ids, dtype=np.int64)
+                matched_rows = np.searchsorted(self.ids[:n], matched_ids)
+                found = matched_rows < n
+                found[found] = self.ids[matched_rows[found]] == matched_ids[found]
+                matched_rows = matched_rows[found]
+                query_mask = np.zeros(n, dtype=bool)
+                query_mask[matched_rows] = True
+                masks["query"] = query_mask
+
+            counts = {}
+            for facet in VALUE_FACETS:
+                # Each facet is counted over the images passing the other filters
+                others = [mask for name, mask in masks.items() if name != facet]
+                codes = self.codes[facet][:n]
+                if others:
+                    # take() on row numbers is several times faster than a boolean index
+                    codes = np.take(codes, np.flatnonzero(np.logical_and.reduce(others)))
+                totals = np.bincount(codes, minlength=len(self.values[facet]))
+                totals[0] = 0
+                nonzero = np.flatnonzero(totals)
+                order = sorted(nonzero, key=lambda code: (-totals[code], str(self.values[facet][code])))
+                counts[facet] = [(self.values[facet][code], int(totals[code])) for code in order]
+
+            selected = np.logical_and.reduce(list(masks.values())) if masks else np.ones(n, dtype=bool)
+            if matched_rows is not None:
+                rows = matched_rows[selected[matched_rows]]
+            else:
+                rows = np.flatnonzero(selected)[::-1]
+            return self.ids[rows], counts
+
+    def save(self, path):
+        """
+        Write the index to ``path`` atomically
+        """
+        with self.lock:
+            state = {
+                "format": _INDEX_FORMAT,
+                "arrays": {name: array[:self.count] for name, array in self._arrays().items()},
+                "values": self.values,
+                "watermark": self.watermark,
+                "deletions": self.deletions,
+            }
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save(), or return None if it is missing or unreadable
+        """
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if state.get("format") != _INDEX_FORMAT:
+            return None
+
+        index = cls()
+        index._set_arrays(state["arrays"])
+        index.count = len(index.ids)
+        index.values = state["values"]
+        index.code_of = {facet: {value: code for code, value in enumerate(values)}
+                         for facet, values in index.values.items()}
+        index.watermark = state["watermark"]
+        index.deletions = state.get("deletions")
+        index.row_by_id = {int(image_id): row for row, image_id in enumerate(index.ids)}
+        return index
+
+class FacetSearch(SyncedIndexBackend):
+    """
+    A FacetIndex kept in sync with the images table, see
+    search_index.SyncedIndexBackend
+    """
+    columns = VALUE_FACETS + RANGE_FILTERS
+
+    def __init__(self, path=FACET_INDEX_PATH, **options):
+        super().__init__(path, **options)
+        self.index = FacetIndex.load(path) or FacetIndex()
+
+    def _apply_rows(self, rows):
+        self.index.add_rows(rows)
+
+    def _remove_ids(self, image_ids):
+        self.index.remove_rows(image_ids)
+
+    def _serialize(self):
+        self.index.save(self.path)
+
+    def search(self, filters, matched_ids=None):
+        """
+        Refresh the index and run FacetIndex.search
+        """
+        self.refresh()
+        return self.index.search(filters, matched_ids)
+
+_facet_search = None
+_facet_search_lock = threading.Lock()
+
+def get_facet_search():
+    """
+    Get the process-wide FacetSearch
+    """
+    global _facet_search
+    import database as db
+
+    with _facet_search_lock:
+        if _facet_search is None:
+            _facet_search = FacetSearch()
+            db.add_image_write_listener(_facet_search.mark_stale)
+        return _facet_search
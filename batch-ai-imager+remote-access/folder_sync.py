@@ -0,0 +1,102 @@
+"""
+Incremental folder sync against the stored image manifest
+
+A sync loads every known (path, size, mtime, hash) for a folder in one
+query, compares it with a filesystem scan and returns only the files that
+need analysis. Files deleted from disk are marked missing.
+"""
+import os
+import database as db
+from utils import compute_file_hash
+
+# Filesystems and float columns can round modification times slightly
+MTIME_TOLERANCE = 1e-3
+
+def file_matches_record(file_size, file_mtime, stat):
+    """
+    Check whether a stored manifest entry still describes a file on disk
+
+    Args:
+        file_size: Stored size in bytes
+        file_mtime: Stored modification time (None for rows stored before
+            manifests were recorded)
+        stat: os.stat_result of the file on disk
+
+    Returns:
+        bool
+    """
+    if file_size != stat.st_size:
+        return False
+    if file_mtime is None:
+        # Legacy row: the size is all we have to go on
+        return True
+    return abs(file_mtime - stat.st_mtime) <= MTIME_TOLERANCE
+
+def sync_folder(folder_id, image_paths):
+    """
+    Diff a folder's stored manifest against the images found on disk
+
+    Unchanged files are skipped without opening them. A file whose mtime
+    changed but whose content hash still matches is only re-stamped. Known
+    files that no longer exist are marked missing.
+
+    Args:
+        folder_id: ID of the folder in the database
+        image_paths: Iterable of image paths found by scanning the folder
+
+    Returns:
+        dict: 'new' and 'changed' (paths that need analysis), plus
+        'unchanged', 'missing' and 'restored' counts
+    """
+    manifest = db.get_folder_manifest(folder_id)
+    summary = {'new': [], 'changed': [], 'unchanged': 0, 'missing': 0, 'restored': 0}
+    updates = []
+    seen = set()
+
+    for path in image_paths:
+        seen.add(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        record = manifest.get(path)
+        if record is None:
+            summary['new'].append(path)
+            continue
+
+        if file_matches_record(record.file_size, record.file_mtime, stat):
+            update = {}
+            if record.file_mtime is None:
+                update['file_mtime'] = stat.st_mtime
+            if record.missing:
+                update['missing'] = False
+                summary['restored'] += 1
+            if update:
+                update['id'] = record.id
+                updates.append(update)
+            summary['unchanged'] += 1
+            continue
+
+        # Touched but not edited: same bytes, so keep the existing analysis
+        if record.content_hash and record.file_size == stat.st_size:
+            try:
+                if compute_file_hash(path) == record.content_hash:
+                    updates.append({'id': record.id, 'file_mtime': stat.st_mtime, 'missing': False})
+                    summary['unchanged'] += 1
+                    continue
+            except OSError:
+                pass
+
+        summary['changed'].append(path)
+
+    for path, record in manifest.items():
+        # Files outside the scan's include/exclude rules are not deleted,
+        # so only flag paths that are really gone
+        if path in seen or record.missing or os.path.exists(path):
+            continue
+        updates.append({'id': record.id, 'missing': True})
+        summary['missing'] += 1
+
+    db.update_image_manifest(updates)
+    return summary
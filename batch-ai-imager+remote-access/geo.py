@@ -0,0 +1,215 @@
+"""
+Geohash helpers for spatial queries on image GPS coordinates
+
+A geohash encodes a latitude/longitude pair as a base-32 string in which
+every character halves the cell several times, so images in the same
+cell share a prefix and sort next to each other. With the Image.geohash
+column behind a B-tree index, a bounding box becomes a handful of prefix
+range scans (cover), and server-side map clusters are a GROUP BY on a
+prefix of the column. This works on both SQLite and PostgreSQL without
+spatial extensions.
+"""
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: i for i, char in enumerate(BASE32)}
+
+# Characters stored per image; a 9-character cell is about 5 x 5 meters
+GEOHASH_PRECISION = 9
+
+EARTH_RADIUS_KM = 6371.0088
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Geohash of a point
+
+    Args:
+        latitude: Degrees north, -90 to 90
+        longitude: Degrees east, -180 to 180
+        precision: Number of characters
+
+    Returns:
+        str: The geohash, or None if either coordinate is missing or out of range
+    """
+    if latitude is None or longitude is None:
+        return None
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        return None
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    # Quantize each coordinate to an integer cell number, then interleave
+    # the bits starting with longitude
+    lon = min(int((longitude + 180.0) / 360.0 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    lat = min(int((latitude + 90.0) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    code = 0
+    for i in range(lon_bits):
+        code = (code << 1) | ((lon >> (lon_bits - 1 - i)) & 1)
+        if i < lat_bits:
+            code = (code << 1) | ((lat >> (lat_bits - 1 - i)) & 1)
+    return "".join(BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+def decode_bbox(geohash):
+    """
+    Bounds of a geohash cell
+
+    Returns:
+        tuple: (south, west, north, east) in degrees
+    """
+    south, west, north, east = -90.0, -180.0, 90.0, 180.0
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                middle = (west + east) / 2
+                if bit:
+                    west = middle
+                else:
+                    east = middle
+            else:
+                middle = (south + north) / 2
+                if bit:
+                    south = middle
+                else:
+                    north = middle
+            even = not even
+    return south, west, north, east
+
+def cell_size(precision):
+    """
+    Height and width in degrees of a geohash cell of ``precision`` characters
+    """
+    bits = precision * 5
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << ((bits + 1) // 2))
+
+def split_antimeridian(south, west, north, east):
+    """
+    Split a box whose west edge is east of its east edge, i.e. one that
+    crosses the 180th meridian, into boxes that do not
+
+    Returns:
+        list: (south, west, north, east) tuples
+    """
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+def _cell_span(south, west, north, east, precision):
+    # Rows and columns of cells of this precision that a box touches
+    height, width = cell_size(precision)
+    return (_cell_number(north, -90.0, height) - _cell_number(south, -90.0, height) + 1,
+            _cell_number(east, -180.0, width) - _cell_number(west, -180.0, width) + 1)
+
+def _cell_number(value, origin, size):
+    # The last cell includes the upper edge (90 degrees north, 180 east)
+    return max(0, min(int((value - origin) // size), int(round(-2 * origin / size)) - 1))
+
+def precision_for(boxes, max_cells):
+    """
+    Longest geohash precision at which ``boxes`` touch at most ``max_cells`` cells
+
+    Args:
+        boxes: (south, west, north, east) tuples not crossing the antimeridian
+        max_cells: Cell budget
+
+    Returns:
+        int: Precision from 1 to GEOHASH_PRECISION
+    """
+    precision = 1
+    for candidate in range(2, GEOHASH_PRECISION + 1):
+        cells = 0
+        for box in boxes:
+            rows, columns = _cell_span(*box, candidate)
+            cells += rows * columns
+        if cells > max_cells:
+            break
+        precision = candidate
+    return precision
+
+def cover(boxes, max_cells=32):
+    """
+    Geohash prefixes whose cells together cover ``boxes``
+
+    Each prefix is one index range scan, so the cell budget trades the
+    number of scans against how much outside the boxes they read.
+
+    Args:
+        boxes: (south, west, north, east) tuples not crossing the antimeridian
+        max_cells: Maximum number of prefixes (at least 1 precision-1 cell
+            per box is always used)
+
+    Returns:
+        list: Sorted geohash prefixes
+    """
+    precision = precision_for(boxes, max_cells)
+    height, width = cell_size(precision)
+    prefixes = set()
+    for south, west, north, east in boxes:
+        south, north = max(south, -90.0), min(north, 90.0)
+        west, east = max(west, -180.0), min(east, 180.0)
+        rows, columns = _cell_span(south, west, north, east, precision)
+        # Step through the cells from the box's south-west corner cell
+        first_lat = (_cell_number(south, -90.0, height) + 0.5) * height - 90.0
+        first_lon = (_cell_number(west, -180.0, width) + 0.5) * width - 180.0
+        for row in range(rows):
+            for column in range(columns):
+                prefixes.add(encode(first_lat + row * height, first_lon + column * width, precision))
+    return sorted(prefixes)
+
+def _prefix_value(prefix):
+    value = 0
+    for char in prefix:
+        value = value * 32 + _DECODE[char]
+    return value
+
+def prefix_ranges(prefixes, precision=GEOHASH_PRECISION):
+    """
+    Turn sorted prefixes of one length into ranges of full-precision
+    geohashes for BETWEEN scans, merging neighbours such as "dr4" to "dr7"
+
+    Returns:
+        list: (lowest, highest) geohash pairs
+    """
+    ranges = []
+    previous = None
+    for prefix in prefixes:
+        value = _prefix_value(prefix)
+        high = prefix.ljust(precision, BASE32[-1])
+        if previous is not None and value == previous + 1:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((prefix.ljust(precision, BASE32[0]), high))
+        previous = value
+    return ranges
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two points in kilometers
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def radius_bbox(latitude, longitude, radius_km):
+    """
+    Box around every point within ``radius_km`` of a point
+
+    Returns:
+        list: (south, west, north, east) tuples, two when the box crosses
+            the antimeridian
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = latitude - delta_lat, latitude + delta_lat
+    if south <= -90.0 or north >= 90.0:
+        # A circle around a pole spans every longitude
+        return [(max(south, -90.0), -180.0, min(north, 90.0), 180.0)]
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude))
+    delta_lon = 180.0 if ratio >= 1 else math.degrees(math.asin(ratio))
+    if delta_lon >= 180.0:
+        return [(south, -180.0, north, 180.0)]
+    west = (longitude - delta_lon + 540.0) % 360.0 - 180.0
+    east = (longitude + delta_lon + 540.0) % 360.0 - 180.0
+    return split_antimeridian(south, west, north, east)
@@ -2,10 +2,12 @@
 import streamlit as st
 import os
 import pandas as pd
-from database import get_all_folders, get_images_by_folder_id, FavoriteImage
+from database import get_folders_page, get_images_page, iter_image_rows, FavoriteImage
 import database as db
+from pagination import get_page_cursor, show_page_controls
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
+@db.with_session_scope
 def show_history_page():
     """
     Display the history of processed folders and allow browsing previous analysis results
@@ -19,8 +21,8 @@ def show_history_page():
     </div>
     """, unsafe_allow_html=True)
     
-    # Get all folders from the database
-    folders = get_all_folders()
+    # Get one page of folders with their image counts, most recent first
+    folders, next_cursor = get_folders_page(get_page_cursor("history_folders"))
     
     if not folders:
         st.info("No analyzed folders found in the database. Process some images first.")
@@ -32,14 +34,11 @@ def show_history_page():
         "name": folder.name, 
         "path": folder.path, 
         "processed_at": folder.processed_at,
-        "image_count": len(folder.images)
+        "image_count": folder.image_count
     } for folder in folders]
     
     folder_df = pd.DataFrame(folder_data)
     
-    # Sort by most recent first
-    folder_df = folder_df.sort_values(by="processed_at", ascending=False)
-    
     # Display as a table
     st.markdown('<div class="card styled-table">', unsafe_allow_html=True)
     st.dataframe(
@@ -53,6 +52,7 @@ def show_history_page():
         hide_index=True
     )
     st.markdown('</div>', unsafe_allow_html=True)
+    show_page_controls("history_folders", next_cursor, len(folders))
     
     # Let user select a folder to view details
     selected_folder_id = st.selectbox(
@@ -66,10 +66,10 @@ def show_history_page():
     
 def show_folder_images(folder_id):
     """
-    Display all images from a specific folder
+    Display the images of a specific folder, one page at a time
     """
-    # Get all images for the folder
-    images = get_images_by_folder_id(folder_id)
+    # Get one page of images, alphabetically by file name
+    images, next_cursor = get_images_page(folder_id, get_page_cursor("history_images", reset_on=folder_id))
     
     if not images:
         st.warning("No images found for this folder")
@@ -86,9 +86,6 @@ def show_folder_images(folder_id):
     
     image_df = pd.DataFrame(image_data)
     
-    # Sort alphabetically by filename
-    image_df = image_df.sort_values(by="file_name")
-    
     # Display as a table
     st.markdown('<div class="card styled-table">', unsafe_allow_html=True)
     st.dataframe(
@@ -103,6 +100,7 @@ def show_folder_images(folder_id):
         hide_index=True
     )
     st.markdown('</div>', unsafe_allow_html=True)
+    show_page_controls("history_images", next_cursor, len(images))
     
     # Export options for selected folder
     st.subheader("Export Folder Results")
@@ -134,9 +132,9 @@ def show_folder_images(folder_id):
     )
     
     if st.button("Export Results", key="history_export_button"):
-        # Create export DataFrame
+        # Create export DataFrame from every image in the folder, not just this page
         export_data = []
-        for img in images:
+        for img in iter_image_rows(folder_id):
             export_data.append({
                 "file_name": img.file_name,
                 "file_path": img.file_path,
@@ -188,6 +186,7 @@ def show_folder_images(folder_id):
     if selected_image_id:
         show_image_details(selected_image_id)
 
+@db.with_session_scope
 def show_image_details(image_id):
     """
     Display details for a specific image
@@ -195,8 +194,8 @@ def show_image_details(image_id):
     # Find the image in the database
     from database import get_db, Image
     
-    db = next(get_db())
-    image = db.query(Image).filter(Image.id == image_id).first()
+    db_session = get_db()
+    image = db_session.query(Image).filter(Image.id == image_id).first()
     
     if not image:
         st.error("Image not found")
@@ -232,7 +231,6 @@ def show_image_details(image_id):
         # Check if image is already in favorites
         existing_favorite = None
         try:
-            db_session = db.get_db()
             existing_favorite = db_session.query(db.FavoriteImage).filter(
                 db.FavoriteImage.image_id == image.id
             ).first()
@@ -7,9 +7,11 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import altair as alt
 import os
-from database import get_db, Image, Folder
+from database import with_session_scope, iter_image_rows, get_folder_choices, Image
 from sqlalchemy import func
-import json
+
+# Metadata fields used as clustering features
+METADATA_FEATURE_FIELDS = ['width', 'height', 'file_size', 'focal_length', 'aperture', 'iso_speed']
 
 def extract_features_from_metadata(metadata):
     """
@@ -46,6 +48,14 @@ def extract_features_from_description(description):
     ]
     return features
 
+# Columns clustering and the cluster view read; loaded as rows, not ORM objects.
+# Metadata features come from typed columns, so no JSON is parsed per image.
+CLUSTER_COLUMNS = [
+    Image.id, Image.file_name, Image.file_path, Image.object_name, Image.description,
+    Image.confidence, Image.width, Image.height, Image.file_size, Image.focal_length,
+    Image.aperture, Image.iso_speed
+]
+
 def cluster_images(images, n_clusters=5):
     """
     Cluster images based on their metadata and descriptions
@@ -56,13 +66,8 @@ def cluster_images(images, n_clusters=5):
     # Prepare features matrix
     features_list = []
     for img in images:
-        # Extract metadata features
-        metadata = {}
-        if hasattr(img, 'metadata_json') and img.metadata_json:
-            try:
-                metadata = json.loads(img.metadata_json)
-            except:
-                metadata = {}
+        # Extract metadata features; missing values count as 0
+        metadata = {field: getattr(img, field) or 0 for field in METADATA_FEATURE_FIELDS}
                 
         # Combine features
         img_features = extract_features_from_metadata(metadata)
@@ -87,6 +92,7 @@ def cluster_images(images, n_clusters=5):
     # Return clustering results
     return clusters, X_2d
 
+@with_session_scope
 def show_clustering_page():
     """
     Display the image clustering interface
@@ -100,11 +106,10 @@ def show_clustering_page():
     </div>
     """, unsafe_allow_html=True)
     
-    # Get all images from database
-    db_session = next(get_db())
-    all_images = db_session.query(Image).all()
+    # Folders for the scope picker; images are loaded once the scope is known
+    folder_options = get_folder_choices()
     
-    if not all_images:
+    if not folder_options:
         st.info("No images available for clustering. Process some images first.")
         return
     
@@ -118,14 +123,6 @@ def show_clustering_page():
     )
     
     if cluster_scope == "By Folder":
-        # Get folders
-        folders = db_session.query(Folder).all()
-        folder_options = [(f.id, f.name) for f in folders]
-        
-        if not folder_options:
-            st.warning("No folders available")
-            return
-        
         selected_folder_id = st.sidebar.selectbox(
             "Select Folder",
             options=[f[0] for f in folder_options],
@@ -133,9 +130,13 @@ def show_clustering_page():
         )
         
         # Filter images by folder
-        images = db_session.query(Image).filter(Image.folder_id == selected_folder_id).all()
+        images = list(iter_image_rows(selected_folder_id, columns=CLUSTER_COLUMNS))
     else:
-        images = all_images
+        images = list(iter_image_rows(columns=CLUSTER_COLUMNS))
+    
+    if not images:
+        st.info("No images available for clustering. Process some images first.")
+        return
     
     # Set number of clusters
     n_clusters = st.sidebar.slider(
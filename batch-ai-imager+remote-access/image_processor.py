@@ -3,14 +3,46 @@ import base64
 import json
 from PIL import Image
 import io
+import math
+import logging
+from PIL import ImageOps
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from openai import OpenAI
-from utils import is_valid_image, extract_image_metadata
+from utils import is_valid_image, extract_image_metadata, iter_image_files
+from rate_limiter import get_shared_limiter
+
+logger = logging.getLogger(__name__)
 
 # Initialize OpenAI client
 # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # Do not change this unless explicitly requested by the user
+# The client also honours OPENAI_BASE_URL, which lets benchmarks point it at a
+# local fake chat-completions server.
+# Retries (429s, timeouts, connection and server errors) are handled by the
+# shared rate limiter, so the SDK's own are disabled.
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Maximum completion tokens requested per image
+MAX_COMPLETION_TOKENS = 1000
+# Prompt tokens for the system and user text (the image is estimated separately)
+ESTIMATED_TEXT_TOKENS = 150
+
+# Upload preprocessing. Images are downscaled so their longest edge is at most
+# UPLOAD_MAX_EDGE and re-encoded before being sent to the vision model.
+IMAGE_DETAIL = os.environ.get("OPENAI_IMAGE_DETAIL", "high")  # "low" or "high"
+UPLOAD_MAX_EDGE = int(os.environ.get("UPLOAD_MAX_EDGE", "2048"))
+UPLOAD_FORMAT = os.environ.get("UPLOAD_FORMAT", "JPEG").upper()  # "JPEG" or "WEBP"
+UPLOAD_QUALITY = int(os.environ.get("UPLOAD_QUALITY", "85"))
+
+# The model rescales high-detail images to fit 2048x2048 and then to a
+# shortest side of 768px; low-detail images are analyzed at 512x512.
+MODEL_MAX_EDGE = 2048
+MODEL_MAX_SHORT_EDGE = 768
+LOW_DETAIL_EDGE = 512
+
+# Number of images analyzed concurrently (OpenAI requests kept in flight)
+DEFAULT_MAX_WORKERS = int(os.environ.get("ANALYSIS_MAX_WORKERS", "4"))
 
 def encode_image_to_base64(image_path):
     """
@@ -22,35 +54,156 @@ def encode_image_to_base64(image_path):
     except Exception as e:
         raise Exception(f"Failed to encode image: {str(e)}")
 
-def analyze_image_with_openai(base64_image):
+def target_upload_size(width, height, max_edge=UPLOAD_MAX_EDGE, detail=IMAGE_DETAIL):
+    """
+    Compute the size an image should be sent at for the given detail level
+
+    Never upscales, and never sends more pixels than the model would keep
+    after its own rescaling.
+
+    Args:
+        width: Original width in pixels
+        height: Original height in pixels
+        max_edge: Configured maximum longest edge
+        detail: Vision detail level ("low" or "high")
+
+    Returns:
+        tuple: (width, height)
+    """
+    if detail == "low":
+        max_edge = min(max_edge, LOW_DETAIL_EDGE)
+
+    scale = min(1.0, max_edge / max(width, height), MODEL_MAX_EDGE / max(width, height))
+    if detail != "low":
+        scale = min(scale, MODEL_MAX_SHORT_EDGE / min(width, height))
+
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def estimate_image_tokens(width, height, detail=IMAGE_DETAIL):
+    """
+    Estimate the prompt tokens the vision model charges for an image
+
+    Returns:
+        int: 85 base tokens plus 170 per 512px tile for high detail
+    """
+    if detail == "low" or not width or not height:
+        return 85
+    width, height = target_upload_size(width, height, MODEL_MAX_EDGE, detail)
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+def preprocess_image_for_upload(image_path, max_edge=UPLOAD_MAX_EDGE, image_format=UPLOAD_FORMAT,
+                                quality=UPLOAD_QUALITY, detail=IMAGE_DETAIL):
+    """
+    Decode, orient, downscale and re-encode an image for upload
+
+    Args:
+        image_path: Path to the image file
+        max_edge: Maximum longest edge in pixels
+        image_format: "JPEG" or "WEBP"
+        quality: Encoder quality (1-100)
+        detail: Vision detail level the image will be analyzed at
+
+    Returns:
+        tuple: (encoded bytes, MIME type, (width, height))
+    """
+    with Image.open(image_path) as img:
+        # Let the JPEG decoder skip work when we are going to downscale anyway
+        if img.format == "JPEG":
+            img.draft("RGB", target_upload_size(img.width, img.height, max_edge, detail))
+
+        # Apply EXIF orientation so the model sees the photo upright
+        img = ImageOps.exif_transpose(img)
+
+        # Flatten transparency and palettes into something the encoder accepts
+        if img.mode in ("RGBA", "LA", "P") and image_format == "JPEG":
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+
+        size = target_upload_size(img.width, img.height, max_edge, detail)
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue(), f"image/{image_format.lower()}", img.size
+
+def encode_image_for_upload(image_path, **options):
+    """
+    Preprocess an image and encode it to base64 for the vision model
+
+    Falls back to the original file bytes if Pillow cannot decode the file.
+
+    Returns:
+        tuple: (base64 string, MIME type, (width, height) or None)
+    """
+    try:
+        data, mime_type, size = preprocess_image_for_upload(image_path, **options)
+        return base64.b64encode(data).decode('utf-8'), mime_type, size
+    except Exception:
+        ext = os.path.splitext(image_path)[1].lower().replace('.', '')
+        mime_type = "image/jpeg" if ext in ("jpg", "jpeg") else f"image/{ext}"
+        return encode_image_to_base64(image_path), mime_type, None
+
+def _used_tokens(raw_response):
+    # Tokens the request consumed, from the usage the response reports
+    usage = raw_response.parse().usage
+    return usage.total_tokens if usage else None
+
+def analyze_image_with_openai(base64_image, mime_type="image/jpeg", image_size=None, detail=IMAGE_DETAIL):
     """
     Use OpenAI's vision capabilities to analyze an image
+
+    Requests go through the shared rate limiter, which paces them under the
+    account's RPM/TPM quota and retries 429 responses and transient errors
+    with backoff.
+
+    Args:
+        base64_image: Base64-encoded image data
+        mime_type: MIME type of the encoded image
+        image_size: (width, height) of the encoded image, used to estimate tokens
+        detail: Vision detail level ("low" or "high")
     """
+    if image_size:
+        image_tokens = estimate_image_tokens(image_size[0], image_size[1], detail)
+    else:
+        # Worst case for a high-detail image
+        image_tokens = 85 + 170 * 8
+
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert object identifier and historian. First identify the main object in the image, then provide its name and a detailed description including historical context if relevant. Return your response as JSON with 'object_name', 'description', and 'confidence' fields."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Identify the main object in this image. Provide the object name and a detailed description that includes historical or contextual information if relevant. Format your response as JSON."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                        }
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1000
+        raw_response = get_shared_limiter().call(
+            lambda: openai_client.chat.completions.with_raw_response.create(
+                model="gpt-4o",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are an expert object identifier and historian. First identify the main object in the image, then provide its name and a detailed description including historical context if relevant. Return your response as JSON with 'object_name', 'description', and 'confidence' fields."
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "Identify the main object in this image. Provide the object name and a detailed description that includes historical or contextual information if relevant. Format your response as JSON."
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": f"data:{mime_type};base64,{base64_image}", "detail": detail}
+                            }
+                        ]
+                    }
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=MAX_COMPLETION_TOKENS
+            ),
+            estimated_tokens=ESTIMATED_TEXT_TOKENS + image_tokens + MAX_COMPLETION_TOKENS,
+            used_tokens=_used_tokens
         )
+        response = raw_response.parse()
         
         # Parse the response
         content = response.choices[0].message.content
@@ -77,11 +230,11 @@ def process_single_image(image_path):
         raise ValueError(f"Invalid or unsupported image file: {image_path}")
     
     try:
-        # Encode image to base64
-        base64_image = encode_image_to_base64(image_path)
+        # Downscale, re-encode and base64 the image for upload
+        base64_image, mime_type, upload_size = encode_image_for_upload(image_path)
         
         # Analyze the image
-        result = analyze_image_with_openai(base64_image)
+        result = analyze_image_with_openai(base64_image, mime_type, upload_size)
         
         # Extract metadata
         metadata = extract_image_metadata(image_path)
@@ -94,49 +247,132 @@ def process_single_image(image_path):
     except Exception as e:
         raise Exception(f"Error processing image {os.path.basename(image_path)}: {str(e)}")
 
-def process_image_folder(folder_path):
+def iter_process_images(image_paths, max_workers=DEFAULT_MAX_WORKERS, process_fn=None):
+    """
+    Analyze images concurrently, yielding each result as soon as it completes
+
+    At most ``max_workers`` images are in flight at any time. Results are
+    yielded in completion order; use the returned index to restore the
+    original ordering. A failure only affects the image that raised it.
+    ``image_paths`` is consumed lazily, so a directory scan can feed the
+    pool while it is still walking the tree.
+
+    Args:
+        image_paths: Iterable of image file paths to analyze
+        max_workers: Number of images to analyze concurrently
+        process_fn: Function called with each path (defaults to process_single_image)
+
+    Yields:
+        tuple: (index, image_path, result, error) where exactly one of
+        result and error is None
+    """
+    if process_fn is None:
+        process_fn = process_single_image
+
+    max_workers = max(1, int(max_workers))
+    paths = iter(image_paths)
+    exhausted = False
+    next_index = 0
+    in_flight = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-analysis")
+    try:
+        while not exhausted or in_flight:
+            # Keep the pool saturated without queueing the whole folder up front
+            while not exhausted and len(in_flight) < max_workers:
+                path = next(paths, None)
+                if path is None:
+                    exhausted = True
+                    break
+                future = executor.submit(process_fn, path)
+                in_flight[future] = (next_index, path)
+                next_index += 1
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, path = in_flight.pop(future)
+                try:
+                    yield index, path, future.result(), None
+                except Exception as e:
+                    yield index, path, None, e
+    finally:
+        # Drop anything not yet started if the caller stops iterating early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def process_images_concurrently(image_paths, max_workers=DEFAULT_MAX_WORKERS, process_fn=None):
+    """
+    Analyze images concurrently and return results in input order
+
+    Args:
+        image_paths: Iterable of image file paths to analyze
+        max_workers: Number of images to analyze concurrently
+        process_fn: Function called with each path (defaults to process_single_image)
+
+    Returns:
+        list: One result dictionary per input path, in the same order
+    """
+    results = {}
+
+    for index, img_path, result, error in iter_process_images(image_paths, max_workers, process_fn):
+        if error is not None:
+            # Log error and continue with next image
+            logger.warning("Error processing %s: %s", img_path, error)
+            results[index] = build_error_result(img_path, error)
+        else:
+            results[index] = build_result_with_path(img_path, result)
+
+    return [results[index] for index in range(len(results))]
+
+def build_result_with_path(img_path, result):
+    """
+    Build the per-image result row returned by batch processing
+    """
+    return {
+        "file_path": img_path,
+        "file_name": os.path.basename(img_path),
+        "object_name": result.get("object_name", "Unknown"),
+        "description": result.get("description", "No description available"),
+        "confidence": result.get("confidence", 0),
+        "metadata": result.get("metadata", {})
+    }
+
+def build_error_result(img_path, error):
+    """
+    Build the result row recorded for an image that failed to process
+    """
+    return {
+        "file_path": img_path,
+        "file_name": os.path.basename(img_path),
+        "object_name": "Error",
+        "description": f"Failed to process: {str(error)}",
+        "confidence": 0,
+        "metadata": {}
+    }
+
+def process_image_folder(folder_path, max_workers=DEFAULT_MAX_WORKERS, recursive=False,
+                         include=None, exclude=None, max_depth=None):
     """
     Process all images in a folder and return analysis results
+
+    Analysis starts as soon as the scanner finds the first image.
+
+    Args:
+        folder_path: Path to the folder containing images
+        max_workers: Number of images to analyze concurrently
+        recursive: Include images in subfolders
+        include: Glob patterns files must match
+        exclude: Glob patterns for files and directories to skip
+        max_depth: Subfolder depth limit when recursive
     """
     if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
         raise ValueError(f"Invalid folder path: {folder_path}")
     
-    results = []
-    
-    # Get all image files in the folder
-    image_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) 
-                  if os.path.isfile(os.path.join(folder_path, f)) and is_valid_image(os.path.join(folder_path, f))]
-    
-    if not image_files:
-        return results
-    
-    # Process each image
-    for img_path in image_files:
-        try:
-            result = process_single_image(img_path)
-            
-            # Add file path to result
-            result_with_path = {
-                "file_path": img_path,
-                "file_name": os.path.basename(img_path),
-                "object_name": result.get("object_name", "Unknown"),
-                "description": result.get("description", "No description available"),
-                "confidence": result.get("confidence", 0),
-                "metadata": result.get("metadata", {})
-            }
-            
-            results.append(result_with_path)
-            
-        except Exception as e:
-            # Log error and continue with next image
-            print(f"Error processing {img_path}: {str(e)}")
-            results.append({
-                "file_path": img_path,
-                "file_name": os.path.basename(img_path),
-                "object_name": "Error",
-                "description": f"Failed to process: {str(e)}",
-                "confidence": 0,
-                "metadata": {}
-            })
+    # Stream image files from the scanner straight into the pool
+    image_files = iter_image_files(folder_path, include=include, exclude=exclude,
+                                   max_depth=max_depth if recursive else 0)
     
-    return results
+    # Process images concurrently, keeping results in scan order
+    return process_images_concurrently(image_files, max_workers=max_workers)
@@ -0,0 +1,168 @@
+import streamlit as st
+import pandas as pd
+import database as db
+import geo
+
+# Images are drawn one by one instead of as clusters when an area holds at most this many
+MAP_POINT_LIMIT = 500
+# Clusters offered for zooming in, largest first
+ZOOM_CHOICES = 20
+
+def _padded(bounds, margin=0.05):
+    """
+    Widen a (south, west, north, east) box a little so edge points are not on the border
+    """
+    south, west, north, east = bounds
+    pad_lat = max((north - south) * margin, 0.01)
+    pad_lon = max((east - west) * margin, 0.01)
+    return (max(south - pad_lat, -90.0), max(west - pad_lon, -180.0),
+            min(north + pad_lat, 90.0), min(east + pad_lon, 180.0))
+
+def _center(area):
+    """
+    Middle of a (south, west, north, east) box, which may cross the 180th meridian
+    """
+    south, west, north, east = area
+    if west > east:
+        east += 360.0
+    return (south + north) / 2, ((west + east) / 2 + 180.0) % 360.0 - 180.0
+
+def _cluster_frame(clusters, area):
+    """
+    Map points for clusters, sized by the number of images they hold
+    """
+    largest = max(cluster.count for cluster in clusters)
+    # The largest cluster gets a radius of about a tenth of the area's height
+    radius = max((area[2] - area[0]) * 111320 / 10, 20)
+    return pd.DataFrame([{
+        "latitude": cluster.latitude,
+        "longitude": cluster.longitude,
+        "size": radius * (cluster.count / largest) ** 0.5,
+    } for cluster in clusters])
+
+@db.with_session_scope
+def show_map_page():
+    """
+    Display geotagged images on a map, clustered in the database
+    """
+    st.markdown("""
+    <div class="card">
+        <div class="card-header">
+            <h2>Photo Map</h2>
+            <p>See where your geotagged images were taken</p>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    geotagged, bounds = db.get_geotagged_bounds()
+    if not geotagged:
+        st.info("No images with GPS coordinates found in the database. Process some geotagged photos first.")
+        return
+
+    if "map_area" not in st.session_state:
+        st.session_state.map_area = _padded(bounds)
+    south, west, north, east = st.session_state.map_area
+
+    # Edit the visible area; a west edge east of the east edge crosses the 180th meridian
+    with st.form("map_area_form"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            new_south = st.number_input("South", -90.0, 90.0, float(south), format="%.4f")
+        with col2:
+            new_west = st.number_input("West", -180.0, 180.0, float(west), format="%.4f")
+        with col3:
+            new_north = st.number_input("North", -90.0, 90.0, float(north), format="%.4f")
+        with col4:
+            new_east = st.number_input("East", -180.0, 180.0, float(east), format="%.4f")
+        col1, col2 = st.columns(2)
+        with col1:
+            apply_area = st.form_submit_button("Show area", use_container_width=True)
+        with col2:
+            reset_area = st.form_submit_button("Show all photos", use_container_width=True)
+    if apply_area:
+        if new_south > new_north:
+            st.error("The south edge must be below the north edge.")
+        else:
+            st.session_state.map_area = (new_south, new_west, new_north, new_east)
+            st.rerun()
+    if reset_area:
+        st.session_state.map_area = _padded(bounds)
+        st.rerun()
+
+    # Clustered on the server, so the browser gets at most a few hundred points
+    clusters = db.get_map_clusters(south, west, north, east)
+    in_area = sum(cluster.count for cluster in clusters)
+    st.caption(f"{in_area:,} of {geotagged:,} geotagged images in this area")
+    if not clusters:
+        st.info("No geotagged images in this area.")
+        return
+
+    if in_area <= MAP_POINT_LIMIT:
+        images = db.get_images_in_bbox(south, west, north, east, limit=MAP_POINT_LIMIT)
+        st.map(pd.DataFrame([{"latitude": image.gps_latitude, "longitude": image.gps_longitude}
+                             for image in images]))
+        st.dataframe(
+            pd.DataFrame([{
+                "File Name": image.file_name,
+                "Object": image.object_name,
+                "Folder": image.folder_name,
+                "Latitude": image.gps_latitude,
+                "Longitude": image.gps_longitude,
+            } for image in images]),
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.map(_cluster_frame(clusters, (south, west, north, east)), size="size")
+
+        # Zoom into a cluster's geohash cell
+        choices = [cluster for cluster in clusters[:ZOOM_CHOICES] if cluster.count > 1]
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            selected = st.selectbox(
+                "Zoom into a cluster",
+                options=range(len(choices)),
+                format_func=lambda i: (f"{choices[i].count:,} images around "
+                                       f"{choices[i].latitude:.3f}, {choices[i].longitude:.3f}")
+            )
+        with col2:
+            st.markdown("<br>", unsafe_allow_html=True)
+            if st.button("Zoom in", use_container_width=True) and selected is not None:
+                st.session_state.map_area = geo.decode_bbox(choices[selected].cell)
+                st.rerun()
+
+    show_nearby_images(*_center(st.session_state.map_area))
+
+def show_nearby_images(default_latitude, default_longitude):
+    """
+    Find the images closest to a point
+    """
+    st.markdown("### Images Near a Point")
+    with st.form("map_near_form"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            latitude = st.number_input("Latitude", -90.0, 90.0, float(default_latitude), format="%.5f")
+        with col2:
+            longitude = st.number_input("Longitude", -180.0, 180.0, float(default_longitude), format="%.5f")
+        with col3:
+            radius_km = st.number_input("Radius (km)", 0.01, 20000.0, 5.0)
+        if st.form_submit_button("Find images"):
+            st.session_state.map_near = (latitude, longitude, radius_km)
+
+    if "map_near" not in st.session_state:
+        return
+    latitude, longitude, radius_km = st.session_state.map_near
+    nearby = db.get_images_near(latitude, longitude, radius_km)
+    if not nearby:
+        st.info(f"No geotagged images within {radius_km:g} km of {latitude:.5f}, {longitude:.5f}.")
+        return
+    st.dataframe(
+        pd.DataFrame([{
+            "File Name": image.file_name,
+            "Object": image.object_name,
+            "Folder": image.folder_name,
+            "Distance (km)": round(distance, 3),
+        } for image, distance in nearby]),
+        use_container_width=True,
+        hide_index=True
+    )
@@ -0,0 +1,427 @@
+"""
+Versioned schema migrations
+
+    python -m migrations            # apply pending migrations
+    python -m migrations status     # list applied and pending migrations
+
+Each migration runs once per database, in version order and in its own
+transaction, and is recorded in the schema_migrations table. The app,
+worker and CLI apply pending migrations when they start; run the command
+above as a deploy step to migrate ahead of them.
+
+Add schema changes as a new function at the end of MIGRATIONS, never by
+editing one that has been applied. Version 1 creates the first release's
+tables (v1_schema), and versions 2 and 3 add the columns and indexes the
+models have gained since, so later migrations must check before they
+change anything (IF NOT EXISTS, checkfirst, inspecting columns).
+"""
+import sys
+import logging
+import argparse
+import datetime
+from contextlib import contextmanager
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+import database as db
+import geo
+
+logger = logging.getLogger("migrations")
+
+schema_migrations = sa.Table(
+    "schema_migrations", sa.MetaData(),
+    sa.Column("version", sa.Integer, primary_key=True),
+    sa.Column("name", sa.String(255), nullable=False),
+    sa.Column("applied_at", sa.DateTime, nullable=False),
+)
+
+# PostgreSQL advisory lock held while a migration runs, so processes that
+# start together do not apply the same migration twice (SQLite uses its
+# database write lock instead)
+MIGRATION_LOCK_ID = 7261934
+
+# The tables as version 1 created them. Frozen: later schema changes are
+# later migrations, so a new database goes through the same steps as one
+# created by the first release
+v1_schema = sa.MetaData()
+
+sa.Table(
+    "folders", v1_schema,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("name", sa.String(255), nullable=False),
+    sa.Column("path", sa.String(512), nullable=False, unique=True),
+    sa.Column("processed_at", sa.DateTime),
+)
+
+sa.Table(
+    "images", v1_schema,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("folder_id", sa.Integer, sa.ForeignKey("folders.id"), nullable=False),
+    sa.Column("file_name", sa.String(255), nullable=False),
+    sa.Column("file_path", sa.String(512), nullable=False, unique=True),
+    sa.Column("object_name", sa.String(255), index=True),
+    sa.Column("description", sa.Text),
+    sa.Column("confidence", sa.Float, index=True),
+    sa.Column("processed_at", sa.DateTime, index=True),
+    sa.Column("metadata_json", sa.Text),
+    sa.Column("width", sa.Integer),
+    sa.Column("height", sa.Integer),
+    sa.Column("camera_make", sa.String(255)),
+    sa.Column("camera_model", sa.String(255), index=True),
+    sa.Column("date_taken", sa.DateTime),
+    sa.Column("focal_length", sa.Float),
+    sa.Column("exposure_time", sa.String(50)),
+    sa.Column("aperture", sa.Float),
+    sa.Column("iso_speed", sa.Integer),
+    sa.Column("gps_latitude", sa.Float),
+    sa.Column("gps_longitude", sa.Float),
+    sa.Column("file_size", sa.Integer),
+    sa.Column("file_type", sa.String(50), index=True),
+    sa.Column("file_mtime", sa.Float),
+    sa.Column("content_hash", sa.String(64), index=True),
+    sa.Column("missing", sa.Boolean, nullable=False),
+    sa.Index("ix_images_folder_file_name", "folder_id", "file_name", "id"),
+)
+
+sa.Table(
+    "favorite_images", v1_schema,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("image_id", sa.Integer, sa.ForeignKey("images.id"), nullable=False, unique=True, index=True),
+    sa.Column("display_order", sa.Integer),
+    sa.Column("note", sa.Text),
+    sa.Column("custom_label", sa.String(255)),
+    sa.Column("added_at", sa.DateTime),
+)
+
+sa.Table(
+    "analysis_cache", v1_schema,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("content_hash", sa.String(64), nullable=False, unique=True),
+    sa.Column("object_name", sa.String(255)),
+    sa.Column("description", sa.Text),
+    sa.Column("confidence", sa.Float),
+    sa.Column("hit_count", sa.Integer),
+    sa.Column("created_at", sa.DateTime),
+)
+
+sa.Table(
+    "processing_jobs", v1_schema,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("folder_id", sa.Integer, sa.ForeignKey("folders.id"), nullable=False),
+    sa.Column("name", sa.String(255), nullable=False),
+    sa.Column("status", sa.String(20), nullable=False),
+    sa.Column("created_at", sa.DateTime),
+    sa.Column("started_at", sa.DateTime),
+    sa.Column("finished_at", sa.DateTime),
+    sa.Column("total_items", sa.Integer),
+    sa.Column("done_items", sa.Integer),
+    sa.Column("failed_items", sa.Integer),
+    sa.Column("run_count", sa.Integer),
+    sa.Column("processing_seconds", sa.Float),
+    sa.Column("images_per_second", sa.Float),
+)
+
+sa.Table(
+    "job_items", v1_schema,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("job_id", sa.Integer, sa.ForeignKey("processing_jobs.id"), nullable=False, index=True),
+    sa.Column("file_path", sa.String(512), nullable=False),
+    sa.Column("state", sa.String(20), nullable=False),
+    sa.Column("attempts", sa.Integer),
+    sa.Column("error", sa.Text),
+    sa.Column("worker_id", sa.String(255)),
+    sa.Column("claim_token", sa.String(32), index=True),
+    sa.Column("result_source", sa.String(20)),
+    sa.Column("updated_at", sa.DateTime),
+)
+
+def create_tables(conn):
+    """
+    Create the version 1 tables that are missing
+    """
+    v1_schema.create_all(conn)
+
+def add_missing_columns(conn):
+    """
+    Add model columns missing from tables created by older releases
+    """
+    inspector = sa.inspect(conn)
+    for table in db.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            # Created by its own, later migration
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            if column.default is not None and column.default.is_scalar:
+                default = column.default.arg
+                if isinstance(default, bool):
+                    default = sa.true() if default else sa.false()
+                    default = default.compile(dialect=conn.dialect)
+                elif isinstance(default, str):
+                    default = "'" + default.replace("'", "''") + "'"
+                ddl += f' DEFAULT {default}'
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            conn.execute(sa.text(ddl))
+
+def create_indexes(conn):
+    """
+    Create missing model indexes, removing duplicate favorites first
+    """
+    existing_indexes = {index['name'] for index in sa.inspect(conn).get_indexes('favorite_images')}
+    if 'ix_favorite_images_image_id' not in existing_indexes:
+        # Older databases could favorite an image twice; keep the first so
+        # the unique index can be built
+        conn.execute(sa.text(
+            'DELETE FROM favorite_images WHERE id NOT IN '
+            '(SELECT min(id) FROM favorite_images GROUP BY image_id)'
+        ))
+    inspector = sa.inspect(conn)
+    for table in db.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+# Weighted full-text document: object names outrank descriptions, and camera
+# and file type fields are matched as plain words without stemming
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(object_name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(camera_make, '') || ' ' || coalesce(camera_model, '') "
+    "|| ' ' || coalesce(file_type, '')), 'C')"
+)
+
+def full_text_search(conn):
+    """
+    Create the PostgreSQL full-text and trigram search structures
+
+    Adds a generated tsvector column (PostgreSQL 12+) with a GIN index, and
+    pg_trgm GIN indexes so substring matches on object names and
+    descriptions do not scan the table. If a step fails, for example
+    without permission to create the extension, search keeps working
+    through the slower fallback.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+
+    def run(ddl):
+        # Savepoints, so one failed step does not abort the rest
+        try:
+            with conn.begin_nested():
+                conn.execute(sa.text(ddl))
+            return True
+        except Exception as e:
+            logger.warning("Search setup step failed: %s", str(e).splitlines()[0])
+            return False
+
+    vector_ready = run(
+        f"ALTER TABLE images ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED"
+    )
+    if vector_ready:
+        run("CREATE INDEX IF NOT EXISTS ix_images_search_vector ON images USING GIN (search_vector)")
+
+    if run("CREATE EXTENSION IF NOT EXISTS pg_trgm"):
+        run("CREATE INDEX IF NOT EXISTS ix_images_object_name_trgm ON images USING GIN (object_name gin_trgm_ops)")
+        run("CREATE INDEX IF NOT EXISTS ix_images_description_trgm ON images USING GIN (description gin_trgm_ops)")
+
+def metadata_jsonb(conn):
+    """
+    Store image metadata as JSONB with a GIN index for containment queries
+
+    Earlier releases stored a JSON string in a text column, including a
+    redundant encoded copy under 'metadata_json', which is dropped here.
+    SQLite keeps JSON text and only loses the redundant copy.
+    """
+    if conn.dialect.name == 'postgresql':
+        columns = {column['name']: column['type'] for column in sa.inspect(conn).get_columns('images')}
+        if not isinstance(columns['metadata_json'], JSONB):
+            conn.execute(sa.text(
+                "ALTER TABLE images ALTER COLUMN metadata_json TYPE jsonb "
+                "USING NULLIF(metadata_json, '')::jsonb - 'metadata_json'"
+            ))
+        # jsonb_path_ops indexes only support @>, but are smaller and faster for it
+        conn.execute(sa.text(
+            "CREATE INDEX IF NOT EXISTS ix_images_metadata_json ON images USING GIN (metadata_json jsonb_path_ops)"
+        ))
+    elif conn.dialect.name == 'sqlite':
+        conn.execute(sa.text(
+            "UPDATE images SET metadata_json = json_remove(metadata_json, '$.metadata_json') "
+            "WHERE json_valid(metadata_json) AND json_type(metadata_json, '$.metadata_json') IS NOT NULL"
+        ))
+
+def geohash_index(conn):
+    """
+    Add the geohash column behind spatial queries and fill it in for
+    images that already have GPS coordinates
+    """
+    if 'geohash' not in {column['name'] for column in sa.inspect(conn).get_columns('images')}:
+        conn.execute(sa.text('ALTER TABLE images ADD COLUMN geohash VARCHAR(12)'))
+
+    images = db.Image.__table__
+    update = images.update().where(images.c.id == sa.bindparam('image_id')).values(geohash=sa.bindparam('hash'))
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(images.c.id, images.c.gps_latitude, images.c.gps_longitude).where(
+                images.c.id > last_id, images.c.geohash.is_(None),
+                images.c.gps_latitude.isnot(None), images.c.gps_longitude.isnot(None)
+            ).order_by(images.c.id).limit(5000)
+        ).all()
+        if not rows:
+            break
+        values = [{'image_id': row.id, 'hash': geo.encode(row.gps_latitude, row.gps_longitude)} for row in rows]
+        # Out-of-range coordinates have no geohash and stay NULL
+        values = [value for value in values if value['hash']]
+        if values:
+            conn.execute(update, values)
+        last_id = rows[-1].id
+
+    for index in images.indexes:
+        if index.name == 'ix_images_geohash':
+            index.create(conn, checkfirst=True)
+
+def write_generation_counter(conn):
+    """
+    Create the write generation counter that lets query caches in one
+    process notice writes made by another
+    """
+    db.WriteGeneration.__table__.create(conn, checkfirst=True)
+    exists = conn.execute(sa.select(db.WriteGeneration.id).where(db.WriteGeneration.id == 1)).first()
+    if not exists:
+        conn.execute(sa.insert(db.WriteGeneration).values(id=1, generation=0))
+
+def image_deletion_counter(conn):
+    """
+    Count deletes from the images table with a trigger, which also bumps
+    the write generation, so indexes and query caches notice rows removed
+    by folder deletes or by hand
+    """
+    columns = {column['name'] for column in sa.inspect(conn).get_columns('write_generation')}
+    if 'image_deletions' not in columns:
+        conn.execute(sa.text(
+            'ALTER TABLE write_generation ADD COLUMN image_deletions BIGINT NOT NULL DEFAULT 0'
+        ))
+    bump = ("UPDATE write_generation SET generation = generation + 1, "
+            "image_deletions = image_deletions + 1 WHERE id = 1")
+    if conn.dialect.name == 'postgresql':
+        conn.execute(sa.text(
+            f"CREATE OR REPLACE FUNCTION count_image_deletions() RETURNS trigger AS $$ "
+            f"BEGIN {bump}; RETURN NULL; END $$ LANGUAGE plpgsql"
+        ))
+        conn.execute(sa.text("DROP TRIGGER IF EXISTS images_deleted ON images"))
+        conn.execute(sa.text(
+            "CREATE TRIGGER images_deleted AFTER DELETE ON images "
+            "FOR EACH STATEMENT EXECUTE PROCEDURE count_image_deletions()"
+        ))
+    elif conn.dialect.name == 'sqlite':
+        # SQLite only has row-level triggers
+        conn.execute(sa.text(
+            f"CREATE TRIGGER IF NOT EXISTS images_deleted AFTER DELETE ON images BEGIN {bump}; END"
+        ))
+
+# (version, function) in the order they are applied
+MIGRATIONS = [
+    (1, create_tables),
+    (2, add_missing_columns),
+    (3, create_indexes),
+    (4, full_text_search),
+    (5, metadata_jsonb),
+    (6, geohash_index),
+    (7, write_generation_counter),
+    (8, image_deletion_counter),
+]
+
+@contextmanager
+def locked_transaction(engine):
+    """
+    Begin a transaction that serializes migrations across processes until
+    it ends
+    """
+    # SQLite takes the database's write lock at BEGIN IMMEDIATE; a deferred
+    # transaction would only take it at its first write, after our checks
+    with engine.connect().execution_options(sqlite_begin="IMMEDIATE") as conn:
+        with conn.begin():
+            if conn.dialect.name == 'postgresql':
+                conn.execute(sa.text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+            yield conn
+
+def get_applied_versions(engine=None):
+    """
+    Get the set of migration versions applied to the database
+
+    Reads without taking the migration lock; migrate() checks each version
+    again under the lock before applying it.
+    """
+    engine = engine or db.get_engine()
+    with engine.connect() as conn:
+        if not sa.inspect(conn).has_table(schema_migrations.name):
+            return set()
+        return {row.version for row in conn.execute(sa.select(schema_migrations.c.version))}
+
+def migrate():
+    """
+    Apply pending migrations
+
+    Cheap when the schema is current: one unlocked read of the applied
+    versions. The migration lock is only taken when something is pending.
+
+    Returns:
+        list: Versions applied by this call
+    """
+    engine = db.get_engine()
+    applied = get_applied_versions(engine)
+    pending = [(version, fn) for version, fn in MIGRATIONS if version not in applied]
+    if not pending:
+        return []
+
+    newly_applied = []
+    for version, fn in pending:
+        with locked_transaction(engine) as conn:
+            # Under the lock, so processes starting together do not race to create it
+            schema_migrations.create(conn, checkfirst=True)
+            # Another process may have applied it while we waited for the lock
+            done = conn.execute(
+                sa.select(schema_migrations.c.version).where(schema_migrations.c.version == version)
+            ).first()
+            if done:
+                continue
+            logger.info("Applying migration %d: %s", version, fn.__name__)
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, name=fn.__name__, applied_at=datetime.datetime.utcnow()
+            ))
+        newly_applied.append(version)
+
+    # The schema changed; let database re-check which features are available
+    db.reset_schema_checks()
+    return newly_applied
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="Manage the database schema")
+    parser.add_argument("command", nargs="?", choices=["upgrade", "status"], default="upgrade",
+                        help="Apply pending migrations (default) or list them")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.command == "status":
+        applied = get_applied_versions()
+        for version, fn in MIGRATIONS:
+            state = "applied" if version in applied else "pending"
+            print(f"{version:>4}  {state:<8} {fn.__name__}")
+        return 0
+
+    newly_applied = migrate()
+    if newly_applied:
+        logger.info("Applied %d migrations", len(newly_applied))
+    else:
+        logger.info("Schema is up to date")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
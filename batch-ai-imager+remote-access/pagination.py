@@ -0,0 +1,50 @@
+import streamlit as st
+
+def get_page_cursor(key, reset_on=None):
+    """
+    Get the cursor of the page currently shown for a paginated listing
+
+    Cursors of the pages visited so far are kept in session state, so the
+    previous page is reached without a backwards query.
+
+    Args:
+        key: Unique name of the listing
+        reset_on: Value describing the listing's filters (folder, search
+            text, ...); when it changes the listing goes back to page one
+
+    Returns:
+        Cursor to pass to the database page function (None for page one)
+    """
+    state_key = f"{key}_pagination"
+    state = st.session_state.get(state_key)
+    if state is None or state["reset_on"] != reset_on:
+        state = {"cursors": [None], "reset_on": reset_on}
+        st.session_state[state_key] = state
+    return state["cursors"][-1]
+
+def show_page_controls(key, next_cursor, row_count, total=None):
+    """
+    Show previous/next buttons for a listing paginated with get_page_cursor
+
+    Args:
+        key: Unique name of the listing
+        next_cursor: next_cursor returned with the current page
+        row_count: Number of rows on the current page
+        total: Optional total row count to display
+    """
+    state = st.session_state[f"{key}_pagination"]
+    page_number = len(state["cursors"])
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("Previous", key=f"{key}_previous_page", disabled=page_number == 1):
+            state["cursors"].pop()
+            st.rerun()
+    with col2:
+        caption = f"Page {page_number} ({row_count} rows"
+        caption += f" of {total})" if total is not None else ")"
+        st.caption(caption)
+    with col3:
+        if st.button("Next", key=f"{key}_next_page", disabled=next_cursor is None):
+            state["cursors"].append(next_cursor)
+            st.rerun()
@@ -0,0 +1,112 @@
+"""
+In-process LRU cache for query results
+
+Streamlit reruns the whole page script on every widget change, so the same
+search runs again when the user only ticks an export checkbox or picks a
+different result. QueryCache keeps recent results keyed by the normalized
+query and its filters.
+
+Entries are dropped when the write generation they were computed under
+changes (database bumps it on every write that can change results), and
+after ``ttl`` seconds, which bounds how stale results can get when another
+process, such as a worker, writes to the database.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+def normalize_query(query):
+    """
+    Lowercase ``query`` and collapse whitespace, so trivially different
+    spellings of a search share a cache entry
+    """
+    return " ".join((query or "").lower().split())
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with a TTL and generation-based invalidation
+
+    Args:
+        generation: Function returning the current write generation
+        maxsize: Maximum number of cached results
+        ttl: Seconds a result stays valid
+        max_items: Results with more items than this are not cached, so a
+            very broad search cannot pin a large result list in memory
+    """
+    def __init__(self, generation, maxsize=256, ttl=30.0, max_items=5000):
+        self.generation = generation
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_items = max_items
+        self.entries = OrderedDict()  # key -> (generation, expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached result for ``key``, or compute and cache it
+
+        Args:
+            key: Hashable key describing the query and its filters
+            compute: Function called without arguments on a miss
+
+        Returns:
+            The cached or computed result
+        """
+        generation = self.generation()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == generation and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                del self.entries[key]
+                self.invalidations += 1
+            self.misses += 1
+
+        # Computed outside the lock; concurrent misses on one key may both run
+        value = compute()
+        try:
+            size = len(value)
+        except TypeError:
+            size = 0
+        if size > self.max_items:
+            return value
+
+        with self.lock:
+            self.entries[key] = (generation, now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """
+        Drop every cached result
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Get hit and miss counters
+
+        Returns:
+            dict: hits, misses, hit_rate, invalidations, evictions and size
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
@@ -0,0 +1,360 @@
+import os
+import re
+import time
+import random
+import threading
+import email.utils
+
+# Defaults match OpenAI's lowest usage tier for gpt-4o; set these to your
+# organisation's quota. Token reservations are settled against the usage
+# each response reports, so the TPM limit is not spent on unused max_tokens.
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_RPM_LIMIT", "500"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TPM_LIMIT", "30000"))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "16"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "6"))
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request is still throttled after all retries
+    """
+    pass
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills continuously up to its capacity
+    """
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def reserve(self, amount):
+        """
+        Take ``amount`` tokens and return how long the caller must wait before using them
+
+        The balance may go negative, which queues later callers behind this one
+        instead of letting them race for the same refill.
+        """
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.refill_per_second
+
+    def refund(self, amount):
+        """
+        Return ``amount`` reserved tokens that were not used
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.capacity, self.tokens + float(amount))
+
+    def sync(self, remaining, reset_seconds=None):
+        """
+        Align the bucket with the remaining quota reported by the server
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Only ever lower our estimate; the server's view already includes
+            # requests other processes made against the same key
+            self.tokens = min(self.tokens, float(remaining))
+            if reset_seconds and remaining <= 0:
+                self.tokens = min(self.tokens, -reset_seconds * self.refill_per_second)
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: grows by one slot per window of successes and
+    halves whenever the API throttles us
+    """
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, decrease_factor=0.5):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(initial_limit if initial_limit is not None else self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        # Additive increase: roughly +1 slot per full window of successful calls
+        with self.condition:
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            self.condition.notify_all()
+
+    def on_throttle(self):
+        # Multiplicative decrease
+        with self.condition:
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+def parse_duration(value):
+    """
+    Parse OpenAI reset durations such as '1s', '6m0s', '20ms' or '0.5' into seconds
+
+    Returns:
+        float or None
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def parse_retry_after(headers):
+    """
+    Extract the server's retry hint (retry-after-ms or retry-after) in seconds
+    """
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            # HTTP-date form
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return None
+
+def _get_headers(obj):
+    """
+    Return response headers from an OpenAI raw response or API exception
+    """
+    headers = getattr(obj, "headers", None)
+    if headers is None and getattr(obj, "response", None) is not None:
+        headers = getattr(obj.response, "headers", None)
+    return headers
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+def is_rate_limit_error(error):
+    """
+    Check whether an exception represents an HTTP 429 from the API
+    """
+    return _status_code(error) == 429
+
+def is_transient_error(error):
+    """
+    Check whether an exception is worth retrying: a timeout, a dropped
+    connection, a conflict or a server error (HTTP 408, 409 or 5xx)
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in (408, 409) or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    # Also covers openai.APITimeoutError
+    return isinstance(error, openai.APIConnectionError)
+
+class RateLimiter:
+    """
+    Shared limiter for OpenAI calls covering requests/minute, tokens/minute
+    and adaptive concurrency
+
+    Safe to use from any number of threads, so the Streamlit processing loop
+    and headless batch runs can share one instance per process.
+    """
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 base_backoff=1.0, max_backoff=60.0):
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        # When throttled, every caller holds off until this monotonic time
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.throttle_count = 0
+        self.error_retry_count = 0
+
+    def backoff_delay(self, attempt):
+        """
+        Exponential backoff with full jitter for the given retry attempt
+        """
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _wait_for_cooldown(self):
+        while True:
+            with self.lock:
+                remaining = self.cooldown_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _wait_for_capacity(self, estimated_tokens):
+        self._wait_for_cooldown()
+        delay = max(self.request_bucket.reserve(1), self.token_bucket.reserve(estimated_tokens))
+        if delay > 0:
+            time.sleep(delay)
+
+    def update_from_headers(self, headers):
+        """
+        Sync the buckets with x-ratelimit-* response headers
+        """
+        if not headers:
+            return
+        for kind, bucket in (("requests", self.request_bucket), ("tokens", self.token_bucket)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            bucket.sync(remaining, parse_duration(headers.get(f"x-ratelimit-reset-{kind}")))
+
+    def _on_throttle(self, error, attempt):
+        headers = _get_headers(error)
+        self.update_from_headers(headers)
+        self.concurrency.on_throttle()
+
+        # Honour the server's hint, but never retry sooner than our own backoff
+        delay = max(parse_retry_after(headers) or 0.0, self.backoff_delay(attempt))
+        with self.lock:
+            self.throttle_count += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+
+    def call(self, fn, estimated_tokens=0, used_tokens=None):
+        """
+        Run ``fn`` under the limiter, retrying on HTTP 429 and on transient
+        errors (see is_transient_error)
+
+        Args:
+            fn: Zero-argument callable that performs the API request. If the
+                returned object has ``headers`` they are used to sync quotas.
+            estimated_tokens: Most tokens the request can consume; reserved
+                from the tokens-per-minute budget before each attempt and
+                returned in full when the attempt fails
+            used_tokens: Optional function returning the tokens a result
+                actually used (or None if unknown); the unused part of the
+                reservation is returned to the budget
+
+        Returns:
+            Whatever ``fn`` returns
+        """
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_capacity(estimated_tokens)
+
+            self.concurrency.acquire()
+            try:
+                with self.lock:
+                    self.request_count += 1
+                result = fn()
+            except Exception as e:
+                # A failed request, throttled or not, used none of its tokens
+                if estimated_tokens:
+                    self.token_bucket.refund(estimated_tokens)
+                if is_rate_limit_error(e):
+                    self._on_throttle(e, attempt)
+                    if attempt == self.max_retries:
+                        raise RateLimitExceeded(f"Rate limited after {self.max_retries + 1} attempts: {str(e)}")
+                    continue
+                if not is_transient_error(e) or attempt == self.max_retries:
+                    raise
+                # Only this request backs off; the quota is not the problem
+                with self.lock:
+                    self.error_retry_count += 1
+                delay = self.backoff_delay(attempt)
+            else:
+                delay = None
+            finally:
+                self.concurrency.release()
+
+            if delay is not None:
+                time.sleep(delay)
+                continue
+
+            self.update_from_headers(_get_headers(result))
+            self.concurrency.on_success()
+            if used_tokens is not None and estimated_tokens:
+                try:
+                    used = used_tokens(result)
+                except Exception:
+                    used = None
+                if used is not None and used < estimated_tokens:
+                    self.token_bucket.refund(estimated_tokens - used)
+            return result
+
+    def stats(self):
+        """
+        Snapshot of limiter counters for progress displays
+        """
+        with self.lock:
+            return {
+                "requests": self.request_count,
+                "throttled": self.throttle_count,
+                "error_retries": self.error_retry_count,
+                "concurrency_limit": self.concurrency.current_limit,
+            }
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+def get_shared_limiter():
+    """
+    Get the process-wide limiter used for all OpenAI calls
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
@@ -0,0 +1,668 @@
+"""
+Pluggable search backends behind database.search_images
+
+- DatabaseSearchBackend runs the search as SQL (PostgreSQL full-text search
+  when available, ILIKE otherwise).
+- InvertedIndexBackend keeps an in-process BM25 inverted index with
+  stemming and prefix matching, persisted to disk, for SQLite and offline
+  deployments. It catches up with new and updated rows incrementally, so
+  queries never scan the images table, and drops deleted rows. Like the
+  ILIKE search it also matches the keys and values of metadata_json.
+
+Choose with SEARCH_BACKEND=database|index; by default PostgreSQL with
+full-text search uses the database and everything else uses the index.
+"""
+import os
+import re
+import math
+import time
+import pickle
+import bisect
+import datetime
+import threading
+from array import array
+from collections import Counter
+import numpy as np
+
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "auto")
+SEARCH_INDEX_PATH = os.environ.get(
+    "SEARCH_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_index.pkl")
+)
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the there this "
+    "to was were with".split()
+)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_VOWELS = set("aeiouy")
+
+# Stored fields and how much a match in each counts towards term frequency
+FIELD_WEIGHTS = {
+    "object_name": 3,
+    "description": 1,
+    "camera_make": 1,
+    "camera_model": 1,
+    "file_type": 1,
+    "metadata_json": 1,
+}
+
+# Score multiplier for terms matched only by prefix expansion
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 50
+
+# Image ids read per query when looking for deleted rows
+PRUNE_BATCH_SIZE = 50000
+
+_INDEX_FORMAT = 2
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def stem(word):
+    """
+    Light English stemmer that strips common inflections
+
+    'dogs', 'running' and 'parked' become 'dog', 'run' and 'park'. Documents
+    and queries go through the same function, so consistency matters more
+    than linguistic accuracy.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("sses"):
+        return word[:-2]
+    if word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("s"):
+        return word[:-1]
+    if word.endswith("eed"):
+        return word
+    for suffix in ("ingly", "edly", "ing", "ed", "ly"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            base = word[:-len(suffix)]
+            if not _VOWELS.intersection(base):
+                return word
+            # running -> run, but keep the double letter in fall, pass, buzz
+            if base[-1] == base[-2] and base[-1] not in "lsz":
+                base = base[:-1]
+            return base
+    return word
+
+def tokenize(text):
+    """
+    Lowercase ``text`` and split it into alphanumeric tokens, dropping stop words
+    """
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+def metadata_text(document):
+    """
+    Keys and values of a metadata document as one string
+    """
+    if isinstance(document, dict):
+        return " ".join(f"{key} {metadata_text(value)}" for key, value in document.items())
+    if isinstance(document, (list, tuple)):
+        return " ".join(metadata_text(value) for value in document)
+    return "" if document is None else str(document)
+
+def _version_of(processed_at):
+    # Seconds since the epoch for a naive UTC datetime
+    if processed_at is None:
+        return 0.0
+    return (processed_at - _EPOCH).total_seconds()
+
+class InvertedIndex:
+    """
+    Compact BM25 inverted index over image text fields
+
+    Postings are stored per stemmed term as parallel arrays of document
+    numbers and field-weighted term frequencies. Re-indexing an image gives
+    it a new document number and tombstones the old one; compact() drops
+    tombstoned postings once they make up a large share of the index.
+    """
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}              # term -> (array('i') docnos, array('H') weighted tf)
+        self.doc_ids = array('q')       # docno -> image id, -1 once replaced or removed
+        self.doc_lengths = array('f')   # docno -> weighted token count
+        self.doc_versions = array('d')  # docno -> processed_at of the indexed row
+        self.docno_by_id = {}
+        self.deleted = 0
+        self.total_length = 0.0
+        self.watermark = None           # newest processed_at indexed from the database
+        self.deletions = None           # images table delete count when last pruned
+        self._sorted_terms = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_ids) - self.deleted
+
+    def version_of(self, image_id):
+        """
+        Return the version indexed for an image, or None if it is not indexed
+        """
+        docno = self.docno_by_id.get(image_id)
+        return None if docno is None else self.doc_versions[docno]
+
+    def image_ids(self):
+        """
+        Return the ids of every indexed image
+        """
+        with self.lock:
+            return list(self.docno_by_id)
+
+    def add(self, image_id, fields, version=0.0):
+        """
+        Index (or re-index) one image
+
+        Args:
+            image_id: ID of the image row
+            fields: Dictionary of field name to text, see FIELD_WEIGHTS
+            version: Version of the row, used to skip unchanged rows
+        """
+        counts = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(fields.get(field)):
+                counts[stem(token)] += weight
+        length = float(sum(counts.values()))
+
+        with self.lock:
+            self._remove(image_id)
+            docno = len(self.doc_ids)
+            self.doc_ids.append(image_id)
+            self.doc_lengths.append(length)
+            self.doc_versions.append(version)
+            self.docno_by_id[image_id] = docno
+            self.total_length += length
+
+            for term, tf in counts.items():
+                entry = self.postings.get(term)
+                if entry is None:
+                    entry = (array('i'), array('H'))
+                    self.postings[term] = entry
+                    self._sorted_terms = None
+                entry[0].append(docno)
+                entry[1].append(min(tf, 65535))
+
+    def remove(self, image_id):
+        """
+        Drop an image from the index
+        """
+        with self.lock:
+            self._remove(image_id)
+
+    def _remove(self, image_id):
+        docno = self.docno_by_id.pop(image_id, None)
+        if docno is None:
+            return
+        self.doc_ids[docno] = -1
+        self.total_length -= self.doc_lengths[docno]
+        self.deleted += 1
+
+    def _prefix_terms(self, prefix):
+        """
+        Indexed terms starting with ``prefix``, most frequent first
+        """
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        matches = []
+        for term in self._sorted_terms[start:]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        matches.sort(key=lambda term: len(self.postings[term][0]), reverse=True)
+        return matches[:MAX_PREFIX_EXPANSIONS]
+
+    def _match(self, query, prefix=True):
+        """
+        Score every indexed image against a query with BM25
+
+        Every query term is stemmed and matched exactly. With ``prefix`` the
+        last term also matches longer terms that start with it, so partial
+        words typed into a search box still find results.
+
+        Returns:
+            tuple: (image ids, scores) arrays of the matching images
+        """
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        tokens = tokenize(query)
+        if not tokens:
+            return empty
+
+        with self.lock:
+            live = len(self)
+            if live == 0:
+                return empty
+
+            terms = {}
+            for token in tokens:
+                term = stem(token)
+                if term in self.postings:
+                    terms[term] = 1.0
+            if prefix and len(tokens[-1]) >= 2:
+                for term in self._prefix_terms(tokens[-1]):
+                    terms.setdefault(term, PREFIX_WEIGHT)
+            if not terms:
+                return empty
+
+            avg_length = self.total_length / live if self.total_length > 0 else 1.0
+            doc_ids = np.frombuffer(self.doc_ids, dtype=np.int64)
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.float32)
+            scores = np.zeros(len(doc_ids), dtype=np.float32)
+
+            for term, weight in terms.items():
+                docnos_array, tfs_array = self.postings[term]
+                docnos = np.frombuffer(docnos_array, dtype=np.int32)
+                tfs = np.frombuffer(tfs_array, dtype=np.uint16).astype(np.float32)
+                df = len(docnos)
+                idf = math.log(1.0 + (live - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * lengths[docnos] / avg_length)
+                # docnos are unique within a posting list, so plain fancy-index add is safe
+                scores[docnos] += weight * idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+            candidates = np.flatnonzero(scores)
+            candidates = candidates[doc_ids[candidates] >= 0]
+            # Fancy indexing copies, so no views of the arrays outlive the lock
+            return doc_ids[candidates], scores[candidates]
+
+    @staticmethod
+    def _rank(ids, scores, limit=None):
+        # Best score first, ties broken by the higher id, so pages are stable
+        if limit is not None and len(scores) > limit:
+            kth = np.partition(-scores, limit - 1)[limit - 1]
+            # Keep every row tied with the last one so the tie break stays exact
+            keep = -scores <= kth
+            ids, scores = ids[keep], scores[keep]
+        order = np.lexsort((-ids, -scores))[:limit]
+        return [(int(image_id), float(score)) for image_id, score in zip(ids[order], scores[order])]
+
+    def search(self, query, limit=None, prefix=True):
+        """
+        Rank indexed images against a query with BM25, see _match
+
+        Returns:
+            list: (image_id, score) tuples, best first
+        """
+        ids, scores = self._match(query, prefix)
+        return self._rank(ids, scores, limit)
+
+    def search_page(self, query, page_size, after=None, prefix=True):
+        """
+        Get one page of ranked results, keyset paginated on (score, image id)
+
+        Args:
+            query: Search text
+            page_size: Results per page
+            after: (score, image_id) of the last result of the previous page
+
+        Returns:
+            tuple: (hits, total) where hits are (image_id, score) tuples, up
+            to ``page_size + 1`` so callers can tell whether a page follows,
+            and total counts every match
+        """
+        ids, scores = self._match(query, prefix)
+        total = len(ids)
+        if after is not None:
+            score, image_id = after
+            # Cursor scores come from these float32 values, so equality is exact
+            keep = (scores < score) | ((scores == score) & (ids < image_id))
+            ids, scores = ids[keep], scores[keep]
+        return self._rank(ids, scores, page_size + 1), total
+
+    def compact(self, min_deleted_ratio=0.25):
+        """
+        Rebuild postings without tombstoned documents
+
+        Returns:
+            bool: True if the index was compacted
+        """
+        with self.lock:
+            if not self.doc_ids or self.deleted < min_deleted_ratio * len(self.doc_ids):
+                return False
+
+            old_ids = np.frombuffer(self.doc_ids, dtype=np.int64)
+            keep = np.flatnonzero(old_ids >= 0)
+            remap = np.full(len(old_ids), -1, dtype=np.int32)
+            remap[keep] = np.arange(len(keep), dtype=np.int32)
+
+            postings = {}
+            for term, (docnos_array, tfs_array) in self.postings.items():
+                docnos = remap[np.frombuffer(docnos_array, dtype=np.int32)]
+                live = docnos >= 0
+                if not live.any():
+                    continue
+                tfs = np.frombuffer(tfs_array, dtype=np.uint16)[live]
+                postings[term] = (array('i', docnos[live].tobytes()), array('H', tfs.tobytes()))
+
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.float32)[keep]
+            versions = np.frombuffer(self.doc_versions, dtype=np.float64)[keep]
+            self.postings = postings
+            self.doc_ids = array('q', old_ids[keep].tobytes())
+            self.doc_lengths = array('f', lengths.tobytes())
+            self.doc_versions = array('d', versions.tobytes())
+            self.docno_by_id = {image_id: docno for docno, image_id in enumerate(self.doc_ids)}
+            self.deleted = 0
+            self._sorted_terms = None
+            return True
+
+    def save(self, path):
+        """
+        Write the index to ``path`` atomically
+        """
+        with self.lock:
+            self.compact()
+            state = {
+                "format": _INDEX_FORMAT,
+                "k1": self.k1,
+                "b": self.b,
+                "postings": self.postings,
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths,
+                "doc_versions": self.doc_versions,
+                "deleted": self.deleted,
+                "total_length": self.total_length,
+                "watermark": self.watermark,
+                "deletions": self.deletions,
+            }
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save(), or return None if it is missing or unreadable
+        """
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if state.get("format") != _INDEX_FORMAT:
+            return None
+
+        index = cls(k1=state["k1"], b=state["b"])
+        index.postings = state["postings"]
+        index.doc_ids = state["doc_ids"]
+        index.doc_lengths = state["doc_lengths"]
+        index.doc_versions = state["doc_versions"]
+        index.deleted = state["deleted"]
+        index.total_length = state["total_length"]
+        index.watermark = state["watermark"]
+        index.deletions = state["deletions"]
+        index.docno_by_id = {image_id: docno for docno, image_id in enumerate(index.doc_ids) if image_id >= 0}
+        return index
+
+class SearchBackend:
+    """
+    Interface for search_images backends
+    """
+    name = None
+
+    def search(self, query, limit=None):
+        """
+        Return matching Image objects, best matches first
+        """
+        raise NotImplementedError
+
+    def search_page(self, query, cursor=None, page_size=50):
+        """
+        Return (rows, next_cursor, total) for one page of results, see
+        database.search_images_page
+        """
+        raise NotImplementedError
+
+    def match_ids(self, query):
+        """
+        Return the ids of every matching image, best matches first
+        """
+        raise NotImplementedError
+
+    def mark_stale(self, rows=None):
+        """
+        Called after image rows are written; backends that keep their own
+        index should pick the changes up before the next search
+        """
+        pass
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Search with SQL: PostgreSQL full-text search when set up, ILIKE otherwise
+    """
+    name = "database"
+
+    def search(self, query, limit=None):
+        import database as db
+        from sqlalchemy.orm import joinedload
+
+        with db.session_scope() as session:
+            results = db.build_search_query(session, query).options(joinedload(db.Image.folder))
+            if limit is not None:
+                results = results.limit(limit)
+            return results.all()
+
+    def search_page(self, query, cursor=None, page_size=50):
+        import database as db
+
+        with db.session_scope() as session:
+            matches = db.build_search_query(session, query).order_by(None)
+            total = matches.count()
+            rank = db.search_rank(query).label('rank')
+            rows = matches.with_entities(
+                *db.IMAGE_LISTING_COLUMNS, db.Folder.name.label('folder_name'), rank
+            ).outerjoin(db.Folder, db.Image.folder_id == db.Folder.id)
+            rows, next_cursor = db.keyset_page(rows, rank, db.Image.id, cursor, page_size, descending=True)
+            return rows, next_cursor, total
+
+    def match_ids(self, query):
+        import database as db
+
+        with db.session_scope() as session:
+            # build_search_query orders by rank, then id
+            return [image_id for image_id, in db.build_search_query(session, query).with_entities(db.Image.id)]
+
+class SyncedIndexBackend:
+    """
+    Base for in-process indexes kept in sync with the images table
+
+    Before a query the index pulls rows processed since its watermark (with
+    a lag window for rows committed late), so several worker processes can
+    write while one app process queries. Rows whose processed_at matches
+    the version already indexed are skipped; the rest are handed to
+    _apply_rows in batches. Deleted rows have no processed_at to find, so
+    when the images table's delete counter moves the index is compared
+    with every image id and rows no longer there go to _remove_ids. The
+    index is saved to disk after changes, at most once per
+    ``save_interval`` seconds.
+
+    Subclasses set ``self.index`` (which needs ``watermark``,
+    ``deletions``, ``version_of`` and ``image_ids``) and ``columns``, the
+    Image columns to load besides id and processed_at, and implement
+    _apply_rows, _remove_ids and _serialize.
+    """
+    columns = ()
+
+    def __init__(self, path, refresh_interval=2.0, save_interval=60.0, reindex_lag=60.0, batch_size=5000):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.save_interval = save_interval
+        self.reindex_lag = reindex_lag
+        self.batch_size = batch_size
+        self.index = None
+        self.stale = True
+        self.last_refresh = 0.0
+        self.last_save = time.monotonic()
+        self.unsaved_changes = 0
+        self.refresh_lock = threading.Lock()
+
+    def mark_stale(self, rows=None):
+        self.stale = True
+
+    def refresh(self, force=False):
+        """
+        Index rows added or updated in the database since the last refresh
+
+        Returns:
+            int: Number of rows (re-)indexed
+        """
+        import database as db
+
+        if not force and not self.stale and time.monotonic() - self.last_refresh < self.refresh_interval:
+            return 0
+
+        with self.refresh_lock:
+            self.stale = False
+            self.last_refresh = time.monotonic()
+            since = None
+            if self.index.watermark is not None:
+                since = self.index.watermark - datetime.timedelta(seconds=self.reindex_lag)
+
+            columns = [getattr(db.Image, name) for name in self.columns]
+            changed = []
+            indexed = 0
+            watermark = self.index.watermark
+            for row in db.iter_image_changes(columns, since, batch_size=self.batch_size):
+                if self.index.version_of(row.id) == _version_of(row.processed_at):
+                    continue
+                changed.append(row)
+                if row.processed_at and (watermark is None or row.processed_at > watermark):
+                    watermark = row.processed_at
+                if len(changed) >= self.batch_size:
+                    self._apply_rows(changed)
+                    indexed += len(changed)
+                    changed = []
+            if changed:
+                self._apply_rows(changed)
+                indexed += len(changed)
+            # Rows arrive in id order, so only move the watermark once every
+            # batch is applied; if one fails, the next refresh starts over
+            self.index.watermark = watermark
+
+            deletions = db.get_image_deletions()
+            if deletions is not None and deletions != self.index.deletions:
+                indexed += self._prune()
+                self.index.deletions = deletions
+
+            self.unsaved_changes += indexed
+            if self.unsaved_changes and (since is None or time.monotonic() - self.last_save >= self.save_interval):
+                self.save()
+            return indexed
+
+    def _prune(self):
+        """
+        Remove indexed images that are no longer in the database
+
+        Returns:
+            int: Number of images removed
+        """
+        import database as db
+
+        live = np.fromiter((row.id for row in db.iter_image_changes([], batch_size=PRUNE_BATCH_SIZE)),
+                           dtype=np.int64)
+        removed = np.setdiff1d(np.array(self.index.image_ids(), dtype=np.int64), live)
+        if len(removed):
+            self._remove_ids(removed.tolist())
+        return len(removed)
+
+    def _apply_rows(self, rows):
+        """
+        Add or update the images in ``rows`` in the index
+        """
+        raise NotImplementedError
+
+    def _remove_ids(self, image_ids):
+        """
+        Drop images from the index
+        """
+        raise NotImplementedError
+
+    def _serialize(self):
+        """
+        Write the index to ``self.path``
+        """
+        raise NotImplementedError
+
+    def save(self):
+        """
+        Persist the index to disk
+        """
+        self._serialize()
+        self.unsaved_changes = 0
+        self.last_save = time.monotonic()
+
+class InvertedIndexBackend(SyncedIndexBackend, SearchBackend):
+    """
+    Search an in-process inverted index kept in sync with the images table,
+    see SyncedIndexBackend
+    """
+    name = "index"
+    columns = tuple(FIELD_WEIGHTS)
+
+    def __init__(self, path=SEARCH_INDEX_PATH, **options):
+        super().__init__(path, **options)
+        self.index = InvertedIndex.load(path) or InvertedIndex()
+
+    def _apply_rows(self, rows):
+        for row in rows:
+            fields = {field: getattr(row, field) for field in FIELD_WEIGHTS}
+            fields["metadata_json"] = metadata_text(row.metadata_json)
+            self.index.add(row.id, fields, _version_of(row.processed_at))
+
+    def _remove_ids(self, image_ids):
+        for image_id in image_ids:
+            self.index.remove(image_id)
+
+    def _serialize(self):
+        self.index.save(self.path)
+
+    def search(self, query, limit=None):
+        import database as db
+
+        self.refresh()
+        hits = self.index.search(query, limit=limit)
+        return db.get_images_by_ids([image_id for image_id, _ in hits])
+
+    def search_page(self, query, cursor=None, page_size=50):
+        import database as db
+
+        self.refresh()
+        hits, total = self.index.search_page(query, page_size, after=cursor)
+        next_cursor = None
+        if len(hits) > page_size:
+            hits = hits[:page_size]
+            image_id, score = hits[-1]
+            next_cursor = (score, image_id)
+        rows = db.get_image_rows_by_ids([image_id for image_id, _ in hits])
+        return rows, next_cursor, total
+
+    def match_ids(self, query):
+        self.refresh()
+        return [image_id for image_id, _ in self.index.search(query)]
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_search_backend():
+    """
+    Get the process-wide search backend chosen by SEARCH_BACKEND
+    """
+    global _backend
+    import database as db
+
+    with _backend_lock:
+        if _backend is None:
+            choice = SEARCH_BACKEND
+            if choice == "auto":
+                choice = "database" if db.is_full_text_search_enabled() else "index"
+            if choice == "database":
+                _backend = DatabaseSearchBackend()
+            elif choice == "index":
+                _backend = InvertedIndexBackend()
+            else:
+                raise ValueError(f"Unknown SEARCH_BACKEND: {choice}")
+            db.add_image_write_listener(_backend.mark_stale)
+        return _backend
@@ -1,10 +1,89 @@
 import streamlit as st
 import os
 import pandas as pd
+import datetime
 from database import search_images, get_db, Image, FavoriteImage
 import database as db
+from pagination import get_page_cursor, show_page_controls
+from semantic_search import get_semantic_backend
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
+# Facets shown as multiselects, in display order
+FACET_LABELS = {
+    "camera_make": "Camera make",
+    "camera_model": "Camera model",
+    "file_type": "File type",
+    "folder_id": "Folder",
+}
+
+def read_facet_filters():
+    """
+    Get the facet filters selected on the previous run from session state
+    
+    The filter widgets are drawn after the search runs, because their
+    options show the counts it returns.
+    """
+    filters = {facet: st.session_state.get(f"facet_{facet}", []) for facet in FACET_LABELS}
+    low, high = st.session_state.get("facet_confidence", (0.0, 1.0))
+    if (low, high) != (0.0, 1.0):
+        filters["confidence"] = (low, high)
+    dates = st.session_state.get("facet_date_taken")
+    if st.session_state.get("facet_filter_dates") and dates and len(dates) == 2:
+        filters["date_taken"] = tuple(dates)
+    return filters
+
+def show_facet_filters(facet_counts, filters):
+    """
+    Draw the facet filter widgets with the number of images for each value
+    """
+    folder_names = dict(db.get_folder_choices())
+    active = any(filters.values())
+    with st.expander("Filters", expanded=active):
+        columns = st.columns(2)
+        for i, (facet, label) in enumerate(FACET_LABELS.items()):
+            counts = dict(facet_counts[facet])
+            # Keep selected values listed even when no image matches them now
+            options = [value for value, _ in facet_counts[facet]]
+            options += [value for value in filters.get(facet, []) if value not in counts]
+
+            def format_value(value, facet=facet, counts=counts):
+                name = folder_names.get(value, "Unknown") if facet == "folder_id" else value
+                return f"{name} ({counts.get(value, 0)})"
+
+            with columns[i % 2]:
+                st.multiselect(label, options, key=f"facet_{facet}", format_func=format_value)
+
+        st.slider("Confidence", 0.0, 1.0, (0.0, 1.0), step=0.05, key="facet_confidence")
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            st.checkbox("Filter by date taken", key="facet_filter_dates")
+        with col2:
+            today = datetime.date.today()
+            st.date_input("Date taken", (today - datetime.timedelta(days=365), today), key="facet_date_taken",
+                          disabled=not st.session_state.get("facet_filter_dates"))
+
+def _use_suggestion(value):
+    # Runs before the rerun, so the text box can still be changed
+    st.session_state.search_query = value
+
+def show_search_suggestions(search_query):
+    """
+    Offer the most common object names and cameras that continue the
+    typed text, so a click runs a precise search instead of a broad one
+    """
+    if not search_query or not search_query.strip():
+        return
+    suggestions = [suggestion for suggestion in db.suggest_search_terms(search_query)
+                   if suggestion[1].lower() != search_query.strip().lower()]
+    if not suggestions:
+        return
+    columns = st.columns(len(suggestions))
+    for column, (field, value, count) in zip(columns, suggestions):
+        with column:
+            st.button(f"{value} ({count})", key=f"suggestion_{field}_{value}",
+                      on_click=_use_suggestion, args=(value,))
+
+@db.with_session_scope
 def show_search_page():
     """
     Display a search interface for finding images by object name, description, or metadata
@@ -19,33 +98,52 @@ def show_search_page():
     """, unsafe_allow_html=True)
 
     # Search input
-    search_query = st.text_input("Search for objects, descriptions, or metadata", 
+    search_query = st.text_input("Search for objects, descriptions, or metadata", key="search_query",
                                 help="Enter keywords to search. Examples: 'cat', 'mountain', 'sunset', 'iPhone', 'Canon', 'JPEG', etc.")
+    show_search_suggestions(search_query)
 
-    # Execute search when a query is entered
-    if search_query:
-        results = search_images(search_query)
+    semantic_backend = get_semantic_backend()
+    if semantic_backend.embedder.matches_synonyms:
+        semantic_help = ("Similar meaning also finds images described in other words, "
+                         "e.g. 'timepiece' finds a pocket watch")
+    else:
+        semantic_help = ("Similar meaning also finds other forms and misspellings of your words; "
+                         "set SEMANTIC_EMBEDDER=openai to match synonyms too")
+    search_mode = st.radio("Match", ["Keywords", "Similar meaning"], horizontal=True, help=semantic_help)
+    semantic = search_mode == "Similar meaning"
+    if semantic and not semantic_backend.indexed_count():
+        st.info("The similar meaning index is empty. Run `python -m semantic_search build` to embed the library, "
+                "and `python worker.py --semantic-index` to keep it up to date.")
+        return
+
+    filters = read_facet_filters()
+    searching = bool(search_query) or any(filters.values())
+    cursor = get_page_cursor("search_results", reset_on=(search_query, semantic, filters)) if searching else None
+    results, next_cursor, total, facet_counts = db.faceted_search(search_query, filters, cursor, semantic=semantic)
+    show_facet_filters(facet_counts, filters)
 
+    # Execute search when a query is entered or a filter is selected
+    if searching:
         if not results:
-            st.info(f"No results found for '{search_query}'")
+            st.info(f"No results found for '{search_query}'" if search_query else "No images match these filters")
             return
 
         # Convert to DataFrame for better display
         result_data = [{
             "id": img.id,
             "file_name": img.file_name, 
-            "folder_name": img.folder.name if img.folder else "Unknown",
+            "folder_name": img.folder_name or "Unknown",
             "object_name": img.object_name, 
             "confidence": img.confidence,
-            "camera_info": f"{img.camera_make} {img.camera_model}".strip() if hasattr(img, 'camera_make') and img.camera_make else "",
-            "file_type": img.file_type.upper() if hasattr(img, 'file_type') and img.file_type else "",
+            "camera_info": f"{img.camera_make} {img.camera_model}".strip() if img.camera_make else "",
+            "file_type": img.file_type.upper() if img.file_type else "",
             "description_snippet": img.description[:100] + "..." if len(img.description) > 100 else img.description
         } for img in results]
 
         result_df = pd.DataFrame(result_data)
 
         # Display results count
-        st.subheader(f"Found {len(results)} results")
+        st.subheader(f"Found {total} results")
 
         # Display as a table
         st.dataframe(
@@ -62,6 +160,7 @@ def show_search_page():
             },
             hide_index=True
         )
+        show_page_controls("search_results", next_cursor, len(results), total)
 
         # Add export options
         st.subheader("Export Search Results")
@@ -86,9 +185,13 @@ def show_search_page():
         )
 
         if st.button("Export Results", key="search_export_button"):
-            # Construct a proper dataframe for export with all fields
+            # Construct a proper dataframe for export with all fields, from every result
             export_data = []
-            for img in results:
+            if any(filters.values()):
+                export_images = db.get_images_by_ids(db.get_faceted_image_ids(search_query, filters, semantic=semantic))
+            else:
+                export_images = search_images(search_query, semantic=semantic)
+            for img in export_images:
                 export_data.append({
                     "file_name": img.file_name,
                     "file_path": img.file_path,
@@ -143,15 +246,21 @@ def show_search_page():
         if selected_image_id:
             show_search_result_details(selected_image_id)
     else:
-        st.info("Enter a search term to find images")
+        st.info("Enter a search term or choose filters to find images")
+
+    with st.expander("Search cache"):
+        stats = db.get_search_cache_stats()
+        st.caption(f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                   f"{stats['invalidations']} invalidated by writes or expiry, {stats['size']} results cached")
 
+@db.with_session_scope
 def show_search_result_details(image_id):
     """
     Display details for a specific image from search results
     """
     # Find the image in the database
-    db = next(get_db())
-    image = db.query(Image).filter(Image.id == image_id).first()
+    db_session = get_db()
+    image = db_session.query(Image).filter(Image.id == image_id).first()
 
     if not image:
         st.error("Image not found")
@@ -202,7 +311,6 @@ def show_search_result_details(image_id):
             # Check if image is already in favorites
             existing_favorite = None
             try:
-                db_session = db.get_db()
                 existing_favorite = db_session.query(db.FavoriteImage).filter(
                     db.FavoriteImage.image_id == image.id
                 ).first()
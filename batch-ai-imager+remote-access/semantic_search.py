@@ -0,0 +1,607 @@
+"""
+Semantic ("similar meaning") search over image object names and descriptions
+
+    python -m semantic_search build     # embed every image not yet in the index
+    python worker.py --semantic-index   # keep embedding new images as they are analyzed
+
+- Embedders turn text into unit-length float32 vectors. HashingEmbedder is
+  deterministic and runs offline: it hashes stemmed words and character
+  trigrams, so it matches related word forms and misspellings but not
+  synonyms. OpenAIEmbedder uses the embeddings API through the shared rate
+  limiter and matches synonyms ("timepiece" finds "pocket watch").
+- VectorIndex is an IVF (inverted file) approximate nearest neighbour
+  index: vectors are grouped under k-means centroids and a query only
+  scores the groups nearest to it. Vectors are kept in a float32 array file
+  and new images are added incrementally.
+- SemanticSearchBackend keeps the index in sync with the images table
+  through search_index.SyncedIndexBackend. Only the builder (the build
+  command or a worker) embeds library rows; the app reloads the saved
+  index when it changes and embeds nothing but queries.
+
+Choose the embedder with SEMANTIC_EMBEDDER=hashing|openai (openai when
+OPENAI_API_KEY is set, hashing otherwise). Changing the embedder rebuilds
+the index on the next build.
+"""
+import os
+import sys
+import time
+import pickle
+import logging
+import argparse
+import threading
+import zlib
+import functools
+import numpy as np
+from search_index import SearchBackend, SyncedIndexBackend, tokenize, stem, _version_of
+from rate_limiter import get_shared_limiter
+
+logger = logging.getLogger("semantic_search")
+
+SEMANTIC_EMBEDDER = os.environ.get("SEMANTIC_EMBEDDER") or ("openai" if os.environ.get("OPENAI_API_KEY") else "hashing")
+SEMANTIC_INDEX_PATH = os.environ.get(
+    "SEMANTIC_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "semantic_index.f32")
+)
+EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = 256
+
+# Matches below this cosine similarity are not shown
+MIN_SCORE = 0.2
+# Results considered per query; pages are cut from these
+MAX_RESULTS = 500
+
+_INDEX_FORMAT = 1
+
+class HashingEmbedder:
+    """
+    Deterministic offline embedder using the hashing trick
+
+    Each stemmed word and each character trigram of it is hashed to a
+    signed dimension. Words count fully and trigrams partly, so "bicycles"
+    and "bicycle", or a misspelling, end up close together.
+    """
+    matches_synonyms = False
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS, trigram_weight=0.3):
+        self.dimensions = dimensions
+        self.trigram_weight = trigram_weight
+        self.name = f"hashing-{dimensions}"
+        # Per-instance cache of the features of each word
+        self._features = functools.lru_cache(maxsize=200000)(self._word_features)
+
+    def _feature(self, text):
+        # crc32 rather than hash(): vectors must not change between processes
+        h = zlib.crc32(text.encode("utf-8"))
+        return h % self.dimensions, 1.0 if (h >> 31) & 1 else -1.0
+
+    def _word_features(self, word):
+        word = stem(word)
+        features = [self._feature("w:" + word)]
+        weights = [1.0]
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            features.append(self._feature(padded[i:i + 3]))
+            weights.append(self.trigram_weight)
+        dims = np.array([dim for dim, _ in features], dtype=np.int64)
+        values = np.array([sign * weight for (_, sign), weight in zip(features, weights)], dtype=np.float32)
+        return dims, values
+
+    def embed(self, texts):
+        """
+        Embed a list of texts
+
+        Returns:
+            numpy.ndarray: (len(texts), dimensions) float32 unit vectors
+                (all zero for texts without words)
+        """
+        positions = []
+        weights = []
+        for row, text in enumerate(texts):
+            offset = row * self.dimensions
+            for word in tokenize(text):
+                dims, values = self._features(word)
+                positions.append(dims + offset)
+                weights.append(values)
+        size = len(texts) * self.dimensions
+        if not positions:
+            return np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        # One bincount sums the features of the whole batch
+        flat = np.bincount(np.concatenate(positions), weights=np.concatenate(weights), minlength=size)
+        return _normalize(flat.astype(np.float32).reshape(len(texts), self.dimensions))
+
+def _used_tokens(raw_response):
+    # Tokens the request consumed, from the usage the response reports
+    usage = raw_response.parse().usage
+    return usage.total_tokens if usage else None
+
+class OpenAIEmbedder:
+    """
+    Embed text with the OpenAI embeddings API, in batches
+
+    Requests go through the shared rate limiter, like image analysis, so
+    embedding a library counts against the same quota and is retried the
+    same way.
+    """
+    matches_synonyms = True
+
+    def __init__(self, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS, batch_size=256):
+        from openai import OpenAI
+
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.name = f"openai-{model}-{dimensions}"
+        # Reads OPENAI_API_KEY and OPENAI_BASE_URL like the analysis client;
+        # retries are left to the shared rate limiter
+        self.client = OpenAI(max_retries=0)
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            # The API rejects empty strings
+            batch = [text or " " for text in texts[start:start + self.batch_size]]
+            # About four characters per token; the reservation is settled
+            # against the usage the response reports
+            estimated_tokens = sum(len(text) for text in batch) // 3 + len(batch)
+            raw_response = get_shared_limiter().call(
+                lambda: self.client.embeddings.with_raw_response.create(
+                    model=self.model, input=batch, dimensions=self.dimensions
+                ),
+                estimated_tokens=estimated_tokens,
+                used_tokens=_used_tokens
+            )
+            for item in raw_response.parse().data:
+                vectors[start + item.index] = item.embedding
+        return _normalize(vectors)
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def get_embedder(choice=None):
+    """
+    Create the embedder chosen by SEMANTIC_EMBEDDER
+    """
+    choice = choice or SEMANTIC_EMBEDDER
+    if choice == "openai":
+        return OpenAIEmbedder()
+    if choice == "hashing":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown SEMANTIC_EMBEDDER: {choice}")
+
+def document_text(object_name, description):
+    """
+    Text embedded for an image; the object name is repeated so it weighs
+    more than any single description word
+    """
+    object_name = object_name or ""
+    return f"{object_name}. {object_name}. {description or ''}"
+
+def _nearest_centroids(vectors, centroids, chunk_size=8192):
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        labels[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return labels
+
+def _spherical_kmeans(vectors, k, iterations=10, seed=0):
+    """
+    Cluster unit vectors by cosine similarity
+
+    Returns:
+        numpy.ndarray: (k, dim) unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroids(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(vectors[order], starts[filled], axis=0)
+        # Reseed empty clusters with random vectors
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+class VectorIndex:
+    """
+    IVF approximate nearest neighbour index over unit vectors
+
+    Vectors live in one growing float32 array; re-adding an image appends a
+    new row and tombstones the old one. Once the index holds
+    ``min_train_size`` vectors, k-means centroids are trained (about
+    2 * sqrt(n) of them) and each vector is assigned to its nearest centroid.
+    A query scores the vectors of the ``nprobe`` nearest centroids plus
+    rows added since the lists were last rebuilt. Centroids are retrained
+    each time the index doubles.
+    """
+    def __init__(self, dimensions, nprobe=16, min_train_size=20000, max_unlisted=5000):
+        self.dimensions = dimensions
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.max_unlisted = max_unlisted
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)           # row -> image id, -1 once replaced or removed
+        self.versions = np.zeros(0, dtype=np.float64)    # row -> processed_at of the embedded row
+        self.assignments = np.zeros(0, dtype=np.int32)   # row -> centroid, -1 before training
+        self.count = 0
+        self.deleted = 0
+        self.row_by_id = {}
+        self.centroids = None
+        self.trained_rows = 0
+        self.list_order = np.zeros(0, dtype=np.int64)    # rows grouped by centroid
+        self.list_offsets = np.zeros(1, dtype=np.int64)  # centroid -> start in list_order
+        self.listed_rows = 0                             # rows covered by list_order
+        self.watermark = None                            # newest processed_at embedded from the database
+        self.deletions = None                            # images table delete count when last pruned
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.count - self.deleted
+
+    def version_of(self, image_id):
+        """
+        Return the version embedded for an image, or None if it is not indexed
+        """
+        row = self.row_by_id.get(image_id)
+        return None if row is None else self.versions[row]
+
+    def image_ids(self):
+        """
+        Return the ids of every indexed image
+        """
+        with self.lock:
+            return list(self.row_by_id)
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name in ("vectors", "ids", "versions", "assignments"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, image_ids, vectors, versions):
+        """
+        Add (or replace) the vectors of several images
+        """
+        with self.lock:
+            for image_id in image_ids:
+                self._remove(image_id)
+            n = len(image_ids)
+            start, end = self.count, self.count + n
+            self._grow(end)
+            self.vectors[start:end] = vectors
+            self.ids[start:end] = image_ids
+            self.versions[start:end] = versions
+            self.assignments[start:end] = -1
+            if self.centroids is not None:
+                self.assignments[start:end] = _nearest_centroids(self.vectors[start:end], self.centroids)
+            self.row_by_id.update((image_id, start + i) for i, image_id in enumerate(image_ids))
+            self.count = end
+
+            if self.centroids is None:
+                if len(self) >= self.min_train_size:
+                    self.train()
+            elif self.count >= 2 * self.trained_rows:
+                self.train()
+            elif self.count - self.listed_rows > self.max_unlisted:
+                self._build_lists()
+
+    def remove(self, image_id):
+        """
+        Drop an image from the index
+        """
+        with self.lock:
+            self._remove(image_id)
+
+    def _remove(self, image_id):
+        row = self.row_by_id.pop(image_id, None)
+        if row is not None:
+            self.ids[row] = -1
+            self.deleted += 1
+
+    def train(self, sample_size=None, iterations=10):
+        """
+        Train the centroids on a sample of live vectors and assign every row
+        """
+        with self.lock:
+            self.compact(min_deleted_ratio=0.0)
+            n = self.count
+            nlist = max(16, min(4096, int(2 * np.sqrt(n))))
+            sample_size = sample_size or min(n, nlist * 32)
+            rng = np.random.default_rng(0)
+            sample = self.vectors[np.sort(rng.choice(n, sample_size, replace=False))]
+            self.centroids = _spherical_kmeans(sample, nlist, iterations=iterations)
+            self.assignments[:n] = _nearest_centroids(self.vectors[:n], self.centroids)
+            self.trained_rows = n
+            self._build_lists()
+
+    def _build_lists(self):
+        assignments = self.assignments[:self.count]
+        self.list_order = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.searchsorted(assignments[self.list_order], np.arange(len(self.centroids) + 1))
+        self.listed_rows = self.count
+
+    def _candidate_rows(self, vector, nprobe):
+        if self.centroids is None:
+            return np.arange(self.count)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ vector), nprobe - 1)[:nprobe]
+        rows = [self.list_order[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes]
+        rows.append(np.arange(self.listed_rows, self.count))
+        return np.concatenate(rows)
+
+    def search(self, vector, limit, nprobe=None, exact=False):
+        """
+        Find the images whose vectors are closest to ``vector``
+
+        Args:
+            vector: Unit-length query vector
+            limit: Maximum number of results
+            nprobe: Centroid lists to scan (defaults to self.nprobe)
+            exact: Score every vector instead of probing lists
+
+        Returns:
+            list: (image_id, cosine similarity) tuples, best first, ties by
+                descending id
+        """
+        with self.lock:
+            if exact:
+                scores = self.vectors[:self.count] @ vector
+                ids = self.ids[:self.count]
+            else:
+                rows = self._candidate_rows(vector, nprobe or self.nprobe)
+                scores = self.vectors[rows] @ vector
+                ids = self.ids[rows]
+            live = ids >= 0
+            ids, scores = ids[live], scores[live]
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((-ids, -scores))
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def compact(self, min_deleted_ratio=0.25):
+        """
+        Drop tombstoned rows once they make up ``min_deleted_ratio`` of the index
+
+        Returns:
+            bool: Whether the index was compacted
+        """
+        with self.lock:
+            if not self.deleted or self.deleted < min_deleted_ratio * self.count:
+                return False
+            live = np.flatnonzero(self.ids[:self.count] >= 0)
+            self.vectors = self.vectors[live]
+            self.ids = self.ids[live]
+            self.versions = self.versions[live]
+            self.assignments = self.assignments[live]
+            self.count = len(live)
+            self.deleted = 0
+            self.row_by_id = {int(image_id): row for row, image_id in enumerate(self.ids)}
+            if self.centroids is not None:
+                self._build_lists()
+            return True
+
+    def save(self, path, embedder_name):
+        """
+        Write the vectors to ``path`` as raw float32 and the rest of the
+        index to ``path + '.meta'``, each atomically
+        """
+        with self.lock:
+            self.compact()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            self.vectors[:self.count].tofile(tmp_path)
+            os.replace(tmp_path, path)
+            state = {
+                "format": _INDEX_FORMAT,
+                "embedder": embedder_name,
+                "dimensions": self.dimensions,
+                "count": self.count,
+                "ids": self.ids[:self.count],
+                "versions": self.versions[:self.count],
+                "assignments": self.assignments[:self.count],
+                "centroids": self.centroids,
+                "trained_rows": self.trained_rows,
+                "watermark": self.watermark,
+                "deletions": self.deletions,
+            }
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path + ".meta")
+
+    @classmethod
+    def load(cls, path, embedder_name, dimensions, **options):
+        """
+        Read an index written by save(), or return None if it is missing,
+        unreadable or built with another embedder
+        """
+        try:
+            with open(path + ".meta", "rb") as f:
+                state = pickle.load(f)
+            vectors = np.fromfile(path, dtype=np.float32)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if (state.get("format") != _INDEX_FORMAT or state["embedder"] != embedder_name
+                or state["dimensions"] != dimensions or len(vectors) != state["count"] * dimensions):
+            # A save interrupted between the two files also lands here
+            return None
+
+        index = cls(dimensions, **options)
+        index.vectors = vectors.reshape(state["count"], dimensions)
+        index.ids = state["ids"]
+        index.versions = state["versions"]
+        index.assignments = state["assignments"]
+        index.count = state["count"]
+        index.centroids = state["centroids"]
+        index.trained_rows = state["trained_rows"]
+        index.watermark = state["watermark"]
+        index.deletions = state.get("deletions")
+        index.deleted = int(np.count_nonzero(index.ids < 0))
+        index.row_by_id = {int(image_id): row for row, image_id in enumerate(index.ids) if image_id >= 0}
+        if index.centroids is not None:
+            index._build_lists()
+        return index
+
+class SemanticSearchBackend(SyncedIndexBackend, SearchBackend):
+    """
+    Search image text by meaning with a vector index kept in sync with the
+    images table, see search_index.SyncedIndexBackend; changed rows are
+    embedded ``batch_size`` at a time
+
+    With ``build`` False the backend never embeds library rows: refresh
+    reloads the index file when a builder has saved a newer one, so
+    searches in the app never wait on embedding calls.
+    """
+    name = "semantic"
+    columns = ("object_name", "description")
+
+    def __init__(self, embedder=None, path=SEMANTIC_INDEX_PATH, batch_size=1000, min_score=MIN_SCORE,
+                 max_results=MAX_RESULTS, build=True, **options):
+        super().__init__(path, batch_size=batch_size, **options)
+        self.embedder = embedder or get_embedder()
+        self.min_score = min_score
+        self.max_results = max_results
+        self.build = build
+        self.loaded_mtime = self._saved_mtime()
+        self.index = (VectorIndex.load(path, self.embedder.name, self.embedder.dimensions)
+                      or VectorIndex(self.embedder.dimensions))
+        self._query_vectors = functools.lru_cache(maxsize=256)(self._embed_query)
+
+    def _saved_mtime(self):
+        try:
+            # save() replaces the .meta file last
+            return os.stat(self.path + ".meta").st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self, force=False):
+        """
+        Embed new and changed rows, or without ``build`` reload the index
+        if a builder saved a newer one
+
+        Returns:
+            int: Number of rows (re-)embedded or, after a reload, in the index
+        """
+        if self.build:
+            return super().refresh(force)
+        if not force and time.monotonic() - self.last_refresh < self.refresh_interval:
+            return 0
+        with self.refresh_lock:
+            self.last_refresh = time.monotonic()
+            mtime = self._saved_mtime()
+            if mtime is None or mtime == self.loaded_mtime:
+                return 0
+            index = VectorIndex.load(self.path, self.embedder.name, self.embedder.dimensions)
+            if index is None:
+                logger.warning("Semantic index at %s was not built with %s; run the build with the same "
+                               "SEMANTIC_EMBEDDER", self.path, self.embedder.name)
+                self.loaded_mtime = mtime
+                return 0
+            self.index = index
+            self.loaded_mtime = mtime
+            return len(index)
+
+    def indexed_count(self):
+        """
+        Number of images in the index, after picking up a newer saved one
+
+        Returns:
+            int
+        """
+        self.refresh()
+        return len(self.index)
+
+    def _embed_query(self, query):
+        return self.embedder.embed([query])[0]
+
+    def _apply_rows(self, rows):
+        texts = [document_text(row.object_name, row.description) for row in rows]
+        self.index.add([row.id for row in rows], self.embedder.embed(texts),
+                       [_version_of(row.processed_at) for row in rows])
+
+    def _remove_ids(self, image_ids):
+        for image_id in image_ids:
+            self.index.remove(image_id)
+
+    def _serialize(self):
+        self.index.save(self.path, self.embedder.name)
+        self.loaded_mtime = self._saved_mtime()
+
+    def _hits(self, query):
+        self.refresh()
+        hits = self.index.search(self._query_vectors(query), self.max_results)
+        return [(image_id, score) for image_id, score in hits if score >= self.min_score]
+
+    def search(self, query, limit=None):
+        import database as db
+
+        hits = self._hits(query)
+        if limit is not None:
+            hits = hits[:limit]
+        return db.get_images_by_ids([image_id for image_id, _ in hits])
+
+    def search_page(self, query, cursor=None, page_size=50):
+        import database as db
+
+        hits = self._hits(query)
+        total = len(hits)
+        if cursor is not None:
+            # Hits are ordered by (score, id) descending, like the keyset cursor
+            after_score, after_id = cursor
+            hits = [(image_id, score) for image_id, score in hits if (score, image_id) < (after_score, after_id)]
+        next_cursor = None
+        if len(hits) > page_size:
+            hits = hits[:page_size]
+            image_id, score = hits[-1]
+            next_cursor = (score, image_id)
+        rows = db.get_image_rows_by_ids([image_id for image_id, _ in hits])
+        return rows, next_cursor, total
+
+    def match_ids(self, query):
+        return [image_id for image_id, _ in self._hits(query)]
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_semantic_backend():
+    """
+    Get the process-wide semantic search backend, which reads the index
+    saved by the builder (see SemanticSearchBackend)
+    """
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            _backend = SemanticSearchBackend(build=False)
+        return _backend
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m semantic_search", description="Manage the semantic search index")
+    parser.add_argument("command", choices=["build"], help="Embed images not yet in the index and save it")
+    parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    from migrations import migrate
+    migrate()
+    backend = SemanticSearchBackend()
+    start = time.time()
+    embedded = backend.refresh(force=True)
+    if backend.unsaved_changes:
+        backend.save()
+    logger.info("Embedded %d images with %s in %.1fs; %d in the index",
+                embedded, backend.embedder.name, time.time() - start, len(backend.index))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Typeahead suggestions for object names and camera makes and models
+
+SuggestionIndex keeps, per field, the distinct values with the number of
+images having each, and a sorted array of lowercase keys: the whole value
+and every tail starting at a word, so "wat" suggests "Pocket watch". A
+prefix is located by binary search and the matching values are ranked by
+image count with numpy, which takes well under a millisecond for any
+prefix. Suggester keeps the index in sync with the images table like the
+search indexes do; counts are adjusted as images are added or re-analyzed.
+"""
+import os
+import re
+import pickle
+import bisect
+import threading
+from array import array
+import numpy as np
+from search_index import SyncedIndexBackend, _version_of
+
+SUGGESTION_INDEX_PATH = os.environ.get(
+    "SUGGESTION_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "suggestion_index.pkl")
+)
+
+SUGGESTION_FIELDS = ("object_name", "camera_make", "camera_model")
+
+_INDEX_FORMAT = 1
+_WORD_START_RE = re.compile(r"(?<![a-z0-9])[a-z0-9]")
+
+def _keys_for(value):
+    # The whole value and each tail starting at a word, lowercased
+    lowered = value.lower()
+    return {lowered[match.start():] for match in _WORD_START_RE.finditer(lowered)} | {lowered}
+
+class SuggestionIndex:
+    """
+    Distinct field values with image counts, searchable by prefix
+
+    Values are dictionary encoded per field; code 0 stands for images
+    without a value. The sorted key arrays are rebuilt lazily when new
+    distinct values appear, which is rare once a library is analyzed.
+    """
+    def __init__(self):
+        self.values = {field: [None] for field in SUGGESTION_FIELDS}           # code -> value
+        self.code_of = {field: {} for field in SUGGESTION_FIELDS}              # value -> code
+        self.counts = {field: np.zeros(1, dtype=np.int64) for field in SUGGESTION_FIELDS}
+        self.keys = {field: [] for field in SUGGESTION_FIELDS}                 # sorted lowercase keys
+        self.key_codes = {field: np.zeros(0, dtype=np.int64) for field in SUGGESTION_FIELDS}
+        self.dirty = {field: False for field in SUGGESTION_FIELDS}
+        self.image_codes = {field: array('i') for field in SUGGESTION_FIELDS}  # row -> code
+        self.versions = array('d')                                             # row -> processed_at
+        self.row_by_id = {}
+        self.watermark = None              # newest processed_at loaded from the database
+        self.deletions = None              # images table delete count when last pruned
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.versions)
+
+    def version_of(self, image_id):
+        """
+        Return the version loaded for an image, or None if it is not indexed
+        """
+        row = self.row_by_id.get(image_id)
+        return None if row is None else self.versions[row]
+
+    def image_ids(self):
+        """
+        Return the ids of every indexed image
+        """
+        with self.lock:
+            return list(self.row_by_id)
+
+    def _code(self, field, value):
+        if value is None or not value.strip():
+            return 0
+        code = self.code_of[field].get(value)
+        if code is None:
+            code = len(self.values[field])
+            self.values[field].append(value)
+            self.code_of[field][value] = code
+            if code >= len(self.counts[field]):
+                grown = np.zeros(max(16, 2 * len(self.counts[field])), dtype=np.int64)
+                grown[:len(self.counts[field])] = self.counts[field]
+                self.counts[field] = grown
+            self.dirty[field] = True
+        return code
+
+    def add_rows(self, rows):
+        """
+        Add or update images from rows with id, processed_at and the
+        suggestion fields, adjusting the value counts
+        """
+        with self.lock:
+            for row in rows:
+                index = self.row_by_id.get(row.id)
+                if index is None:
+                    index = len(self.versions)
+                    self.row_by_id[row.id] = index
+                    self.versions.append(0.0)
+                    for field in SUGGESTION_FIELDS:
+                        self.image_codes[field].append(0)
+                self.versions[index] = _version_of(row.processed_at)
+                for field in SUGGESTION_FIELDS:
+                    old = self.image_codes[field][index]
+                    new = self._code(field, getattr(row, field))
+                    if old != new:
+                        self.counts[field][old] -= 1
+                        self.counts[field][new] += 1
+                        self.image_codes[field][index] = new
+
+    def remove_rows(self, image_ids):
+        """
+        Drop images from the index, adjusting the value counts
+        """
+        with self.lock:
+            removed = {self.row_by_id[image_id] for image_id in image_ids if image_id in self.row_by_id}
+            if not removed:
+                return
+            for field in SUGGESTION_FIELDS:
+                for row in removed:
+                    self.counts[field][self.image_codes[field][row]] -= 1
+            # Row numbers follow insertion order, so renumber the rows kept
+            kept = [(image_id, row) for image_id, row in self.row_by_id.items() if row not in removed]
+            self.versions = array('d', (self.versions[row] for _, row in kept))
+            self.image_codes = {field: array('i', (codes[row] for _, row in kept))
+                                for field, codes in self.image_codes.items()}
+            self.row_by_id = {image_id: row for row, (image_id, _) in enumerate(kept)}
+
+    def _build_keys(self, field):
+        pairs = sorted((key, code) for code, value in enumerate(self.values[field]) if value is not None
+                       for key in _keys_for(value))
+        self.keys[field] = [key for key, _ in pairs]
+        self.key_codes[field] = np.array([code for _, code in pairs], dtype=np.int64)
+        self.dirty[field] = False
+
+    def suggest(self, prefix, limit=5, fields=SUGGESTION_FIELDS):
+        """
+        Find the most common values with a word starting with ``prefix``
+
+        Args:
+            prefix: Text typed so far (case-insensitive)
+            limit: Maximum number of suggestions
+            fields: Fields to suggest from
+
+        Returns:
+            list: (field, value, image count) tuples, most common first
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        suggestions = []
+        with self.lock:
+            for field in fields:
+                if self.dirty[field]:
+                    self._build_keys(field)
+                keys = self.keys[field]
+                start = bisect.bisect_left(keys, prefix)
+                end = bisect.bisect_left(keys, prefix + "\uffff", start)
+                if start == end:
+                    continue
+                codes = np.unique(self.key_codes[field][start:end])
+                counts = self.counts[field][codes]
+                if len(codes) > limit:
+                    top = np.argpartition(-counts, limit - 1)[:limit]
+                    codes, counts = codes[top], counts[top]
+                suggestions.extend((field, self.values[field][code], int(count))
+                                   for code, count in zip(codes, counts) if count > 0)
+        suggestions.sort(key=lambda suggestion: (-suggestion[2], suggestion[1].lower()))
+        return suggestions[:limit]
+
+    def save(self, path):
+        """
+        Write the index to ``path`` atomically
+        """
+        with self.lock:
+            state = {
+                "format": _INDEX_FORMAT,
+                "values": self.values,
+                "counts": self.counts,
+                "image_codes": self.image_codes,
+                "versions": self.versions,
+                "ids": list(self.row_by_id),
+                "watermark": self.watermark,
+                "deletions": self.deletions,
+            }
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save(), or return None if it is missing or unreadable
+        """
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if state.get("format") != _INDEX_FORMAT:
+            return None
+
+        index = cls()
+        index.values = state["values"]
+        index.code_of = {field: {value: code for code, value in enumerate(values) if value is not None}
+                         for field, values in index.values.items()}
+        index.counts = state["counts"]
+        index.image_codes = state["image_codes"]
+        index.versions = state["versions"]
+        # Rows were numbered in insertion order, which dicts preserve
+        index.row_by_id = {image_id: row for row, image_id in enumerate(state["ids"])}
+        index.watermark = state["watermark"]
+        index.deletions = state.get("deletions")
+        index.dirty = {field: True for field in SUGGESTION_FIELDS}
+        return index
+
+class Suggester(SyncedIndexBackend):
+    """
+    A SuggestionIndex kept in sync with the images table, see
+    search_index.SyncedIndexBackend
+    """
+    columns = SUGGESTION_FIELDS
+
+    def __init__(self, path=SUGGESTION_INDEX_PATH, **options):
+        super().__init__(path, **options)
+        self.index = SuggestionIndex.load(path) or SuggestionIndex()
+
+    def _apply_rows(self, rows):
+        self.index.add_rows(rows)
+
+    def _remove_ids(self, image_ids):
+        self.index.remove_rows(image_ids)
+
+    def _serialize(self):
+        self.index.save(self.path)
+
+    def suggest(self, prefix, limit=5, fields=SUGGESTION_FIELDS):
+        """
+        Refresh the index and run SuggestionIndex.suggest
+        """
+        self.refresh()
+        return self.index.suggest(prefix, limit, fields)
+
+_suggester = None
+_suggester_lock = threading.Lock()
+
+def get_suggester():
+    """
+    Get the process-wide Suggester
+    """
+    global _suggester
+    import database as db
+
+    with _suggester_lock:
+        if _suggester is None:
+            _suggester = Suggester()
+            db.add_image_write_listener(_suggester.mark_stale)
+        return _suggester
@@ -0,0 +1,28 @@
+"""
+Shared fixtures: each test runs against its own freshly migrated SQLite
+database
+"""
+import pytest
+
+import database as db
+from migrations import migrate
+
+def _reset_engine():
+    db.remove_session()
+    if db._engine is not None:
+        db._engine.dispose()
+    db._engine = None
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Point the database module at a new SQLite file with the current schema
+    """
+    monkeypatch.setattr(db, "DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    # Results and the stored generation cached by an earlier test's database
+    monkeypatch.setattr(db, "_stored_generation_checked_at", None)
+    db.search_cache.clear()
+    _reset_engine()
+    migrate()
+    yield db
+    _reset_engine()
@@ -0,0 +1,54 @@
+"""
+Migrations runner: applies each version once, in order, under the lock
+"""
+import threading
+import sqlalchemy as sa
+
+import migrations
+
+def test_fresh_database_is_fully_migrated(database):
+    versions = [version for version, _ in migrations.MIGRATIONS]
+    assert migrations.get_applied_versions() == set(versions)
+    assert migrations.migrate() == []
+
+def test_schema_matches_the_models(database):
+    inspector = sa.inspect(database.get_engine())
+    for table in database.Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert columns == {column.name for column in table.columns}, table.name
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes, table.name
+
+def test_pending_migrations_are_applied(database):
+    with database.get_engine().begin() as conn:
+        conn.execute(migrations.schema_migrations.delete().where(migrations.schema_migrations.c.version >= 7))
+
+    assert migrations.migrate() == [7, 8]
+    assert migrations.migrate() == []
+
+def test_concurrent_runs_apply_each_migration_once(tmp_path, monkeypatch):
+    import database as db
+
+    monkeypatch.setattr(db, "DATABASE_URL", f"sqlite:///{tmp_path / 'concurrent.db'}")
+    db.remove_session()
+    db._engine = None
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(migrations.migrate())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert errors == []
+        applied = sorted(version for result in results for version in result)
+        assert applied == [version for version, _ in migrations.MIGRATIONS]
+    finally:
+        db._engine.dispose()
+        db._engine = None
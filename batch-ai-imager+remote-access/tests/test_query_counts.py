@@ -0,0 +1,47 @@
+"""
+Page data paths must issue the same number of statements however many
+rows the tables hold, see benchmark.py queries
+"""
+import pytest
+
+import search_index
+from benchmark import StatementCounter, _seed_page_data, _page_data_paths
+
+PER_FOLDER = 10
+
+def _count_statements(db, folders):
+    with db.session_scope() as session:
+        for model in (db.FavoriteImage, db.Image, db.Folder):
+            session.query(model).delete()
+    image_ids = _seed_page_data(db, folders, PER_FOLDER)
+    # Seeded with bulk operations, which do not invalidate cached results
+    db.bump_write_generation()
+    backend = search_index.get_search_backend()
+    if hasattr(backend, "refresh"):
+        backend.refresh(force=True)
+
+    counts = {}
+    for name, fn in _page_data_paths(db, image_ids).items():
+        # One session per page render, as with with_session_scope
+        with db.session_scope(), StatementCounter(db.engine) as counter:
+            fn()
+        counts[name] = counter.count
+    return counts
+
+@pytest.mark.parametrize("backend", ["database", "index"])
+def test_page_statements_do_not_grow_with_rows(database, tmp_path, monkeypatch, backend):
+    if backend == "index":
+        search_backend = search_index.InvertedIndexBackend(path=str(tmp_path / "search_index.pkl"))
+    else:
+        search_backend = search_index.DatabaseSearchBackend()
+    monkeypatch.setattr(search_index, "_backend", search_backend)
+    # Read the stored generation once now rather than inside a counted render
+    monkeypatch.setattr(database, "WRITE_GENERATION_POLL_SECONDS", float("inf"))
+    database.get_write_generation()
+
+    small = _count_statements(database, 10)
+    large = _count_statements(database, 100)
+
+    assert set(small) == set(large)
+    for name in small:
+        assert small[name] == large[name], f"{name}: {small[name]} statements for 100 images, {large[name]} for 1000"
@@ -0,0 +1,61 @@
+"""
+Work queue: claiming, lease renewal and release of job items
+"""
+import datetime
+
+def _queue(db, count=3):
+    folder = db.add_folder("queue", "/queue")
+    return db.create_processing_job(folder.id, "queue", [f"/queue/img_{i}.jpg" for i in range(count)])
+
+def _expire_leases(db):
+    with db.session_scope() as session:
+        session.query(db.JobItem).update(
+            {db.JobItem.updated_at: datetime.datetime.utcnow() - datetime.timedelta(hours=1)},
+            synchronize_session=False
+        )
+
+def test_claim_takes_each_item_once(database):
+    job = _queue(database, 3)
+
+    first = database.claim_job_items("worker-a", limit=2)
+    second = database.claim_job_items("worker-b", limit=2)
+
+    assert len(first) == 2 and len(second) == 1
+    assert not {item.id for item in first} & {item.id for item in second}
+    assert database.claim_job_items("worker-c") == []
+    assert {item.state for item in first + second} == {database.ITEM_IN_FLIGHT}
+    assert database.get_processing_job(job.id).status == database.JOB_RUNNING
+
+def test_renewed_items_are_not_released(database):
+    _queue(database, 2)
+    items = database.claim_job_items("worker-a")
+    _expire_leases(database)
+
+    assert database.renew_job_items(items[0].claim_token) == 2
+    assert database.release_stale_job_items(lease_seconds=60) == 0
+
+def test_stale_items_are_released_and_reclaimed(database):
+    _queue(database, 2)
+    stale = database.claim_job_items("worker-a")
+    _expire_leases(database)
+
+    assert database.release_stale_job_items(lease_seconds=60) == 2
+    assert database.renew_job_items(stale[0].claim_token) == 0
+
+    reclaimed = database.claim_job_items("worker-b")
+    assert {item.id for item in reclaimed} == {item.id for item in stale}
+    assert all(item.attempts == 2 for item in reclaimed)
+
+def test_lost_lease_does_not_overwrite_new_owner(database):
+    _queue(database, 1)
+    [stale] = database.claim_job_items("worker-a")
+    _expire_leases(database)
+    database.release_stale_job_items(lease_seconds=60)
+    [current] = database.claim_job_items("worker-b")
+
+    assert database.mark_job_item_failed(stale.id, "timed out", claim_token=stale.claim_token) == 0
+    assert database.mark_job_item_done(current.id, "analyzed", claim_token=current.claim_token) == 1
+
+    [item] = database.get_job_items(current.job_id)
+    assert item.state == database.ITEM_DONE
+    assert item.error is None
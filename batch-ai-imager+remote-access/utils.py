@@ -1,6 +1,9 @@
 import os
 import json
+import fnmatch
+import hashlib
 import datetime
+import threading
 from PIL import Image
 from pillow_heif import register_heif_opener
 import exifread
@@ -8,55 +11,207 @@ import exifread
 # Register the HEIF opener to support HEIC format
 register_heif_opener()
 
-def is_valid_image(file_path):
+# Supported image extensions
+SUPPORTED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.heic', '.heif']
+
+# Leading bytes of each supported format; checking these is far cheaper
+# than opening the image
+IMAGE_SIGNATURES = [
+    (0, b'\xff\xd8\xff'),            # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),       # PNG
+    (0, b'GIF87a'),
+    (0, b'GIF89a'),
+    (0, b'BM'),                         # BMP
+    (8, b'WEBP'),                       # RIFF....WEBP
+    (4, b'ftyp'),                       # HEIC/HEIF (ISO base media)
+]
+_SIGNATURE_BYTES = 16
+
+# Per-run memo of probe results keyed by (path, mtime, size), so the directory
+# listing, validation and metadata extraction share one open per file
+_probe_cache = {}
+_probe_cache_lock = threading.Lock()
+_PROBE_CACHE_MAX_ENTRIES = 100000
+
+def clear_probe_cache():
     """
-    Check if a file is a valid image supported by the application
+    Forget all memoized probe results
+    """
+    with _probe_cache_lock:
+        _probe_cache.clear()
+
+def probe_image(file_path, use_cache=True):
+    """
+    Open an image once and read everything the pipeline needs from it
+    
+    Args:
+        file_path (str): Path to the image file
+        use_cache (bool): Reuse a previous probe if the file is unchanged
+        
+    Returns:
+        dict: 'valid', 'width', 'height', 'format', 'file_size', 'file_mtime'
+        and 'exif' (camera, date, exposure and GPS fields)
     """
-    # Supported image extensions
-    supported_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.heic', '.heif']
+    probe = {
+        'valid': False,
+        'width': 0,
+        'height': 0,
+        'format': None,
+        'file_size': 0,
+        'file_mtime': None,
+        'exif': {},
+    }
     
-    # Check file extension
+    # Check file extension before touching the file
     file_ext = os.path.splitext(file_path)[1].lower()
-    if file_ext not in supported_extensions:
-        return False
+    if file_ext not in SUPPORTED_EXTENSIONS:
+        return probe
+    
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return probe
+    
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if use_cache:
+        with _probe_cache_lock:
+            cached = _probe_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    probe['file_size'] = stat.st_size
+    probe['file_mtime'] = stat.st_mtime
     
-    # Try to open the image to validate it
     try:
-        with Image.open(file_path) as img:
-            # Verify it's an image by accessing its properties
-            img.size
-            return True
+        with open(file_path, 'rb') as f:
+            # Header parse only; pixel data is not decoded
+            with Image.open(f) as img:
+                probe['width'], probe['height'] = img.size
+                probe['format'] = img.format
+            probe['valid'] = True
+            
+            # Read EXIF from the same file handle
+            f.seek(0)
+            try:
+                probe['exif'] = _parse_exif_tags(exifread.process_file(f, details=False))
+            except Exception:
+                probe['exif'] = {}
     except Exception:
+        probe['valid'] = False
+    
+    if use_cache:
+        with _probe_cache_lock:
+            if len(_probe_cache) >= _PROBE_CACHE_MAX_ENTRIES:
+                _probe_cache.clear()
+            _probe_cache[key] = probe
+    
+    return probe
+
+def is_valid_image(file_path):
+    """
+    Check if a file is a valid image supported by the application
+    """
+    return probe_image(file_path)['valid']
+
+def has_image_signature(file_path):
+    """
+    Check a file's leading bytes against the supported image formats
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(_SIGNATURE_BYTES)
+    except OSError:
         return False
+    return any(header[offset:offset + len(magic)] == magic for offset, magic in IMAGE_SIGNATURES)
 
-def get_all_image_files(folder_path):
+def _matches_any(rel_path, name, patterns):
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+def iter_image_files(folder_path, include=None, exclude=None, max_depth=None,
+                     check_signature=True, follow_symlinks=False):
     """
-    Get a list of all valid image files in a folder
+    Walk a folder tree and lazily yield candidate image files
+    
+    Files are checked by extension and magic bytes only; images are not
+    opened, so callers can start processing as soon as the first file is
+    found. Directories are visited in sorted order.
+    
+    Args:
+        folder_path (str): Root folder to scan
+        include (list): Glob patterns a file must match, against its path
+            relative to the root or its name (e.g. '*.jpg', '2024/*')
+        exclude (list): Glob patterns for files and directories to skip
+        max_depth (int): 0 scans only the root folder; None is unlimited
+        check_signature (bool): Also verify the file's magic bytes
+        follow_symlinks (bool): Descend into symlinked directories
+        
+    Yields:
+        str: Path of each candidate image file
     """
-    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-        return []
+    if not os.path.isdir(folder_path):
+        return
     
-    image_files = []
+    include = list(include or [])
+    exclude = list(exclude or [])
     
-    # Go through all files in the folder
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
+    # Explicit stack of (directory, depth, relative path) instead of recursion
+    stack = [(folder_path, 0, '')]
+    while stack:
+        directory, depth, rel_dir = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if exclude and _matches_any(rel_path, entry.name, exclude):
+                continue
+            
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if max_depth is None or depth < max_depth:
+                        subdirs.append((entry.path, depth + 1, rel_path))
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            
+            if os.path.splitext(entry.name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            if include and not _matches_any(rel_path, entry.name, include):
+                continue
+            if check_signature and not has_image_signature(entry.path):
+                continue
+            yield entry.path
         
-        # Check if it's a file and a valid image
-        if os.path.isfile(file_path) and is_valid_image(file_path):
-            image_files.append(file_path)
+        # Reversed so subdirectories are popped in sorted order
+        stack.extend(reversed(subdirs))
+
+def get_all_image_files(folder_path, recursive=False, include=None, exclude=None, max_depth=None):
+    """
+    Get a list of all image files in a folder
     
-    return image_files
+    Args:
+        folder_path (str): Folder to scan
+        recursive (bool): Include images in subfolders
+        include (list): Glob patterns files must match
+        exclude (list): Glob patterns for files and directories to skip
+        max_depth (int): Subfolder depth limit when recursive
+    """
+    if not recursive:
+        max_depth = 0
+    return list(iter_image_files(folder_path, include=include, exclude=exclude, max_depth=max_depth))
 
 def get_image_dimensions(file_path):
     """
     Get the dimensions of an image
     """
-    try:
-        with Image.open(file_path) as img:
-            return img.size
-    except Exception:
-        return (0, 0)
+    probe = probe_image(file_path)
+    return (probe['width'], probe['height'])
 
 def get_file_size(file_path):
     """
@@ -67,6 +222,23 @@ def get_file_size(file_path):
     except Exception:
         return 0
 
+def compute_file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    Compute a content hash of a file, used to recognise the same image at different paths
+    
+    Args:
+        file_path (str): Path to the file
+        chunk_size (int): Bytes read per iteration
+        
+    Returns:
+        str: Hex-encoded BLAKE2b digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def extract_image_metadata(file_path):
     """
     Extract metadata from an image file
@@ -82,6 +254,7 @@ def extract_image_metadata(file_path):
         'height': 0,
         'file_size': 0,
         'file_type': '',
+        'file_mtime': None,
         'camera_make': '',
         'camera_model': '',
         'date_taken': None,
@@ -94,78 +267,17 @@ def extract_image_metadata(file_path):
     }
     
     try:
-        # Basic file information
-        metadata['file_size'] = get_file_size(file_path)
+        # Basic file information, dimensions and EXIF from a single probe
+        probe = probe_image(file_path)
+        metadata['file_size'] = probe['file_size'] or get_file_size(file_path)
+        metadata['file_mtime'] = probe['file_mtime']
         _, ext = os.path.splitext(file_path)
         metadata['file_type'] = ext.lower().replace('.', '')
         
-        # Get image dimensions
-        width, height = get_image_dimensions(file_path)
-        metadata['width'] = width
-        metadata['height'] = height
+        metadata['width'] = probe['width']
+        metadata['height'] = probe['height']
+        metadata.update(probe['exif'])
         
-        # Extract EXIF data
-        with open(file_path, 'rb') as f:
-            exif_tags = exifread.process_file(f, details=False)
-            
-            # Camera information
-            if 'Image Make' in exif_tags:
-                metadata['camera_make'] = str(exif_tags['Image Make'])
-            
-            if 'Image Model' in exif_tags:
-                metadata['camera_model'] = str(exif_tags['Image Model'])
-            
-            # Date information
-            if 'EXIF DateTimeOriginal' in exif_tags:
-                date_str = str(exif_tags['EXIF DateTimeOriginal'])
-                try:
-                    # Convert date string to datetime object
-                    metadata['date_taken'] = datetime.datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                except ValueError:
-                    pass
-            
-            # Camera settings
-            if 'EXIF FocalLength' in exif_tags:
-                try:
-                    focal_length_raw = str(exif_tags['EXIF FocalLength'])
-                    if '/' in focal_length_raw:
-                        num, denom = map(float, focal_length_raw.split('/'))
-                        metadata['focal_length'] = num / denom if denom != 0 else None
-                    else:
-                        metadata['focal_length'] = float(focal_length_raw)
-                except:
-                    pass
-            
-            if 'EXIF ExposureTime' in exif_tags:
-                metadata['exposure_time'] = str(exif_tags['EXIF ExposureTime'])
-            
-            if 'EXIF FNumber' in exif_tags:
-                try:
-                    aperture_raw = str(exif_tags['EXIF FNumber'])
-                    if '/' in aperture_raw:
-                        num, denom = map(float, aperture_raw.split('/'))
-                        metadata['aperture'] = num / denom if denom != 0 else None
-                    else:
-                        metadata['aperture'] = float(aperture_raw)
-                except:
-                    pass
-            
-            if 'EXIF ISOSpeedRatings' in exif_tags:
-                try:
-                    metadata['iso_speed'] = int(str(exif_tags['EXIF ISOSpeedRatings']))
-                except:
-                    pass
-            
-            # GPS information
-            gps_latitude = _get_gps_coord(exif_tags, 'GPS GPSLatitude', 'GPS GPSLatitudeRef')
-            gps_longitude = _get_gps_coord(exif_tags, 'GPS GPSLongitude', 'GPS GPSLongitudeRef')
-            
-            if gps_latitude is not None:
-                metadata['gps_latitude'] = gps_latitude
-            
-            if gps_longitude is not None:
-                metadata['gps_longitude'] = gps_longitude
-            
         # Generate a complete metadata JSON
         full_metadata = {**metadata}
         for key, value in metadata.items():
@@ -179,6 +291,72 @@ def extract_image_metadata(file_path):
     
     return metadata
 
+def _parse_exif_tags(exif_tags):
+    """
+    Convert exifread tags into the metadata fields stored for each image
+    """
+    fields = {}
+    
+    # Camera information
+    if 'Image Make' in exif_tags:
+        fields['camera_make'] = str(exif_tags['Image Make'])
+    
+    if 'Image Model' in exif_tags:
+        fields['camera_model'] = str(exif_tags['Image Model'])
+    
+    # Date information
+    if 'EXIF DateTimeOriginal' in exif_tags:
+        date_str = str(exif_tags['EXIF DateTimeOriginal'])
+        try:
+            # Convert date string to datetime object
+            fields['date_taken'] = datetime.datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            pass
+    
+    # Camera settings
+    if 'EXIF FocalLength' in exif_tags:
+        try:
+            focal_length_raw = str(exif_tags['EXIF FocalLength'])
+            if '/' in focal_length_raw:
+                num, denom = map(float, focal_length_raw.split('/'))
+                fields['focal_length'] = num / denom if denom != 0 else None
+            else:
+                fields['focal_length'] = float(focal_length_raw)
+        except:
+            pass
+    
+    if 'EXIF ExposureTime' in exif_tags:
+        fields['exposure_time'] = str(exif_tags['EXIF ExposureTime'])
+    
+    if 'EXIF FNumber' in exif_tags:
+        try:
+            aperture_raw = str(exif_tags['EXIF FNumber'])
+            if '/' in aperture_raw:
+                num, denom = map(float, aperture_raw.split('/'))
+                fields['aperture'] = num / denom if denom != 0 else None
+            else:
+                fields['aperture'] = float(aperture_raw)
+        except:
+            pass
+    
+    if 'EXIF ISOSpeedRatings' in exif_tags:
+        try:
+            fields['iso_speed'] = int(str(exif_tags['EXIF ISOSpeedRatings']))
+        except:
+            pass
+    
+    # GPS information
+    gps_latitude = _get_gps_coord(exif_tags, 'GPS GPSLatitude', 'GPS GPSLatitudeRef')
+    gps_longitude = _get_gps_coord(exif_tags, 'GPS GPSLongitude', 'GPS GPSLongitudeRef')
+    
+    if gps_latitude is not None:
+        fields['gps_latitude'] = gps_latitude
+    
+    if gps_longitude is not None:
+        fields['gps_longitude'] = gps_longitude
+    
+    return fields
+
 def _get_gps_coord(exif_tags, coord_tag, ref_tag):
     """
     Convert GPS coordinates from EXIF format to decimal degrees
@@ -0,0 +1,335 @@
+"""
+Background worker that drains the image processing queue
+
+Run one or more workers, on any number of hosts that share the database:
+
+    python worker.py --concurrency 8
+
+The Streamlit app only enqueues jobs; workers claim pending job items,
+analyze them and record the results. One worker on the app's host should
+also run with --semantic-index to embed new images for "Similar meaning"
+search, which the app only reads.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import threading
+import argparse
+import database as db
+from image_processor import process_single_image, iter_process_images, DEFAULT_MAX_WORKERS
+from utils import compute_file_hash, extract_image_metadata
+from folder_sync import file_matches_record
+
+logger = logging.getLogger("worker")
+
+# Set by SIGINT/SIGTERM so the current batch can finish cleanly
+_stop_requested = False
+
+def save_image_result(writer=None, item=None, cache=False, **row):
+    """
+    Store one analysis result, through ``writer`` when batching writes
+
+    With ``cache``, the analysis is also stored under the row's content
+    hash for identical files, after (or, through ``writer``, together with)
+    the image row. ``item`` tags the row in the writer.
+    """
+    if writer is not None:
+        writer.add(item=item, cache=cache, **row)
+        return
+    db.add_image_result(**row)
+    if cache and row.get('content_hash'):
+        db.add_cached_analysis(row['content_hash'], row['object_name'], row['description'], row['confidence'])
+
+def reuse_existing_analysis(folder_id, img_path, check_stored=True, writer=None, item=None):
+    """
+    Reuse a stored or cached analysis for an image instead of calling OpenAI
+
+    Args:
+        folder_id: ID of the folder the image belongs to
+        img_path: Full path to the image file
+        check_stored: Skip images already in the database and unchanged on disk
+        writer: Optional db.ImageResultWriter to buffer the database write
+        item: Tag for the buffered row, see db.ImageResultWriter.add
+
+    Returns:
+        tuple: (source, content_hash) where source is 'stored' (already in the
+        database), 'cache' (identical file analyzed before) or None if the
+        image still needs to be analyzed
+    """
+    if check_stored:
+        stored = db.get_image_by_path(img_path)
+        if stored and file_matches_record(stored.file_size, stored.file_mtime, os.stat(img_path)):
+            return 'stored', None
+
+    try:
+        content_hash = compute_file_hash(img_path)
+        cached = db.get_cached_analysis(content_hash)
+    except Exception:
+        return None, None
+
+    if not cached:
+        return None, content_hash
+
+    # Link this path to the existing analysis without calling OpenAI
+    save_image_result(
+        writer,
+        item=item,
+        folder_id=folder_id,
+        file_name=os.path.basename(img_path),
+        file_path=img_path,
+        object_name=cached.object_name,
+        description=cached.description,
+        confidence=cached.confidence,
+        metadata=extract_image_metadata(img_path),
+        content_hash=content_hash
+    )
+    return 'cache', content_hash
+
+def store_analysis(folder_id, img_path, result, content_hash=None, writer=None, item=None):
+    """
+    Save a fresh analysis and remember it for identical files at other paths
+    """
+    save_image_result(
+        writer,
+        item=item,
+        cache=bool(content_hash),
+        folder_id=folder_id,
+        file_name=os.path.basename(img_path),
+        file_path=img_path,
+        object_name=result.get("object_name", "Unknown"),
+        description=result.get("description", "No description available"),
+        confidence=result.get("confidence", 0),
+        metadata=result.get("metadata", {}),
+        content_hash=content_hash
+    )
+
+def mark_item_done(item, result_source):
+    """
+    Mark a claimed item done, unless its lease was lost to another worker
+    """
+    if not db.mark_job_item_done(item.id, result_source=result_source, claim_token=item.claim_token):
+        logger.warning("Lease lost on %s; leaving it to the worker that reclaimed it", item.file_path)
+
+def mark_item_failed(item, error):
+    """
+    Mark a claimed item failed, unless its lease was lost to another worker
+    """
+    if not db.mark_job_item_failed(item.id, error, claim_token=item.claim_token):
+        logger.warning("Lease lost on %s; leaving it to the worker that reclaimed it", item.file_path)
+
+def process_claimed_items(items, concurrency):
+    """
+    Analyze a batch of claimed job items and record each outcome
+
+    Database access stays on this thread; only the image preparation and
+    OpenAI calls run in the thread pool. Image rows and cached analyses are
+    written in one bulk upsert at the end of the batch, before any item is
+    marked done; if it fails, every item it covered is marked failed.
+
+    Returns:
+        tuple: (done count, failed count)
+    """
+    # Resolve each job's folder once per batch
+    folder_ids = {}
+    for item in items:
+        if item.job_id not in folder_ids:
+            folder_ids[item.job_id] = db.get_processing_job(item.job_id).folder_id
+
+    failed = 0
+    stored = []    # Items already in the database, with nothing to write
+    sources = {}   # Item id -> result source
+    to_analyze = []
+    content_hashes = {}
+    # No size or time based flushes: the single flush below covers exactly
+    # the items it marks done
+    writer = db.ImageResultWriter(batch_size=None, max_delay=None)
+    for item in items:
+        try:
+            source, content_hashes[item.id] = reuse_existing_analysis(
+                folder_ids[item.job_id], item.file_path, writer=writer, item=item
+            )
+        except Exception as e:
+            logger.warning("Failed %s: %s", item.file_path, e)
+            mark_item_failed(item, e)
+            failed += 1
+            continue
+
+        if source == 'stored':
+            stored.append(item)
+        elif source:
+            sources[item.id] = source
+        else:
+            to_analyze.append(item)
+
+    outcomes = iter_process_images(
+        [item.file_path for item in to_analyze],
+        max_workers=concurrency,
+        process_fn=process_single_image
+    )
+    for index, img_path, result, error in outcomes:
+        item = to_analyze[index]
+        try:
+            if error is not None:
+                raise error
+            store_analysis(folder_ids[item.job_id], img_path, result, content_hashes.get(item.id),
+                           writer=writer, item=item)
+        except Exception as e:
+            logger.warning("Failed %s: %s", img_path, e)
+            mark_item_failed(item, e)
+            failed += 1
+            continue
+
+        sources[item.id] = 'analyzed'
+
+    try:
+        written = writer.flush()
+    except Exception as e:
+        # None of the buffered results were stored
+        unstored = writer.discard()
+        logger.error("Failed to store %d results: %s", len(unstored), e)
+        for item in unstored:
+            mark_item_failed(item, e)
+        failed += len(unstored)
+        written = []
+
+    for item in stored:
+        mark_item_done(item, 'stored')
+    for item in written:
+        mark_item_done(item, sources[item.id])
+
+    for job_id in folder_ids:
+        db.refresh_job_progress(job_id)
+
+    return len(stored) + len(written), failed
+
+class LeaseHeartbeat:
+    """
+    Renew the lease on a claim's items from a background thread while
+    they are processed, so a slow batch is not released to other workers
+    """
+    def __init__(self, claim_token, interval):
+        self.claim_token = claim_token
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                db.renew_job_items(self.claim_token)
+            except Exception as e:
+                logger.warning("Failed to renew item leases: %s", str(e))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        return False
+
+def refresh_semantic_index(backend):
+    """
+    Embed images added or changed since the last refresh, logging rather
+    than raising on failure so analysis carries on
+    """
+    try:
+        embedded = backend.refresh()
+    except Exception as e:
+        logger.warning("Semantic index refresh failed: %s", str(e))
+        return
+    if embedded:
+        logger.info("Embedded %d images for semantic search", embedded)
+
+def run_worker(concurrency=DEFAULT_MAX_WORKERS, batch_size=None, poll_interval=2.0,
+               lease_seconds=900, once=False, semantic_index=False):
+    """
+    Claim and process queued job items until stopped
+
+    Args:
+        concurrency: Images analyzed in parallel by this worker
+        batch_size: Items claimed per round trip (defaults to twice the concurrency)
+        poll_interval: Seconds to wait when the queue is empty
+        lease_seconds: In-flight items whose lease was not renewed for this long
+            are assumed abandoned; leases are renewed every third of it
+        once: Exit when the queue is empty instead of polling
+        semantic_index: Also keep the semantic search index up to date
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    batch_size = batch_size or concurrency * 2
+    logger.info("Worker %s started (concurrency %d)", worker_id, concurrency)
+
+    semantic = None
+    if semantic_index:
+        from semantic_search import SemanticSearchBackend
+        semantic = SemanticSearchBackend()
+        db.add_image_write_listener(semantic.mark_stale)
+
+    while not _stop_requested:
+        if semantic is not None:
+            refresh_semantic_index(semantic)
+
+        released = db.release_stale_job_items(lease_seconds)
+        if released:
+            logger.info("Released %d abandoned items back to the queue", released)
+
+        items = db.claim_job_items(worker_id, batch_size)
+        if not items:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        start = time.time()
+        # Items claimed together share a token; renew it well within the lease
+        with LeaseHeartbeat(items[0].claim_token, lease_seconds / 3):
+            done, failed = process_claimed_items(items, concurrency)
+        elapsed = time.time() - start
+        logger.info("Processed %d items (%d failed) in %.1fs, %.2f images/sec",
+                    done + failed, failed, elapsed, (done + failed) / elapsed if elapsed else 0.0)
+
+    if semantic is not None:
+        refresh_semantic_index(semantic)
+        if semantic.unsaved_changes:
+            semantic.save()
+    logger.info("Worker %s stopped", worker_id)
+
+def _request_stop(signum, frame):
+    global _stop_requested
+    _stop_requested = True
+    logger.info("Stop requested, finishing current batch")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process queued image analysis jobs")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_WORKERS, help="Images analyzed in parallel")
+    parser.add_argument("--batch-size", type=int, default=None, help="Items claimed per round trip")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between polls of an empty queue")
+    parser.add_argument("--lease-seconds", type=int, default=900, help="Requeue in-flight items whose worker stopped renewing them for this long")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    parser.add_argument("--semantic-index", action="store_true",
+                        help="Embed new images for semantic search (run on one worker on the app's host)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    from migrations import migrate
+    migrate()
+
+    signal.signal(signal.SIGINT, _request_stop)
+    signal.signal(signal.SIGTERM, _request_stop)
+
+    run_worker(
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        poll_interval=args.poll_interval,
+        lease_seconds=args.lease_seconds,
+        once=args.once,
+        semantic_index=args.semantic_index
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())